@@ -0,0 +1,66 @@
+"""
+Encode and decode throughput of every JSON codec installed, on documents shaped like typical CouchDB documents
+and _all_docs/_bulk_docs bodies.
+
+  python benchmarks/codecs.py [iterations]
+
+Reports MB/s of encoded JSON for a single document, a _bulk_docs body of 1000 documents and an _all_docs
+response with include_docs of 1000 rows.
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from relaxed.codec import available_codecs, get_codec  # noqa: E402
+
+
+def make_doc(rng, index):
+  return {
+    '_id': f'invoice:{index:08d}',
+    '_rev': f'3-{rng.getrandbits(128):032x}',
+    'type': 'invoice',
+    'customer': {'id': f'customer:{rng.randint(0, 10000):06d}', 'name': f'Customer {index}',
+                 'email': f'billing{index}@example.com', 'country': rng.choice(['CA', 'US', 'FR', 'DE', 'JP'])},
+    'issued': f'2020-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T10:15:00Z',
+    'paid': rng.random() < 0.7,
+    'total': round(rng.uniform(10, 5000), 2),
+    'tags': rng.sample(['urgent', 'export', 'recurring', 'discount', 'café', 'review'], 3),
+    'lines': [{'sku': f'SKU-{rng.randint(0, 99999):05d}', 'quantity': rng.randint(1, 20),
+               'price': round(rng.uniform(1, 250), 2), 'description': 'Widget, standard size / colour ' * 2}
+              for _ in range(0, rng.randint(1, 8))],
+  }
+
+
+def workloads():
+  rng = random.Random(42)
+  docs = [make_doc(rng, index) for index in range(0, 1000)]
+  rows = [{'id': doc['_id'], 'key': doc['_id'], 'value': {'rev': doc['_rev']}, 'doc': doc} for doc in docs]
+  return {
+    'single doc': docs[0],
+    'bulk_docs x1000': {'docs': docs, 'new_edits': True},
+    'all_docs x1000': {'total_rows': 1000, 'offset': 0, 'rows': rows},
+  }
+
+
+def main():
+  iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+  reference = get_codec('json')
+
+  for name, payload in workloads().items():
+    size = len(reference.encode(payload))
+    print(f'{name} ({size / 1024:.1f} KiB)')
+    for codec_name in available_codecs():
+      codec = get_codec(codec_name)
+      encoded = codec.encode(payload)
+      # scale the repetitions so that every workload runs for a comparable time
+      number = max(1, iterations * 1000000 // size)
+      encode = min(timeit.repeat(lambda: codec.encode(payload), number=number, repeat=3)) / number
+      decode = min(timeit.repeat(lambda: codec.decode(encoded), number=number, repeat=3)) / number
+      print(f'  {codec_name:8} encode {size / encode / 1e6:8.1f} MB/s   decode {size / decode / 1e6:8.1f} MB/s')
+
+
+if __name__ == '__main__':
+  main()
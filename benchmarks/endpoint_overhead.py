@@ -0,0 +1,68 @@
+"""
+Micro-benchmark of the per-call overhead added by RelaxedDecorators.endpoint before a request is sent: building
+the URI from its template and validating params/data against AllowedKeys.
+
+  python benchmarks/endpoint_overhead.py [iterations]
+
+"legacy" re-implements the per-call re.sub/key loop that endpoints used before they were compiled into an
+EndpointPlan, "plan" is the compiled path and "trusted" is the compiled path with validation skipped.
+"""
+import os
+import sys
+import timeit
+from re import sub
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from relaxed.core import AllowedKeys, EndpointPlan, InvalidKeysException  # noqa: E402
+
+TEMPLATE = '/:db:/_design/:docid:/_view/:view:'
+SEGMENTS = {'db': 'invoices', 'docid': 'reports', 'view': 'by_customer'}
+PARAMS = {'include_docs': 'true', 'limit': 100, 'startkey': '"a"', 'endkey': '"b"', 'reduce': False}
+
+
+def legacy_process_filter_format(filter_format, filter):
+  if (filter_format is not None):
+    for key in filter.keys():
+      if key not in filter_format:
+        raise InvalidKeysException("The provided filter does not meet the expected format.")
+
+
+def legacy_build_uri(template, segments):
+  def replace_with_segment(matches):
+    if matches.group(1) not in segments:
+      raise Exception('missing segment')
+    return segments[matches.group(1)]
+
+  return sub(r':([\w_]+):', replace_with_segment, template)
+
+
+def legacy():
+  legacy_build_uri(TEMPLATE, SEGMENTS)
+  legacy_process_filter_format(AllowedKeys.VIEW__PARAMS, PARAMS)
+
+
+plan = EndpointPlan(TEMPLATE, query_keys=AllowedKeys.VIEW__PARAMS)
+
+
+def compiled():
+  plan.build_uri(SEGMENTS)
+  plan.validate_params(PARAMS)
+
+
+def trusted():
+  plan.build_uri(SEGMENTS)
+
+
+def main():
+  iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+  baseline = None
+  for name, fn in [('legacy', legacy), ('plan', compiled), ('trusted', trusted)]:
+    best = min(timeit.repeat(fn, number=iterations, repeat=5))
+    per_call = best / iterations * 1e9
+    baseline = baseline or per_call
+    print(f'{name:>8}: {per_call:8.1f} ns/call  ({baseline / per_call:4.2f}x)')
+
+
+if __name__ == '__main__':
+  main()
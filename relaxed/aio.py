@@ -0,0 +1,234 @@
+import asyncio
+import json
+import threading
+
+from .codec import get_codec
+from .core import RelaxedDecorators
+from .hooks import Hooks
+from .server import Server
+from .db import Database
+from .session import Session
+
+try:
+  import aiohttp
+except ImportError:
+  aiohttp = None
+
+
+def _mirror_endpoints(sync_cls):
+  """
+  Class decorator that adds an awaitable twin of every endpoint declared on sync_cls, driven by
+  RelaxedDecorators.async_endpoint and post-processed by the same function as the synchronous endpoint.
+  """
+  def decorate(cls):
+    for name, attr in vars(sync_cls).items():
+      spec = getattr(attr, '_endpoint', None)
+      if spec is not None and name not in vars(cls):
+        template, endpoint_kwargs = spec
+        setattr(cls, name, RelaxedDecorators.async_endpoint(template, **endpoint_kwargs)(attr.__wrapped__))
+    return cls
+  return decorate
+
+
+def _encode_params(params):
+  # aiohttp only accepts str/int/float query values, so encode them the way CouchDB expects them
+  if params is None:
+    return None
+
+  encoded = []
+  for key, value in params.items():
+    values = value if isinstance(value, (list, tuple)) else [value]
+    for v in values:
+      if v is None:
+        continue
+      encoded.append((key, json.dumps(v) if isinstance(v, bool) else str(v)))
+  return encoded
+
+
+class AsyncResponse():
+  """
+  Fully read aiohttp response exposing the subset of the requests.Response interface used by
+  RelaxedDecorators._process_response.
+  """
+
+  def __init__(self, status_code, headers, content):
+    self.status_code = status_code
+    self.headers = headers
+    self.content = content
+
+  def json(self):
+    return json.loads(self.content)
+
+
+class AsyncTransport():
+  """
+  Pooled keep-alive transport for asyncio applications, backed by an aiohttp connector.
+
+  Attributes:
+  :param int pool_connections: Number of hosts that may hold pooled connections. (Default: 10)
+  :param int pool_maxsize: Maximum number of concurrent connections to a single host. 0 means unlimited. (Default: 100)
+  :param float idle_timeout: Seconds an idle keep-alive connection is kept before being closed. (Default: 15)
+  """
+
+  def __init__(self, **kwargs):
+    if aiohttp is None:
+      raise ImportError('AsyncTransport requires aiohttp.  Install it with "pip install relaxed[async]".')
+
+    self.pool_connections = kwargs.get('pool_connections', 10)
+    self.pool_maxsize = kwargs.get('pool_maxsize', 100)
+    self.idle_timeout = kwargs.get('idle_timeout', 0) or 15
+    self._client = None
+
+  def _get_client(self):
+    # aiohttp sessions are bound to the running loop, so they can only be created from inside it
+    if self._client is None or self._client.closed:
+      connector = aiohttp.TCPConnector(limit=self.pool_connections * self.pool_maxsize,
+                                       limit_per_host=self.pool_maxsize,
+                                       keepalive_timeout=self.idle_timeout)
+      self._client = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+    return self._client
+
+  async def request(self, method, url, **kwargs):
+    cookies = {k: v for k, v in (kwargs.get('cookies', None) or {}).items() if v is not None}
+    data = kwargs.get('json', None)
+    # raw bodies (bytes or file objects, which aiohttp streams) are passed through untouched
+    body = kwargs.get('data', None) if data is None else json.dumps(data)
+
+    async with self._get_client().request(method.upper(), url,
+                                          headers=kwargs.get('headers', None),
+                                          cookies=cookies,
+                                          params=_encode_params(kwargs.get('params', None)),
+                                          data=body) as response:
+      content = await response.read()
+      return AsyncResponse(response.status, response.headers, content)
+
+  async def close(self):
+    if self._client is not None:
+      await self._client.close()
+      self._client = None
+
+
+@_mirror_endpoints(Session)
+class AsyncSession():
+  """
+  Asyncio counterpart of Session.  Accepts the same arguments; every endpoint is a coroutine.
+
+  Examples:
+    session = AsyncSession(host="https://somehost.com", port="6984", username="admin", password="super_secure")
+    await session.authenticate(data={'name': 'admin', 'password': 'super_secure'})
+  """
+
+  def __init__(self, **kwargs):
+    self._host = kwargs.get('host', 'http://127.0.0.1')
+    self._port = kwargs.get('port', 5984)
+    self.address = f'{self._host}:{self._port}'
+
+    self._keep_alive = kwargs.get('keep_alive', 0)
+    self._keep_alive_task = None
+
+    self._name = kwargs.get('username', None)
+    self._password = kwargs.get('password', None)
+    self.auth_token = kwargs.get('auth_token', None)
+    self._token_lock = threading.Lock()
+
+    self.transport = kwargs.get('transport', None) or AsyncTransport(**kwargs)
+    self.trusted = kwargs.get('trusted', False)
+    self.codec = get_codec(kwargs.get('codec', None))
+    self.response_mode = kwargs.get('response_mode', 'json')
+    self.hooks = kwargs.get('hooks', None) if kwargs.get('hooks', None) is not None else Hooks()
+
+    self._headers = {
+      'Content-type': 'application/json',
+      'Accept': 'application/json'}
+
+    # reference to this object is required for the RelaxedDecorators.async_endpoint to update the auth token
+    self.session = self
+
+  set_auth_token_from_headers = Session.set_auth_token_from_headers
+
+  async def renew_session(self):
+    """
+    Alias for get_session_info()
+    """
+    return await self.get_session_info()
+
+  async def _renew_forever(self):
+    while True:
+      await asyncio.sleep(self._keep_alive)
+      await self.renew_session()
+
+  def keep_alive(self, isEnabled=False):
+    """
+    Enables or disables keep alive.  Must be called from within a running event loop.
+    """
+    if (isEnabled is False):
+      if self._keep_alive_task is not None:
+        self._keep_alive_task.cancel()
+        self._keep_alive_task = None
+    elif (isEnabled and self._keep_alive > 0 and self.auth_token is not None):
+      if self._keep_alive_task is None:
+        self._keep_alive_task = asyncio.ensure_future(self._renew_forever())
+
+  async def aclose(self):
+    """
+    Stops session renewal and closes every pooled connection.
+    """
+    self.keep_alive(False)
+    await self.transport.close()
+
+
+@_mirror_endpoints(Server)
+class AsyncServer():
+  def __init__(self, **kwargs):
+    self.session = kwargs.get('session', None)
+    self._predefined_segments = {'node_name': '_local'}
+
+
+@_mirror_endpoints(Database)
+class AsyncDatabase():
+  def __init__(self, **kwargs):
+    self.session = kwargs.get('session', None)
+    self._db = kwargs.get('db', '_global_changes')
+    self._predefined_segments = {'db': self._db}
+
+
+class AsyncUser():
+  def __init__(self, **kwargs):
+    self.session = kwargs.get('session', None)
+    self.db = kwargs.get('db', None)
+
+  async def create(self, name, password, **kwargs):
+    docid = f'org.couchdb.user:{name}'
+    userdoc = {'name': name, 'password': password, 'roles': kwargs.get('roles', []), 'type': "user"}
+    userdoc.update(**kwargs)
+    return await self.db.save_named_doc(uri_segments={'db': '_users', 'docid': docid}, data=userdoc)
+
+  async def get(self, id):
+    docid = f'org.couchdb.user:{id}'
+    return await self.db.get_doc(uri_segments={'db': '_users', 'docid': docid})
+
+
+class AsyncCouchDB():
+  """
+  Exposes an awaitable interface for interacting with a CouchDB server's REST API.  A single event loop can
+  keep many requests in flight over the pooled connections of one AsyncCouchDB.
+
+  Usage:
+    async with AsyncCouchDB([username=<user>[, password=<password>][,<arg=<value>]) as couch:
+      info = await couch.server.get_info()
+  """
+
+  def __init__(self, **kwargs):
+    self.session = AsyncSession(**kwargs)
+    self.server = AsyncServer(session=self.session)
+    self.db = AsyncDatabase(session=self.session, **kwargs)
+    self.user = AsyncUser(session=self.session, db=self.db)
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, type, value, traceback):
+    await self.aclose()
+
+  async def aclose(self):
+    await self.session.aclose()
@@ -0,0 +1,86 @@
+import mimetypes
+import mmap
+import os
+
+
+class AttachmentStream():
+  """
+  Iterator over the body of an attachment in chunks of at most chunk_size bytes, read from the network as they are
+  consumed, so an attachment of any size is never held in memory.
+
+  Attributes:
+  :param str content_type: Content type the attachment was stored with.
+  :param int content_length: Size of the attachment in bytes, when the server reported it. (Default: None)
+  :param str digest: MD5 digest of the attachment as reported by the server (Content-MD5 or ETag). (Default: None)
+
+  Usage:
+    stream = couch.db.iter_attachment(uri_segments={'docid': 'report', 'attname': 'data.csv'})
+    for chunk in stream:
+      ...
+
+    couch.db.download_attachment('/tmp/data.csv', uri_segments={'docid': 'report', 'attname': 'data.csv'})
+  """
+
+  def __init__(self, response, chunk_size=65536):
+    self._response = response
+    self._chunks = response.iter_content(chunk_size=chunk_size)
+    self.content_type = response.headers.get('Content-Type', None)
+    length = response.headers.get('Content-Length', None)
+    self.content_length = int(length) if length is not None else None
+    self.digest = response.headers.get('Content-MD5', None) or response.headers.get('ETag', None)
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    try:
+      return next(self._chunks)
+    except StopIteration:
+      self.close()
+      raise
+
+  def close(self):
+    """
+    Stops reading and releases the connection.
+    """
+    self._response.close()
+
+  def save(self, destination):
+    """
+    Writes the remaining chunks to destination, a file path or any object with a write method.
+
+    :returns int number of bytes written
+    """
+    if isinstance(destination, (str, os.PathLike)):
+      with open(destination, 'wb') as target:
+        return self.save(target)
+
+    written = 0
+    try:
+      for chunk in self:
+        destination.write(chunk)
+        written += len(chunk)
+    finally:
+      self.close()
+    return written
+
+
+def attachment_body(source, name=None, content_type=None):
+  """
+  Prepares source, a file path, a file-like object opened in binary mode, an mmap or bytes, to be streamed as the
+  body of an attachment upload.
+
+  :returns tuple (body, content type, function releasing anything opened here)
+  """
+  if content_type is None:
+    guessed = source if isinstance(source, (str, os.PathLike)) else name
+    content_type = (mimetypes.guess_type(str(guessed))[0] if guessed else None) or 'application/octet-stream'
+
+  if isinstance(source, (str, os.PathLike)):
+    body = open(source, 'rb')
+    return body, content_type, body.close
+
+  if isinstance(source, mmap.mmap):
+    # sent from the current position like any other file object, so start from the beginning
+    source.seek(0)
+  return source, content_type, lambda: None
@@ -0,0 +1,135 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from .core import CouchError
+
+# statuses worth retrying as-is; 413 is handled separately by splitting the chunk
+TRANSIENT_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+TRANSIENT_EXCEPTIONS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+# statuses telling that the request was turned away before any document was written
+UNPROCESSED_STATUS_CODES = (429, 503)
+
+
+class BulkWriter():
+  """
+  Saves any number of documents through _bulk_docs by splitting them into chunks bounded by document count and
+  by encoded size, sending up to max_workers chunks concurrently and retrying chunks that fail transiently.
+
+  The result is a single list in input order holding, for every document, the id/rev (or id/error/reason) that
+  CouchDB reported for it.  Chunks that still fail after max_retries are reported per document with the error of
+  the last attempt instead of raising.
+
+  A chunk that failed with a connection error, a timeout or a 408, 500, 502 or 504 may have been written all the
+  same, so it is only retried when every document in it has an _id: sending it again then at worst reports
+  conflicts, whereas documents without an _id would be created twice.  Such a conflict can mean that the first
+  attempt saved the document, so check conflicting documents before writing them again.  Give documents their ids before saving
+  them (e.g. from a UUIDPool) to have such chunks retried.  429 and 503 responses are always retried.
+
+  Attributes:
+  :param Database db: Database the documents are saved to.
+  :param int max_docs: Maximum number of documents per _bulk_docs request. (Default: 1000)
+  :param int max_bytes: Maximum encoded size of a _bulk_docs request body, in bytes. A single document larger
+    than this is sent on its own. (Default: 8388608)
+  :param int max_workers: Maximum number of chunks in flight at once. (Default: 4)
+  :param int max_retries: Number of times a transiently failing chunk is retried. (Default: 3)
+  :param float backoff: Seconds to wait before the first retry; doubled for each subsequent retry. (Default: 0.5)
+
+  Usage:
+    writer = BulkWriter(couch.db, max_docs=2000, max_workers=8)
+    results = writer.save(docs)
+  """
+
+  def __init__(self, db, **kwargs):
+    self.db = db
+    self.max_docs = kwargs.get('max_docs', 1000)
+    self.max_bytes = kwargs.get('max_bytes', 8 * 1024 * 1024)
+    self.max_workers = kwargs.get('max_workers', 4)
+    self.max_retries = kwargs.get('max_retries', 3)
+    self.backoff = kwargs.get('backoff', 0.5)
+
+  def save(self, docs, new_edits=True, uri_segments=None):
+    """
+    Saves docs, which may be any iterable, and returns one result per document in input order.
+
+    :param bool new_edits: Set to False to store the documents with their existing revisions, as replication does.
+    :param dict uri_segments: Dynamic segments for the _bulk_docs endpoint (e.g. {'db': 'other'}).
+    """
+    results = []
+    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+      in_flight = set()
+      for start, chunk, pieces in self._chunks(docs):
+        results.extend([None] * len(chunk))
+        if len(in_flight) >= self.max_workers:
+          done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+          for future in done:
+            future.result()
+        in_flight.add(executor.submit(self._save_chunk, results, start, chunk, pieces, new_edits,
+                                     uri_segments))
+
+      for future in in_flight:
+        future.result()
+
+    return results
+
+  def _chunks(self, docs):
+    # every document is encoded once, with the session's codec: its size decides the chunk and the encoded piece
+    # goes into the body as it is; 2 bytes for the enclosing brackets and ~32 for the rest of the body
+    encode = self.db.session.codec.encode
+    chunk, pieces, size, start, index = [], [], 34, 0, 0
+    for doc in docs:
+      piece = encode(doc)
+      if chunk and (len(chunk) >= self.max_docs or size + len(piece) + 1 > self.max_bytes):
+        yield start, chunk, pieces
+        chunk, pieces, size, start = [], [], 34, index
+      chunk.append(doc)
+      pieces.append(piece)
+      size += len(piece) + 1
+      index += 1
+
+    if chunk:
+      yield start, chunk, pieces
+
+  def _save_chunk(self, results, start, chunk, pieces, new_edits, uri_segments):
+    body = b''.join((b'{"docs":[', b','.join(pieces), b'],"new_edits":', b'true' if new_edits else b'false', b'}'))
+    kwargs = {'data': body, 'response_mode': 'json'}
+    if uri_segments is not None:
+      kwargs['uri_segments'] = uri_segments
+
+    for attempt in range(0, self.max_retries + 1):
+      try:
+        response = self.db.bulk_save(**kwargs)
+      except TRANSIENT_EXCEPTIONS as e:
+        response = CouchError(error='connection_error', reason=str(e))
+
+      if not isinstance(response, CouchError):
+        results[start:start + len(chunk)] = self._document_results(chunk, response, new_edits)
+        return
+
+      # the server refused the body size; halve the chunk rather than retrying it unchanged
+      if response.status_code == 413 and len(chunk) > 1:
+        middle = len(chunk) // 2
+        self._save_chunk(results, start, chunk[:middle], pieces[:middle], new_edits, uri_segments)
+        self._save_chunk(results, start + middle, chunk[middle:], pieces[middle:], new_edits, uri_segments)
+        return
+
+      transient = response.status_code is None or response.status_code in TRANSIENT_STATUS_CODES
+      if transient and response.status_code not in UNPROCESSED_STATUS_CODES:
+        # the chunk may have been applied; only documents with an _id can be sent again without duplicates
+        transient = all('_id' in doc for doc in chunk)
+      if not transient or attempt == self.max_retries:
+        break
+      time.sleep(self.backoff * (2 ** attempt))
+
+    results[start:start + len(chunk)] = [{'id': doc.get('_id', None), 'error': response.error,
+                                          'reason': response.reason} for doc in chunk]
+
+  def _document_results(self, chunk, response, new_edits):
+    if len(response) == len(chunk):
+      return response
+
+    # with new_edits=false CouchDB only reports the documents it could not store
+    errors = {result.get('id', None): result for result in response}
+    return [errors.get(doc.get('_id', None), {'ok': True, 'id': doc.get('_id', None), 'rev': doc.get('_rev', None)})
+            for doc in chunk]
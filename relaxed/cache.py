@@ -0,0 +1,363 @@
+import json
+import threading
+from collections import OrderedDict
+
+from .core import CouchError
+
+
+class LRU():
+  """
+  Thread safe least recently used mapping bounded by number of entries and by the total size reported for them.
+
+  Attributes:
+  :param int max_entries: Maximum number of entries kept. (Default: 1024)
+  :param int max_bytes: Maximum total size of the entries kept, in bytes. (Default: 67108864)
+  """
+
+  def __init__(self, **kwargs):
+    self.max_entries = kwargs.get('max_entries', 1024)
+    self.max_bytes = kwargs.get('max_bytes', 64 * 1024 * 1024)
+    self.size = 0
+    self.evictions = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def __contains__(self, key):
+    return key in self._entries
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._entries.get(key, None)
+      if entry is None:
+        return default
+      self._entries.move_to_end(key)
+      return entry[0]
+
+  def put(self, key, value, size):
+    with self._lock:
+      previous = self._entries.pop(key, None)
+      if previous is not None:
+        self.size -= previous[1]
+
+      if size > self.max_bytes:
+        return False
+
+      self._entries[key] = (value, size)
+      self.size += size
+      while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+        _, (_, evicted_size) = self._entries.popitem(last=False)
+        self.size -= evicted_size
+        self.evictions += 1
+      return True
+
+  def pop(self, key, default=None):
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is None:
+        return default
+      self.size -= entry[1]
+      return entry[0]
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self.size = 0
+
+
+class _CachedResponse():
+  # stands in for the requests.Response of a 304 so the endpoint processes the cached body as if it had been sent
+  def __init__(self, response, content, codec=None):
+    self.status_code = 200
+    self.headers = response.headers
+    self.content = content
+    self._codec = codec
+
+  def json(self):
+    return self._codec.decode(self.content) if self._codec is not None else json.loads(self.content)
+
+  def iter_content(self, chunk_size=1):
+    for start in range(0, len(self.content), chunk_size):
+      yield self.content[start:start + chunk_size]
+
+  def close(self):
+    pass
+
+
+class ETagCache():
+  """
+  Client side cache of response bodies keyed by URI and query parameters and revalidated with their ETag.  When an
+  entry exists the request is sent with If-None-Match, and a 304 Not Modified is answered from memory.  Bodies are
+  kept encoded, so every read decodes its own copy and callers can never mutate a cached document.
+
+  Used by the endpoints declared cacheable (get_doc, get_ddoc, get_view and get_docs) when passed to a Session:
+    couch = CouchDB(etag_cache=ETagCache(max_entries=10000, max_bytes=256 * 1024 * 1024))
+
+  Attributes:
+  :param int max_entries: Maximum number of responses kept. (Default: 1024)
+  :param int max_bytes: Maximum total size of the responses kept, in bytes. (Default: 67108864)
+  :param int hits: Number of responses served from the cache after a 304.
+  :param int misses: Number of cacheable requests that had to be answered with a full body.
+  :param int revalidations: Number of conditional requests sent.
+  """
+
+  def __init__(self, **kwargs):
+    self._entries = LRU(**kwargs)
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.revalidations = 0
+
+  @property
+  def evictions(self):
+    return self._entries.evictions
+
+  @property
+  def size(self):
+    return self._entries.size
+
+  @property
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations,
+            'evictions': self.evictions, 'entries': len(self._entries), 'bytes': self.size}
+
+  def __len__(self):
+    return len(self._entries)
+
+  def key(self, address, uri, params):
+    """
+    Returns the cache key of a request to uri with params on the server (or cluster) at address, so that a cache
+    shared between sessions never answers one server's request with another's body.
+    """
+    url = f'{address}{uri}'
+    return url if not params else f'{url}?{json.dumps(params, sort_keys=True, default=str)}'
+
+  def request_headers(self, key, headers):
+    """
+    Returns the headers to send for key, adding If-None-Match when a response is cached, and the cached entry to
+    pass to resolve(), or None.  The entry is held by the request so that its eviction while the request is in
+    flight cannot leave a 304 without a body.
+    """
+    entry = self._entries.get(key, None)
+    if entry is None:
+      return headers, None
+
+    self._count('revalidations')
+    return dict(headers, **{'If-None-Match': entry[0]}), entry
+
+  def resolve(self, key, response, entry=None, codec=None):
+    """
+    Returns a response carrying the body of entry, as returned by request_headers(), if the server answered 304,
+    otherwise caches the response (when it has an ETag) and returns it unchanged.  codec decodes the cached body
+    for json(), like the session's codec does for the responses it receives.
+    """
+    if response.status_code == 304 and entry is not None:
+      self._count('hits')
+      return _CachedResponse(response, entry[1], codec)
+
+    self._count('misses')
+    etag = response.headers.get('ETag', None)
+    if response.status_code == 200 and etag:
+      content = response.content
+      self._entries.put(key, (etag, content), len(content) + len(etag) + len(key))
+    else:
+      self._entries.pop(key, None)
+    return response
+
+  def invalidate(self, key=None):
+    """
+    Drops the response cached for key, or every response if no key is given.
+    """
+    if key is None:
+      self._entries.clear()
+    else:
+      self._entries.pop(key, None)
+
+  def _count(self, counter):
+    with self._lock:
+      setattr(self, counter, getattr(self, counter) + 1)
+
+
+class DocumentCache():
+  """
+  Read-through document cache for a Database that stays coherent by following the database's _changes feed (from
+  since=now) in a background thread.  Every change evicts the cached copy of its document, or replaces it when
+  refresh is enabled, so a cached read is never more than one change behind the server.
+
+  Reads that race with a change of the same document are not cached.  If the feed is lost the cache is emptied and
+  reads go straight to the server until start() is called again.
+
+  Attributes:
+  :param Database db: Database the documents are read from.
+  :param int max_entries: Maximum number of documents kept. (Default: 1024)
+  :param int max_bytes: Maximum total encoded size of the documents kept, in bytes. (Default: 67108864)
+  :param bool refresh: Replace changed documents with their new revision (using include_docs) instead of evicting
+    them. (Default: False)
+  :param list warm: Document ids preloaded through bulk_get when the cache starts. (Default: None)
+  :param int heartbeat: Heartbeat of the _changes feed, in milliseconds. (Default: 10000)
+
+  Usage:
+    cache = DocumentCache(couch.db, max_entries=50000, warm=hot_ids).start()
+    doc = cache.get_doc('some-id')
+    cache.stop()
+  """
+
+  def __init__(self, db, **kwargs):
+    self.db = db
+    self.refresh = kwargs.get('refresh', False)
+    self.warm = kwargs.get('warm', None)
+    self.heartbeat = kwargs.get('heartbeat', 10000)
+    self.error = None
+
+    self.hits = 0
+    self.misses = 0
+    self.invalidations = 0
+
+    self._entries = LRU(max_entries=kwargs.get('max_entries', 1024), max_bytes=kwargs.get('max_bytes', 64 * 1024 * 1024))
+    self._lock = threading.Lock()
+    # docid -> [number of reads in flight, number of changes seen while they were in flight]
+    self._inflight = {}
+    self._feed = None
+    self._thread = None
+
+  @property
+  def running(self):
+    return self._thread is not None and self._thread.is_alive()
+
+  @property
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations,
+            'evictions': self._entries.evictions, 'entries': len(self._entries), 'bytes': self._entries.size}
+
+  def start(self):
+    """
+    Connects to the _changes feed, preloads the warm ids and starts following the feed.
+
+    :returns CouchError if the feed could not be opened
+    :returns DocumentCache this cache
+    """
+    feed = self.db.iter_changes(since='now', feed='continuous', heartbeat=self.heartbeat,
+                                include_docs=self.refresh, reconnect_delay=1)
+    if isinstance(feed, CouchError):
+      return feed
+
+    self.error = None
+    self._feed = feed
+    self._thread = threading.Thread(target=self._follow, name='relaxed-document-cache', daemon=True)
+    self._thread.start()
+
+    if self.warm:
+      self._warm(list(self.warm))
+    return self
+
+  def stop(self):
+    """
+    Stops following the feed and empties the cache.
+    """
+    feed, self._feed = self._feed, None
+    if feed is not None:
+      feed.close()
+    self._entries.clear()
+
+  def get_doc(self, docid):
+    """
+    Returns the document from the cache, or reads it with Database.get_doc and caches it.
+    """
+    encoded = self._entries.get(docid, None)
+    if encoded is not None:
+      self._count('hits')
+      return json.loads(encoded)
+
+    self._count('misses')
+    version = self._begin_read(docid)
+    try:
+      doc = self.db.get_doc(uri_segments={'docid': docid}, response_mode='json')
+      if not isinstance(doc, CouchError):
+        self._store(docid, doc, version)
+      return doc
+    finally:
+      self._end_read(docid)
+
+  def invalidate(self, docid):
+    """
+    Drops docid from the cache and keeps reads of it that are in flight from caching what they read.
+
+    :returns bool True if the document was cached
+    """
+    with self._lock:
+      if docid in self._inflight:
+        self._inflight[docid][1] += 1
+    if self._entries.pop(docid, None) is None:
+      return False
+    self._count('invalidations')
+    return True
+
+  def _warm(self, docids):
+    for start in range(0, len(docids), 500):
+      chunk = docids[start:start + 500]
+      versions = {docid: self._begin_read(docid) for docid in chunk}
+      try:
+        response = self.db.bulk_get(data={'docs': [{'id': docid} for docid in chunk]}, response_mode='json')
+        if isinstance(response, CouchError):
+          continue
+        for result in response.get('results', []):
+          docs = result.get('docs', [])
+          if docs and 'ok' in docs[0] and result.get('id', None) in versions:
+            self._store(result['id'], docs[0]['ok'], versions[result['id']])
+      finally:
+        for docid in chunk:
+          self._end_read(docid)
+
+  def _follow(self):
+    feed = self._feed
+    try:
+      for change in feed:
+        docid = change.get('id', None)
+        if docid is None:
+          continue
+
+        if self.refresh and docid in self._entries and not change.get('deleted', False) and 'doc' in change:
+          self._replace(docid, change['doc'])
+        else:
+          self.invalidate(docid)
+    except Exception as e:
+      self.error = e
+    finally:
+      # without the feed nothing can be trusted anymore
+      self._entries.clear()
+
+  def _replace(self, docid, doc):
+    with self._lock:
+      if docid in self._inflight:
+        self._inflight[docid][1] += 1
+    self._entries.put(docid, *self._encode(doc))
+    self._count('invalidations')
+
+  def _begin_read(self, docid):
+    with self._lock:
+      entry = self._inflight.setdefault(docid, [0, 0])
+      entry[0] += 1
+      return entry[1]
+
+  def _end_read(self, docid):
+    with self._lock:
+      entry = self._inflight[docid]
+      entry[0] -= 1
+      if entry[0] == 0:
+        del self._inflight[docid]
+
+  def _store(self, docid, doc, version):
+    with self._lock:
+      if not self.running or self._inflight[docid][1] != version:
+        return
+      self._entries.put(docid, *self._encode(doc))
+
+  def _encode(self, doc):
+    encoded = json.dumps(doc, separators=(',', ':')).encode('utf-8')
+    return encoded, len(encoded)
+
+  def _count(self, counter):
+    with self._lock:
+      setattr(self, counter, getattr(self, counter) + 1)
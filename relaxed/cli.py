@@ -0,0 +1,256 @@
+"""
+Command line tools for moving whole databases.
+
+  relaxed dump <db> <directory> [--workers 4] [--ranges N] [--page-size 1000]
+  relaxed restore <directory> <db> [--workers 4] [--batch-size 1000] [--create]
+
+dump writes every document (with its attachments inline) as one JSON document per line, in gzip compressed
+shards, one per key range, read concurrently.  restore saves them, several shards at once, with _bulk_docs and
+new_edits=false, so documents keep their _rev.  Both keep a checkpoint in the directory and pick up where an interrupted run stopped
+when run again with the same arguments.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .bulk import BulkWriter
+from .core import CouchDB, CouchError
+from .replicate import PERMANENT_ERRORS
+from .scan import ParallelScanner
+
+MANIFEST = 'manifest.json'
+
+
+class _Checkpoint():
+  # json file rewritten atomically every time the state changes
+  def __init__(self, path, state):
+    self.path = path
+    self.state = state
+    self._lock = threading.Lock()
+
+  @classmethod
+  def load(cls, path, default):
+    if os.path.exists(path):
+      with open(path, 'r', encoding='utf-8') as f:
+        return cls(path, json.load(f))
+    return cls(path, default)
+
+  def update(self, fn):
+    with self._lock:
+      fn(self.state)
+      temporary = f'{self.path}.tmp'
+      with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(self.state, f)
+      os.replace(temporary, self.path)
+
+
+def _boundary(value):
+  return tuple(value) if value is not None else None
+
+
+def dump(db, directory, workers=4, ranges=None, page_size=1000, log=print):
+  """
+  Dumps every document of db into gzip compressed NDJSON shards in directory.
+
+  Each page of a range is appended to its shard as a complete gzip member before the checkpoint records it, so a
+  shard can be truncated back to its last checkpoint after an interruption and continued from the next key.
+
+  :returns CouchError if the database could not be read
+  :returns int number of documents written by this run
+  """
+  os.makedirs(directory, exist_ok=True)
+  params = {'include_docs': True, 'attachments': True}
+  scanner = ParallelScanner(db, max_workers=workers, ranges=ranges, page_size=page_size)
+  checkpoint = _Checkpoint.load(os.path.join(directory, MANIFEST), None)
+
+  if checkpoint.state is None:
+    split = scanner.split(params=params)
+    if isinstance(split, CouchError):
+      return split
+    shards = [{'file': f'{db._db}-{index:04d}.ndjson.gz', 'start': start, 'end': end, 'next': start,
+               'bytes': 0, 'docs': 0, 'done': False} for index, (start, end) in enumerate(split)]
+    checkpoint.state = {'db': db._db, 'shards': shards}
+    checkpoint.update(lambda state: None)
+  elif checkpoint.state['db'] != db._db:
+    return CouchError(error='bad_request', reason=f'{directory} holds a dump of {checkpoint.state["db"]}')
+
+  def dump_shard(index):
+    shard = checkpoint.state['shards'][index]
+    if shard['done']:
+      return 0
+
+    path = os.path.join(directory, shard['file'])
+    written = 0
+    with open(path, 'ab') as f:
+      # drop whatever was appended after the last checkpoint
+      f.truncate(shard['bytes'])
+      for page in scanner.iter_pages(_boundary(shard['next']), _boundary(shard['end']), params=params):
+        if isinstance(page, CouchError):
+          return page
+
+        rows, following = page
+        lines = b''.join(db.session.codec.encode(row['doc']) + b'\n' for row in rows if row.get('doc', None))
+        f.write(gzip.compress(lines))
+        f.flush()
+        os.fsync(f.fileno())
+        written += len(rows)
+
+        size = f.tell()
+
+        def record(state, size=size, following=following, count=len(rows)):
+          entry = state['shards'][index]
+          entry.update(next=following, bytes=size, docs=entry['docs'] + count, done=following is None)
+        checkpoint.update(record)
+    log(f'{shard["file"]}: {checkpoint.state["shards"][index]["docs"]} documents')
+    return written
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    results = list(executor.map(dump_shard, range(0, len(checkpoint.state['shards']))))
+
+  for result in results:
+    if isinstance(result, CouchError):
+      return result
+  return sum(results)
+
+
+def restore(db, directory, workers=4, batch_size=1000, log=print):
+  """
+  Saves every document of the shards in directory into db with new_edits=false, batch by batch and up to
+  workers shards at a time, recording in a checkpoint how many lines of each shard have been saved.
+
+  Lines rejected for good ('forbidden', 'unauthorized') are recorded in the checkpoint as failed.  Any other
+  failure stops the shard before its batch, so that running restore again saves the batch again, which
+  new_edits=false makes harmless for the documents that were saved.
+
+  :returns int number of documents that could not be saved
+  """
+  with open(os.path.join(directory, MANIFEST), 'r', encoding='utf-8') as f:
+    manifest = json.load(f)
+
+  checkpoint = _Checkpoint.load(os.path.join(directory, f'restore-{db._db}.json'), {'shards': {}})
+  shards = [shard['file'] for shard in manifest['shards']
+            if not checkpoint.state['shards'].get(shard['file'], {}).get('done', False)]
+  if not shards:
+    return 0
+
+  # shards are read concurrently; with fewer shards than workers, each shard sends several chunks at once
+  readers = min(workers, len(shards))
+  writer = BulkWriter(db, max_docs=batch_size, max_workers=max(workers // readers, 1))
+
+  def restore_shard(name):
+    skip = checkpoint.state['shards'].get(name, {}).get('lines', 0)
+    line_number = 0
+    batch = []
+    saved = True
+    failures = 0
+    with gzip.open(os.path.join(directory, name), 'rb') as f:
+      for line in f:
+        line_number += 1
+        if line_number <= skip:
+          continue
+        batch.append(db.session.codec.decode(line))
+        # several chunks per call keep every writer busy
+        if len(batch) >= batch_size * writer.max_workers:
+          failed, saved = _save(writer, batch, checkpoint, name, line_number)
+          failures += failed
+          batch = []
+          if not saved:
+            break
+
+    if saved:
+      failed, saved = _save(writer, batch, checkpoint, name, line_number, done=True)
+      failures += failed
+    if saved:
+      log(f'{name}: {line_number} documents')
+    else:
+      log(f'{name}: stopped before line {line_number - len(batch) + 1}, run restore again to continue')
+    return failures
+
+  with ThreadPoolExecutor(max_workers=readers) as executor:
+    return sum(executor.map(restore_shard, shards))
+
+
+def _save(writer, batch, checkpoint, name, line_number, done=False):
+  # returns the number of failed documents and whether the checkpoint was advanced past the batch
+  failed = []
+  retry = False
+  if batch:
+    first = line_number - len(batch) + 1
+    for offset, result in enumerate(writer.save(batch, new_edits=False)):
+      if 'error' in result:
+        failed.append(first + offset)
+        retry = retry or result['error'] not in PERMANENT_ERRORS
+  if retry:
+    return len(failed), False
+
+  def record(state):
+    previous = state['shards'].get(name, {}).get('failed', [])
+    state['shards'][name] = {'lines': line_number, 'done': done, 'failed': previous + failed}
+  checkpoint.update(record)
+  return len(failed), True
+
+
+def _parser():
+  parser = argparse.ArgumentParser(prog='relaxed', description='Move whole CouchDB databases to and from NDJSON.')
+  parser.add_argument('--host', default=os.environ.get('RELAXED_HOST', 'http://127.0.0.1'))
+  parser.add_argument('--port', type=int, default=int(os.environ.get('RELAXED_PORT', 5984)))
+  parser.add_argument('--username', default=os.environ.get('RELAXED_USERNAME', None))
+  parser.add_argument('--password', default=os.environ.get('RELAXED_PASSWORD', None),
+                      help='defaults to the RELAXED_PASSWORD environment variable')
+  parser.add_argument('--workers', type=int, default=4, help='concurrent requests (default: 4)')
+  # also accepted after the command; SUPPRESS keeps the subcommand from overwriting a value given before it
+  common = argparse.ArgumentParser(add_help=False)
+  common.add_argument('--workers', type=int, default=argparse.SUPPRESS, help='concurrent requests (default: 4)')
+  commands = parser.add_subparsers(dest='command')
+  commands.required = True
+
+  dump_parser = commands.add_parser('dump', parents=[common], help='dump a database into gzip compressed NDJSON shards')
+  dump_parser.add_argument('db')
+  dump_parser.add_argument('directory')
+  dump_parser.add_argument('--ranges', type=int, default=None, help='key ranges read in parallel (default: shards)')
+  dump_parser.add_argument('--page-size', type=int, default=1000)
+
+  restore_parser = commands.add_parser('restore', parents=[common], help='restore a dump into a database')
+  restore_parser.add_argument('directory')
+  restore_parser.add_argument('db')
+  restore_parser.add_argument('--batch-size', type=int, default=1000, help='documents per _bulk_docs request')
+  restore_parser.add_argument('--create', action='store_true', help='create the database if it does not exist')
+  return parser
+
+
+def main(argv=None):
+  args = _parser().parse_args(argv)
+  couch = CouchDB(host=args.host, port=args.port, username=args.username, password=args.password, db=args.db,
+                  auto_connect=args.username is not None)
+
+  if args.command == 'dump':
+    result = dump(couch.db, args.directory, workers=args.workers, ranges=args.ranges, page_size=args.page_size)
+    if isinstance(result, CouchError):
+      print(f'dump failed: {result.error} ({result.reason})', file=sys.stderr)
+      return 1
+    print(f'dumped {result} documents')
+    return 0
+
+  if args.create:
+    # exists() answers with the ETag of the HEAD request, or None, so it cannot tell a missing database apart
+    info = couch.db.get()
+    if isinstance(info, CouchError) and info.status_code == 404:
+      created = couch.db.create()
+      if isinstance(created, CouchError):
+        print(f'could not create {args.db}: {created.error} ({created.reason})', file=sys.stderr)
+        return 1
+
+  failures = restore(couch.db, args.directory, workers=args.workers, batch_size=args.batch_size)
+  if failures:
+    print(f'{failures} documents could not be restored', file=sys.stderr)
+    return 1
+  print('restore complete')
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
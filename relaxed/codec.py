@@ -0,0 +1,85 @@
+import json
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  import ujson
+except ImportError:
+  ujson = None
+
+
+class JSONCodec():
+  """
+  Encodes request bodies and decodes response bodies with the standard library json module.  Every codec exposes
+  the same two methods: encode(obj) returning UTF-8 bytes and decode(bytes) returning the decoded object.
+  """
+
+  name = 'json'
+
+  def __init__(self):
+    self._encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    self._decode = json.JSONDecoder().decode
+
+  def encode(self, obj):
+    return self._encoder.encode(obj).encode('utf-8')
+
+  def decode(self, data):
+    return self._decode(data.decode('utf-8') if isinstance(data, (bytes, bytearray)) else data)
+
+
+class OrjsonCodec():
+  """
+  Codec backed by orjson (pip install orjson).
+  """
+
+  name = 'orjson'
+
+  def __init__(self):
+    if orjson is None:
+      raise ImportError('the orjson codec requires the orjson package')
+    self.encode = orjson.dumps
+    self.decode = orjson.loads
+
+
+class UjsonCodec():
+  """
+  Codec backed by ujson (pip install ujson).
+  """
+
+  name = 'ujson'
+
+  def __init__(self):
+    if ujson is None:
+      raise ImportError('the ujson codec requires the ujson package')
+    self._dumps = ujson.dumps
+    self.decode = ujson.loads
+
+  def encode(self, obj):
+    return self._dumps(obj, ensure_ascii=False, escape_forward_slashes=False).encode('utf-8')
+
+
+CODECS = {'json': JSONCodec, 'orjson': OrjsonCodec, 'ujson': UjsonCodec}
+
+
+def available_codecs():
+  """
+  Names of the codecs that can be used in this environment, fastest first.
+  """
+  return [name for name, module in (('orjson', orjson), ('ujson', ujson)) if module is not None] + ['json']
+
+
+def get_codec(codec=None):
+  """
+  Returns the codec to use for codec, which is a codec object, the name of one of CODECS, or None to pick the
+  fastest codec installed (orjson, then ujson, then the standard library).
+  """
+  if codec is None:
+    return CODECS[available_codecs()[0]]()
+  if isinstance(codec, str):
+    if codec not in CODECS:
+      raise ValueError(f'unknown codec {codec}, expected one of {", ".join(CODECS)}')
+    return CODECS[codec]()
+  return codec
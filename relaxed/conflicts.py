@@ -0,0 +1,195 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .bulk import BulkWriter
+from .core import CouchError
+from .scan import ParallelScanner
+
+
+class ConflictResolver():
+  """
+  Finds and resolves conflicted documents in batches instead of one get_doc(conflicts=true) per document and one
+  delete_doc per losing revision.
+
+  Conflicted documents are found either in the changes feed (style=all_docs lists every leaf revision of a
+  document) or, with view=, in a view emitting them, e.g. function (doc) { if (doc._conflicts) emit(doc._id); },
+  read with include_docs and conflicts.  For every batch, all leaf revisions are read with one _bulk_get, merge
+  picks or builds the winner, and the winners and then the deletions of every other leaf are saved with
+  _bulk_docs in chunks.  Batches are resolved on a thread pool while the next ones are being found.
+
+  merge is called with the id of the document and its live leaf revisions, CouchDB's winner first.  It returns
+  the document to keep, which is saved on top of the leaf whose _rev it carries (the winner's when it has none),
+  or None to keep CouchDB's winner as it is.  Every other leaf is deleted once the winner is saved; if saving it
+  fails (e.g. because it changed since it was read), the document is left as it was and counted as a failure.
+
+  Attributes:
+  :param Database db: Database to resolve.
+  :param function merge: Picks or builds the winning document. (Default: None, i.e. CouchDB's winner is kept)
+  :param tuple view: (design document, view) emitting conflicted documents. (Default: None, i.e. the changes feed)
+  :param int batch_size: Conflicted documents per batch. (Default: 500)
+  :param int max_workers: Batches resolved concurrently. (Default: 2)
+  :param dict stats: Totals of the last run: conflicted, merged (winners saved), deleted_revisions,
+    write_failures and batches.
+  :param CouchError error: Set if a request failed, in which case the run stops.
+
+  Usage:
+    def latest(docid, leaves):
+      return max(leaves, key=lambda doc: doc.get('updated_at', ''))
+
+    resolver = ConflictResolver(couch.db, merge=latest, batch_size=1000, max_workers=4)
+    stats = resolver.resolve()
+  """
+
+  def __init__(self, db, **kwargs):
+    self.db = db
+    self.merge = kwargs.get('merge', None)
+    self.view = kwargs.get('view', None)
+    self.batch_size = kwargs.get('batch_size', 500)
+    self.max_workers = kwargs.get('max_workers', 2)
+
+    self.stats = {}
+    self.error = None
+    self._lock = threading.Lock()
+
+  def find(self, since='0'):
+    """
+    Returns an iterator of (docid, leaf revisions) of every conflicted document, CouchDB's winner first.  Leaves
+    found in the changes feed may include deleted ones.
+
+    :param str since: Sequence to read the changes feed from. (Default: 0)
+    """
+    if self.view is None:
+      return self._from_changes(since)
+    return self._from_view()
+
+  def resolve(self, since='0'):
+    """
+    Resolves every conflicted document.
+
+    :returns dict stats
+    """
+    self.stats = {'conflicted': 0, 'merged': 0, 'deleted_revisions': 0, 'write_failures': 0, 'batches': 0}
+    self.error = None
+
+    with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+      pending = deque()
+      for batch in self._batches(self.find(since)):
+        pending.append(executor.submit(self._resolve_batch, batch))
+        while len(pending) > self.max_workers:
+          self._complete(pending.popleft().result())
+        if self.error is not None:
+          break
+
+      while pending:
+        self._complete(pending.popleft().result())
+    return self.stats
+
+  def _from_changes(self, since):
+    while True:
+      changes = self.db.get_changes(params={'since': str(since), 'style': 'all_docs', 'limit': self.batch_size},
+                                    response_mode='json')
+      if isinstance(changes, CouchError):
+        self.error = changes
+        return
+
+      results = changes.get('results', [])
+      for result in results:
+        revs = [change['rev'] for change in result.get('changes', [])]
+        # a deleted winner means every leaf is deleted, which is no conflict
+        if len(revs) > 1 and not result.get('deleted', False):
+          yield result['id'], revs
+
+      since = changes.get('last_seq', since)
+      if len(results) < self.batch_size:
+        return
+
+  def _from_view(self):
+    ddoc, view = self.view
+    scanner = ParallelScanner(self.db, max_workers=1, ranges=1, page_size=self.batch_size)
+    seen = set()
+    for row in scanner.scan(ddoc, view, params={'include_docs': True, 'conflicts': True}):
+      doc = row.get('doc', None) or {}
+      if doc.get('_conflicts', None) and doc['_id'] not in seen:
+        seen.add(doc['_id'])
+        yield doc['_id'], [doc['_rev']] + doc['_conflicts']
+
+    if scanner.error is not None:
+      self.error = scanner.error
+
+  def _batches(self, conflicts):
+    batch = []
+    for conflict in conflicts:
+      batch.append(conflict)
+      if len(batch) >= self.batch_size:
+        yield batch
+        batch = []
+    if batch:
+      yield batch
+
+  def _resolve_batch(self, batch):
+    requests = [{'id': docid, 'rev': rev} for docid, revs in batch for rev in revs]
+    response = self.db.bulk_get(data={'docs': requests}, response_mode='json')
+    if isinstance(response, CouchError):
+      return response
+
+    leaves = {}
+    for result in response.get('results', []):
+      for entry in result.get('docs', []):
+        doc = entry.get('ok', None)
+        if doc is not None and not doc.get('_deleted', False):
+          leaves.setdefault(doc['_id'], {})[doc['_rev']] = doc
+
+    winners = []
+    deletions = {}
+    conflicted = 0
+    for docid, revs in batch:
+      found = leaves.get(docid, {})
+      live = [found[rev] for rev in revs if rev in found]
+      if len(live) < 2:
+        # resolved since it was found
+        continue
+      conflicted += 1
+
+      winner = self.merge(docid, live) if self.merge is not None else None
+      if winner is None or winner is live[0] or winner == live[0]:
+        kept = live[0]['_rev']
+      else:
+        winner = dict(winner, _id=docid)
+        winner.setdefault('_rev', live[0]['_rev'])
+        kept = winner['_rev']
+        winners.append(winner)
+      deletions[docid] = [{'_id': docid, '_rev': leaf['_rev'], '_deleted': True}
+                          for leaf in live if leaf['_rev'] != kept]
+
+    writer = BulkWriter(self.db, max_docs=self.batch_size, max_workers=1)
+    merged = failures = 0
+    if winners:
+      # the losing leaves of a document are only deleted once its merged winner is saved, as _bulk_docs is not
+      # atomic and the winner may have changed since it was read
+      for winner, result in zip(winners, writer.save(winners)):
+        if 'error' in result:
+          failures += 1 + len(deletions.pop(winner['_id']))
+        else:
+          merged += 1
+
+    losers = [deletion for docid in deletions for deletion in deletions[docid]]
+    deleted = 0
+    if losers:
+      failed = sum(1 for result in writer.save(losers) if 'error' in result)
+      deleted = len(losers) - failed
+      failures += failed
+    return conflicted, merged, deleted, failures
+
+  def _complete(self, resolved):
+    with self._lock:
+      if isinstance(resolved, CouchError):
+        self.error = resolved
+        return
+
+      conflicted, merged, deleted, failures = resolved
+      self.stats['conflicted'] += conflicted
+      self.stats['merged'] += merged
+      self.stats['deleted_revisions'] += deleted
+      self.stats['write_failures'] += failures
+      self.stats['batches'] += 1
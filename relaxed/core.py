@@ -1,7 +1,8 @@
-# TODO: figure out how to implement hooks
-from functools import wraps
+from functools import lru_cache, wraps
+from time import perf_counter
 import requests
-from re import sub
+from re import compile as compile_regex
+from urllib.parse import quote
 
 
 class User():
@@ -62,6 +63,8 @@ class CouchDB():
 
 
 class CouchError():
+  __slots__ = ('error', 'reason', 'status_code')
+
   def __init__(self, **kwargs):
     self.error = kwargs.get('error', None)
     self.reason = kwargs.get('reason', None)
@@ -112,7 +115,7 @@ class AllowedKeys():
   DATABASE__DESIGN_DOCS_QUERIES__DATA = {'queries': []}
   DATABASE__DESIGN_DOCS__DATA = {'keys': []}
   DATABASE__LOCAL_DOCS_QUERIES__DATA = {'queries': []}
-  DATABASE__BULK_GET__PARAMS = {'revs': bool}
+  DATABASE__BULK_GET__PARAMS = {'revs': bool, 'attachments': bool, 'latest': bool}
   DATABASE__BULK_GET__DATA = {'docs': [{}]}
   DATABASE__BULK_DOCS__DATA = {'docs': [{}], 'new_edits': bool}
   DATABASE__FIND__DATA = {'selector': {}, 'limit': int, 'skip': int,
@@ -151,92 +154,495 @@ class AllowedKeys():
   DATABASE__VIEW_BY_KEY__DATA = {'keys': []}
   DATABASE__VIEW_QUERIES__DATA = {'queries': []}
 
+_UNRESERVED_SEGMENT = compile_regex(r'[A-Za-z0-9_.~-]*\Z').match
+
+
+class EndpointPlan():
+  """
+  Everything about an endpoint that can be worked out once, when the endpoint is declared: the split URI
+  template, the percent-encoding used for each dynamic segment and validators generated from the AllowedKeys
+  specs.
+
+  Validators check both the keys and, where AllowedKeys declares a scalar type (bool, int or str), the type of
+  each value.  Container specs ([], {}, [{}], ...) accept any JSON value since CouchDB accepts several shapes
+  for them (e.g. replication source as a url or an object).  Query parameters may always be passed as
+  pre-encoded strings.
+  """
+
+  # segments whose values are paths in their own right; every other segment is encoded as a single path segment
+  _SEGMENT_SAFE_CHARACTERS = {'key': '/', 'stat': '/', 'attname': '/'}
+  _DOCID_PREFIXES = ('_design/', '_local/')
+
+  def __init__(self, template, method='get', query_keys=None, data_keys=None, cacheable=False,
+               raw_body=False, raw_response=False, multipart=False):
+    self.template = template
+    self.method = method
+    self.cacheable = cacheable
+    self.raw_body = raw_body
+    self.raw_response = raw_response
+    self.multipart = multipart
+    self.request_class = self._classify(template, method)
+
+    parts = template.split(':')
+    # odd indices of the split template are segment identifiers, even indices literal text
+    self._literals = parts[0::2]
+    self._segments = tuple(parts[1::2])
+    self._quoters = tuple(self._compile_quoter(name) for name in self._segments)
+
+    self.validate_params = self._compile_validator(query_keys, allow_encoded=True)
+    self.validate_data = self._compile_validator(data_keys, allow_encoded=False)
+
+  # view queries are the expensive reads; feeds stay open for as long as they are followed and are never limited
+  _VIEW_SUFFIXES = ('_view/:view:', '_view/:view:/queries', '/_find', '/_explain')
+  _FEED_SUFFIXES = ('/_changes', '/_db_updates')
+  _READ_SUFFIXES = ('/_all_docs', '/_all_docs/queries', '/_design_docs', '/_design_docs/queries', '/_local_docs',
+                    '/_local_docs/queries', '/_bulk_get', '/_revs_diff', '/_missing_revs')
+
+  @classmethod
+  def _classify(cls, template, method):
+    if template.endswith(cls._FEED_SUFFIXES):
+      return None
+    if template.endswith(cls._VIEW_SUFFIXES):
+      return 'view'
+    if method in ('get', 'head') or template.endswith(cls._READ_SUFFIXES):
+      return 'read'
+    return 'write'
+
+  @classmethod
+  def _compile_quoter(cls, name):
+    safe = cls._SEGMENT_SAFE_CHARACTERS.get(name, '')
+    if name != 'docid':
+      # database, view, index and config names repeat from call to call, so remember how they were encoded
+      @lru_cache(maxsize=1024)
+      def quote_segment(value):
+        return quote(str(value), safe=safe)
+      return quote_segment
+
+    def quote_docid(value):
+      value = str(value)
+      if _UNRESERVED_SEGMENT(value):
+        return value
+      for prefix in cls._DOCID_PREFIXES:
+        if value.startswith(prefix):
+          return prefix + quote(value[len(prefix):], safe='')
+      return quote(value, safe='')
+    return quote_docid
+
+  @staticmethod
+  def _compile_validator(spec, allow_encoded):
+    if spec is None:
+      return None
+
+    allowed = frozenset(spec)
+    typed = {}
+    for key, expected in spec.items():
+      if expected in (bool, int, str):
+        # exact types; bool is deliberately not accepted where an int is expected
+        typed[key] = frozenset([expected, str]) if allow_encoded else frozenset([expected])
+
+    def validate(values):
+      if not isinstance(values, dict) or not allowed.issuperset(values):
+        raise InvalidKeysException("The provided filter does not meet the expected format.")
+
+      for key, value in values.items():
+        expected_types = typed.get(key, None)
+        if expected_types is not None and type(value) not in expected_types:
+          if isinstance(value, bool) or not isinstance(value, tuple(expected_types)):
+            raise InvalidKeysException(f'The provided value for "{key}" is not of the expected type.')
+    return validate
+
+  def build_uri(self, segments):
+    if not self._segments:
+      return self.template
+
+    if segments is None:
+      raise Exception((
+        'Invalid URI. This endpoint contains dynamic segments, but none were provided.  '
+        f'Expected segment definition for "{self._segments[0]}".  '
+        'Did you forget to pass a uri_segments dict?'))
+
+    literals = self._literals
+    uri = [literals[0]]
+    for index, name in enumerate(self._segments):
+      if name not in segments:
+        raise Exception(f'Invalid URI. Expected a dynamic segment for "{name}", but none was provided.')
+      uri.append(self._quoters[index](segments[name]))
+      uri.append(literals[index + 1])
+    return ''.join(uri)
+
+
 class RelaxedDecorators():
-  def _process_filter_format(filter_format, filter):
-    if (filter_format is not None):
-      for key in filter.keys():
-        if key not in filter_format:
-          raise InvalidKeysException("The provided filter does not meet the expected format.")
-
-  def _build_uri(template: str, segments: dict):
-    def replace_with_segment(matches):
-      #  dynamic segments are expected, but not provided at all
-      if segments is None and len(matches.groups()) > 0:
-        identifier = matches.group(1)
-        raise Exception((
-          'Invalid URI. This endpoint contains dynamic segments, but none were provided.  '
-          f'Expected segment definition for "{identifier}".  '
-          'Did you forget to pass a uri_segments dict?'))
-
-      # a specific segment not provided
-      elif len(matches.groups()) == 1 and matches.group(1) not in segments:
-        identifier = matches.group(1)
-        raise Exception(f'Invalid URI. Expected a dynamic segment for "{identifier}", but none was provided.')
+  def _prepare_request(self, plan, kwargs):
+    # a per call copy, so that a call's segments never leak into the next one or race another thread's
+    dynamic_segments = getattr(self, '_predefined_segments', {})
+    if ('uri_segments' in kwargs):
+      dynamic_segments = dict(dynamic_segments, **kwargs.get('uri_segments'))
+    uri = plan.build_uri(dynamic_segments)
+
+    # trusted sessions skip validation entirely
+    # pre-encoded bodies are sent as they are, so there is nothing to validate
+    if not self.session.trusted:
+      if ('data' in kwargs and plan.validate_data is not None and not isinstance(kwargs['data'], (bytes, bytearray))):
+        plan.validate_data(kwargs.get('data'))
+
+      if ('params' in kwargs and plan.validate_params is not None):
+        plan.validate_params(kwargs.get('params'))
+
+    return uri, {'AuthSession': self.session.auth_token or None}
+
+  _SUCCESS_CODES = (requests.codes['ok'], requests.codes['created'], requests.codes['accepted'])
+
+  def _encode_body(session, data):
+    # bodies already encoded by the caller go out unchanged
+    if data is None or isinstance(data, (bytes, bytearray)):
+      return data
+    return session.codec.encode(data)
+
+  def _process_response(session, response, mode=None):
+    if (response.status_code in RelaxedDecorators._SUCCESS_CODES):
+      session.set_auth_token_from_headers(response.headers)
+      mode = mode or session.response_mode
+      if mode == 'raw':
+        return response.content
+      elif mode == 'columnar':
+        return ViewResult.from_response(response)
+      elif mode == 'lazy':
+        ret_val = lazy_response(response.content, session.codec)
       else:
-        return segments[matches.group(1)]
-
-    return sub(':([\w_]+):', replace_with_segment, template)
+        ret_val = session.codec.decode(response.content)
+      if isinstance(ret_val, str):
+        ret_val = {'data': ret_val}
+    else:
+      result = session.codec.decode(response.content)
+      if isinstance(result, str):
+        result = {'data': result}
+      result['code'] = response.status_code
+      ret_val = CouchError(**result)
+
+    return ret_val
+
+  def _replayable(plan, kwargs):
+    # streamed bodies cannot be read a second time
+    if plan.raw_body:
+      return isinstance(kwargs.get('data', None), (bytes, bytearray))
+    if plan.multipart and kwargs.get('attachments', None):
+      # bytes and paths can be sent again, open files cannot
+      sources = (source[0] if isinstance(source, tuple) else source for source in kwargs['attachments'].values())
+      return not any(hasattr(source, 'read') for source in sources)
+    return True
+
+  def _dispatch(self, plan, uri, cookies, kwargs, request_stream, multipart_read):
+    # sends the request to a node of the session's pool, within its limiter, through its circuit breaker and retry
+    # policy, when it has them
+    session = self.session
+    policy, breaker, pool = session.retry_policy, session.circuit_breaker, session.node_pool
+    limiter = session.limiter if plan.request_class is not None else None
+    if policy is None and breaker is None and pool is None and limiter is None:
+      return RelaxedDecorators._send(self, plan, uri, cookies, kwargs, request_stream, multipart_read, session.address)
+
+    replayable = RelaxedDecorators._replayable(plan, kwargs)
+    attempt = 0
+    tried = []
+    while True:
+      node = pool.acquire(tried) if pool is not None else None
+      host = session.address if node is None else node.address
+      if breaker is not None:
+        try:
+          breaker.before(host)
+        except CircuitOpenError:
+          # nothing was sent, so this is no failure of the node nor congestion, and any request can go elsewhere;
+          # with no other node left it fails fast rather than being retried
+          if node is None:
+            raise
+          pool.cancel(node)
+          tried.append(node)
+          if len(tried) < len(pool.nodes):
+            continue
+          raise
+
+      permit = limiter.acquire(plan.request_class) if limiter is not None else None
+      started = perf_counter()
+      try:
+        response = RelaxedDecorators._send(self, plan, uri, cookies, kwargs, request_stream, multipart_read, host)
+      except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        if permit is not None:
+          permit.release(None, None)
+        if breaker is not None:
+          breaker.record(host, None)
+        if node is not None:
+          pool.release(node, status=None)
+          tried.append(node)
+          # nothing came back, so an idempotent request can go to the next node straight away
+          if (replayable and plan.method in pool.FAILOVER_METHODS and len(tried) < len(pool.nodes)):
+            continue
+        if not (policy is not None and replayable and policy.retry(plan.method, attempt)):
+          raise
+        delay = policy.delay(attempt)
+      except BaseException:
+        if permit is not None:
+          permit.cancel()
+        raise
+      else:
+        elapsed = perf_counter() - started
+        if breaker is not None:
+          breaker.record(host, response.status_code)
+        if node is not None:
+          pool.release(node, elapsed, response.status_code)
+        retry = policy is not None and replayable and policy.retry(plan.method, attempt, response.status_code)
+        if permit is not None:
+          if (request_stream and not retry and response.status_code in RelaxedDecorators._SUCCESS_CODES):
+            RelaxedDecorators._release_on_close(response, permit, elapsed)
+          else:
+            permit.release(elapsed, response.status_code)
+        if not retry:
+          return response
+        delay = policy.delay(attempt, response)
+        response.close()
+
+      policy.sleep(delay)
+      attempt += 1
+      tried = []
+
+  def _release_on_close(response, permit, elapsed):
+    # a streamed body is read after the request returns, so its limiter slot is held until the response is closed,
+    # which RowStream and the other streams do once they are exhausted; the limit adapts to the time to the headers
+    close = response.close
+    held = [permit]
+
+    def release_and_close():
+      if held:
+        held.pop().release(elapsed, response.status_code)
+      close()
+    response.close = release_and_close
+
+  def _send(self, plan, uri, cookies, kwargs, request_stream, multipart_read, address):
+    request_action = self.session.transport.request
+    request_method = plan.method
+    url = f'{address}{uri}'
+
+    multipart_body = None
+    if plan.multipart and (request_method == 'put' or request_method == 'post'):
+      multipart_body = MultipartBody.from_request(kwargs)
+
+    if (multipart_body is not None):
+      try:
+        return request_action(request_method, url,
+                              headers=dict(self.session._headers, **{'Content-type': multipart_body.content_type}),
+                              cookies=cookies,
+                              params=kwargs.get('params', None),
+                              data=multipart_body,
+                              stream=request_stream,
+                              timeout=kwargs.get('timeout', None))
+      finally:
+        multipart_body.close()
+    elif (multipart_read):
+      return request_action(request_method, url,
+                            headers=dict(self.session._headers, Accept='multipart/related'),
+                            cookies=cookies,
+                            params=multipart_params(kwargs.get('params', None)),
+                            stream=True,
+                            timeout=kwargs.get('timeout', None))
+    elif (plan.raw_body and (request_method == 'post' or request_method == 'put')):
+      # data is sent as is (bytes or a file-like object, which requests streams) with the given content type
+      return request_action(request_method, url,
+                            headers=dict(self.session._headers, **{'Content-type': kwargs.get('content_type', 'application/octet-stream')}),
+                            cookies=cookies,
+                            params=kwargs.get('params', None),
+                            data=kwargs.get('data'),
+                            stream=request_stream,
+                            timeout=kwargs.get('timeout', None))
+    elif (request_method == 'post'or request_method == 'put'):
+      return request_action(request_method, url,
+                            headers=self.session._headers,
+                            cookies=cookies,
+                            params=kwargs.get('params', None),
+                            data=RelaxedDecorators._encode_body(self.session, kwargs.get('data')),
+                            stream=request_stream,
+                            timeout=kwargs.get('timeout', None))
+    elif request_method == 'head':
+      return request_action(request_method, url,
+                            headers=self.session._headers,
+                            cookies=cookies,
+                            params=kwargs.get('params', None),
+                            json=kwargs.get('data'))
+    elif (plan.cacheable and self.session.etag_cache is not None and kwargs.get('stream', False) is False):
+      cache = self.session.etag_cache
+      # keyed by the session's address rather than the node's, so that every node of a cluster shares the entries
+      cache_key = cache.key(self.session.address, uri, kwargs.get('params', None))
+      headers, cached = cache.request_headers(cache_key, self.session._headers)
+      response = request_action(request_method, url,
+                                headers=headers,
+                                cookies=cookies,
+                                params=kwargs.get('params', None),
+                                timeout=kwargs.get('timeout', None))
+      return cache.resolve(cache_key, response, cached, self.session.codec)
+    else:
+      return request_action(request_method, url,
+                            headers=dict(self.session._headers, Accept='*/*') if plan.raw_response else self.session._headers,
+                            cookies=cookies,
+                            params=kwargs.get('params', None),
+                            stream=request_stream,
+                            timeout=kwargs.get('timeout', None))
+
+  def _result(session, plan, response, kwargs, stream=False, multipart_read=False):
+    # the value handed to the endpoint function
+    if plan.method == 'head':
+      return response.headers.get('ETag')
+
+    if (response.status_code in RelaxedDecorators._SUCCESS_CODES):
+      if (multipart_read):
+        session.set_auth_token_from_headers(response.headers)
+        return read_multipart_doc(response, spill_size=kwargs.get('spill_size', None))
+
+      if (stream is True):
+        session.set_auth_token_from_headers(response.headers)
+        return response
+
+      # raw_response endpoints hand back the body undecoded; errors are still JSON
+      if (plan.raw_response):
+        session.set_auth_token_from_headers(response.headers)
+        return response.content
+
+    return RelaxedDecorators._process_response(session, response, kwargs.get('response_mode', None))
 
   def endpoint(*args, **kwargs):
     endpoint = args[0]
+    endpoint_kwargs = kwargs
 
-    allowed_query_parameter_keys = kwargs.get('query_keys', None)
-    allowed_data_keys = kwargs.get('data_keys', None)
-
-    request_method = kwargs.get('method', 'get')
-    request_action = getattr(requests, request_method)
+    plan = EndpointPlan(endpoint, method=kwargs.get('method', 'get'),
+                        query_keys=kwargs.get('query_keys', None), data_keys=kwargs.get('data_keys', None),
+                        cacheable=kwargs.get('cacheable', False),
+                        raw_body=kwargs.get('raw_body', False), raw_response=kwargs.get('raw_response', False),
+                        multipart=kwargs.get('multipart', False))
+    request_method = plan.method
 
     def set_endpoint(*eargs):
       fn = eargs[0]
 
+      def call(self, kwargs, event):
+        uri, cookies = RelaxedDecorators._prepare_request(self, plan, kwargs)
+        if event is not None:
+          event.sending(uri)
+
+        # stream=True hands the undecoded requests.Response of a successful call to the endpoint function
+        stream = kwargs.get('stream', False)
+        # columnar results are decoded row by row as the response arrives
+        request_stream = stream or kwargs.get('response_mode', None) == 'columnar'
+        # multipart endpoints send documents with attachments, and read them with multipart=True, in one request
+        multipart_read = (plan.multipart and request_method == 'get' and kwargs.get('multipart', False))
+
+        response = RelaxedDecorators._dispatch(self, plan, uri, cookies, kwargs, request_stream, multipart_read)
+        # an expired AuthSession is renewed once, by whichever request notices first, and the request sent again;
+        # requests to /_session are the authentication itself
+        if (response.status_code == requests.codes['unauthorized'] and plan.template != '/_session'
+            and RelaxedDecorators._replayable(plan, kwargs)
+            and self.session.refresh_authentication(cookies.get('AuthSession'))):
+          response.close()
+          cookies = {'AuthSession': self.session.auth_token or None}
+          response = RelaxedDecorators._dispatch(self, plan, uri, cookies, kwargs, request_stream, multipart_read)
+
+        if event is not None:
+          event.received(response)
+        return RelaxedDecorators._result(self.session, plan, response, kwargs, stream, multipart_read)
+
       @wraps(fn)
       def wrapper(self, *query_params, **kwargs):
-        dynamic_segments = getattr(self, '_predefined_segments', {})
-        dynamic_segments.update(kwargs.get('uri_segments', {}))
-        cookies = {'AuthSession': self.session.auth_token or None}
-        uri = RelaxedDecorators._build_uri(endpoint, dynamic_segments)
-
-        if ('data' in kwargs):
-          RelaxedDecorators._process_filter_format(allowed_data_keys, kwargs.get('data'))
-
-        if ('params' in kwargs):
-          RelaxedDecorators._process_filter_format(allowed_query_parameter_keys, kwargs.get('params'))
-
-        if (request_method == 'post'or request_method == 'put'):
-          response = request_action(f'{self.session.address}{uri}',
-                                    headers=self.session._headers,
-                                    cookies=cookies,
-                                    params=kwargs.get('params', None),
-                                    json=kwargs.get('data'))
-        elif request_method == 'head':
-          response = request_action(f'{self.session.address}{uri}',
-                                    headers=self.session._headers,
-                                    cookies=cookies,
-                                    params=kwargs.get('params', None),
-                                    json=kwargs.get('data'))
-          return fn(self, response.headers.get('ETag'))
-        else:
-          response = request_action(f'{self.session.address}{uri}',
-                                    headers=self.session._headers,
-                                    cookies=cookies,
-                                    params=kwargs.get('params', None))
-
-        if (response.status_code in [requests.codes['ok'], requests.codes['created'], requests.codes['accepted']]):
-          self.session.set_auth_token_from_headers(response.headers)
-          ret_val = response.json()
-          if isinstance(ret_val, str):
-            ret_val = {'data': ret_val}
+        hooks = self.session.hooks
+        if not hooks:
+          return fn(self, call(self, kwargs, None))
+
+        event = RequestEvent(hooks, fn.__name__, plan)
+        try:
+          result = call(self, kwargs, event)
+        except Exception as error:
+          event.failed(error)
+          raise
+        event.finished(result)
+        return fn(self, result)
+
+      # kept so that relaxed.aio can build awaitable twins of every endpoint
+      wrapper._endpoint = (endpoint, endpoint_kwargs)
+      wrapper._plan = plan
+      return wrapper
+    return set_endpoint
+
+  def async_endpoint(*args, **kwargs):
+    """
+    Awaitable counterpart of endpoint().  Shares URI templates, AllowedKeys validation and CouchError semantics
+    with the synchronous decorator, but awaits the session's transport, which must be an AsyncTransport.
+    Multipart attachments and response_mode='columnar' are not supported and raise ValueError.
+    """
+    endpoint = args[0]
+
+    plan = EndpointPlan(endpoint, method=kwargs.get('method', 'get'),
+                        query_keys=kwargs.get('query_keys', None), data_keys=kwargs.get('data_keys', None),
+                        raw_body=kwargs.get('raw_body', False), raw_response=kwargs.get('raw_response', False),
+                        multipart=kwargs.get('multipart', False))
+    request_method = plan.method
+
+    def set_endpoint(*eargs):
+      fn = eargs[0]
+
+      async def call(self, kwargs, event):
+        uri, cookies = RelaxedDecorators._prepare_request(self, plan, kwargs)
+        if event is not None:
+          event.sending(uri)
+
+        if plan.raw_body:
+          headers = dict(self.session._headers, **{'Content-type': kwargs.get('content_type', 'application/octet-stream')})
+          body = kwargs.get('data', None)
         else:
-          result = response.json()
-          if isinstance(result, str):
-            result = {'data': result}
-          result['code'] = response.status_code
-          ret_val = CouchError(**result)
+          headers = self.session._headers
+          body = RelaxedDecorators._encode_body(self.session, kwargs.get('data', None))
+        response = await self.session.transport.request(request_method, f'{self.session.address}{uri}',
+                                                        headers=headers,
+                                                        cookies=cookies,
+                                                        params=kwargs.get('params', None),
+                                                        data=body)
+
+        if event is not None:
+          event.received(response, body)
+        return RelaxedDecorators._result(self.session, plan, response, kwargs)
 
-        return fn(self, ret_val)
+      @wraps(fn)
+      async def wrapper(self, *query_params, **kwargs):
+        # responses are read whole into an AsyncResponse, and multipart bodies are only built for requests, so
+        # these would otherwise be dropped or fail once the response arrived
+        if kwargs.get('response_mode', None) == 'columnar':
+          raise ValueError(f'{fn.__name__}: response_mode="columnar" is not supported by async endpoints.')
+        if plan.multipart and (kwargs.get('attachments', None) or kwargs.get('multipart', False)):
+          raise ValueError(f'{fn.__name__}: multipart attachments are not supported by async endpoints.')
+
+        hooks = self.session.hooks
+        if not hooks:
+          return fn(self, await call(self, kwargs, None))
+
+        event = RequestEvent(hooks, fn.__name__, plan)
+        try:
+          result = await call(self, kwargs, event)
+        except Exception as error:
+          event.failed(error)
+          raise
+        event.finished(result)
+        return fn(self, result)
       return wrapper
     return set_endpoint
 
+from .hooks import Hooks, RequestEvent
+from .policy import CircuitBreaker, CircuitOpenError, RetryPolicy
+from .nodes import Node, NodePool
+from .limiter import AdaptiveLimiter, RequestLimiter, TokenBucket
 from .session import Session
 from .server import Server
 from .db import Database
+from .aio import AsyncCouchDB
+from .bulk import BulkWriter
+from .loader import DocumentLoader
+from .cache import DocumentCache, ETagCache
+from .lazy import LazyArray, LazyDocument, lazy_response
+from .results import Row, ViewResult
+from .multipart import MultipartBody, multipart_params, read_multipart_doc
+from .scan import ParallelScanner
+from .replicate import Replicator
+from .uuids import UUIDPool
+from .conflicts import ConflictResolver
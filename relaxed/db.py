@@ -1,4 +1,6 @@
 from .core import RelaxedDecorators, CouchError, AllowedKeys
+from .attachments import AttachmentStream, attachment_body
+from .streaming import ChangesFeed, FindStream, RowStream, encode_params
 
 
 class Database():
@@ -7,6 +9,11 @@ class Database():
     self._db = kwargs.get('db', '_global_changes')
     self._predefined_segments = {'db': self._db}
 
+  def _stream_rows(self, endpoint, kwargs):
+    chunk_size = kwargs.pop('chunk_size', 65536)
+    response = endpoint(stream=True, **kwargs)
+    return response if isinstance(response, CouchError) else RowStream(response, chunk_size=chunk_size)
+
   @RelaxedDecorators.endpoint('/:db:', method='head')
   def headers(self, couch_data):
     return couch_data
@@ -58,12 +65,25 @@ class Database():
   def get_doc_info(self, couch_data):
     return couch_data
 
-  @RelaxedDecorators.endpoint('/:db:/:docid:', query_keys=AllowedKeys.DATABASE__DOCUMENT__PARAMS)
+  @RelaxedDecorators.endpoint('/:db:/:docid:', query_keys=AllowedKeys.DATABASE__DOCUMENT__PARAMS, cacheable=True, multipart=True)
   def get_doc(self, couch_data):
+    """
+    Pass multipart=True to read the document together with the bodies of its attachments in a single
+    multipart/related response; each attachment's data is then its content as bytes.  Combine with
+    params={'atts_since': [revs]} to leave out the attachments already present in those revisions, and with
+    spill_size=bytes to have larger attachments written to temporary files as they arrive, their data being the
+    file instead.
+    """
     return couch_data
 
-  @RelaxedDecorators.endpoint('/:db:/:docid:', method='put', query_keys=AllowedKeys.DATABASE__DOCUMENT__NAMED_DOC__PARAMS)
+  @RelaxedDecorators.endpoint('/:db:/:docid:', method='put', query_keys=AllowedKeys.DATABASE__DOCUMENT__NAMED_DOC__PARAMS, multipart=True)
   def save_named_doc(self, couch_data):
+    """
+    Pass attachments={name: source} to save the document and its attachments as one multipart/related request
+    and a single revision.  A source is bytes, a file path, a binary file-like object, an mmap or a (source,
+    content_type) tuple, and is streamed rather than read into memory.  Attachments whose data is bytes or a file
+    (as read by get_doc(multipart=True)) are sent the same way.
+    """
     return couch_data
 
   @RelaxedDecorators.endpoint('/:db:/:docid:', method='delete', query_keys=AllowedKeys.DATABASE__DOCUMENT__DELETE__PARAMS)
@@ -81,16 +101,57 @@ class Database():
   def get_attachment_info(self, couch_data):
     return couch_data
 
-  # TODO: implement ability for endpoint to return non-json data
-  @RelaxedDecorators.endpoint('/:db:/:docid:/:attname:', query_keys=AllowedKeys.DATABASE__ATTACHMENT__GET__PARAMS)
+  @RelaxedDecorators.endpoint('/:db:/:docid:/:attname:', query_keys=AllowedKeys.DATABASE__ATTACHMENT__GET__PARAMS, raw_response=True)
   def get_attachment(self, couch_data):
+    """
+    :returns CouchError if an error occured accessing the couch api
+    :returns bytes the attachment, read whole; see iter_attachment to stream it
+    """
     return couch_data
 
-  # TODO: confirm ability to pass custom headers to endpoint decorator
-  @RelaxedDecorators.endpoint('/:db:/:docid:/:attname:', method='put', query_keys=AllowedKeys.DATABASE__ATTACHMENT__SAVE__PARAMS)
+  def iter_attachment(self, chunk_size=65536, **kwargs):
+    """
+    Streams the attachment, yielding chunks of at most chunk_size bytes.  Takes the same arguments as
+    get_attachment.
+
+    :returns CouchError if an error occured accessing the couch api
+    :returns AttachmentStream iterator over the chunks of the attachment
+    """
+    response = self.get_attachment(stream=True, **kwargs)
+    return response if isinstance(response, CouchError) else AttachmentStream(response, chunk_size=chunk_size)
+
+  def download_attachment(self, destination, chunk_size=65536, **kwargs):
+    """
+    Streams the attachment into destination, a file path or any object with a write method.
+
+    :returns CouchError if an error occured accessing the couch api
+    :returns int number of bytes written
+    """
+    stream = self.iter_attachment(chunk_size=chunk_size, **kwargs)
+    return stream if isinstance(stream, CouchError) else stream.save(destination)
+
+  @RelaxedDecorators.endpoint('/:db:/:docid:/:attname:', method='put', query_keys=AllowedKeys.DATABASE__ATTACHMENT__SAVE__PARAMS, raw_body=True)
   def save_attachment(self, couch_data):
+    """
+    Stores data (bytes or a binary file-like object) as the attachment, sent with the content_type argument.
+    (Default: application/octet-stream)
+    """
     return couch_data
 
+  def upload_attachment(self, source, content_type=None, **kwargs):
+    """
+    Streams source, a file path, a binary file-like object or an mmap, as the attachment without reading it into
+    memory.  Takes the same arguments as save_attachment (uri_segments, params={'rev': ...}).
+
+    :param str content_type: Content type of the attachment. (Default: guessed from the path or attachment name)
+    """
+    attname = kwargs.get('uri_segments', {}).get('attname', None)
+    body, content_type, release = attachment_body(source, name=attname, content_type=content_type)
+    try:
+      return self.save_attachment(data=body, content_type=content_type, **kwargs)
+    finally:
+      release()
+
   @RelaxedDecorators.endpoint('/:db:/:docid:/:attname:', method='delete', query_keys=AllowedKeys.DATABASE__ATTACHMENT__DELETE__PARAMS)
   def delete_attachment(self, couch_data):
     return couch_data
@@ -103,12 +164,25 @@ class Database():
   def get_ddoc_details(self, couch_data):
     return couch_data
 
-  @RelaxedDecorators.endpoint('/:db:/_design/:docid:', query_keys=AllowedKeys.DATABASE__DOCUMENT__PARAMS)
+  @RelaxedDecorators.endpoint('/:db:/_design/:docid:', query_keys=AllowedKeys.DATABASE__DOCUMENT__PARAMS, cacheable=True, multipart=True)
   def get_ddoc(self, couch_data):
+    """
+    Pass multipart=True to read the document together with the bodies of its attachments in a single
+    multipart/related response; each attachment's data is then its content as bytes.  Combine with
+    params={'atts_since': [revs]} to leave out the attachments already present in those revisions, and with
+    spill_size=bytes to have larger attachments written to temporary files as they arrive, their data being the
+    file instead.
+    """
     return couch_data
 
-  @RelaxedDecorators.endpoint('/:db:/_design/:docid:', method='put', query_keys=AllowedKeys.DATABASE__DOCUMENT__NAMED_DOC__PARAMS)
+  @RelaxedDecorators.endpoint('/:db:/_design/:docid:', method='put', query_keys=AllowedKeys.DATABASE__DOCUMENT__NAMED_DOC__PARAMS, multipart=True)
   def save_named_ddoc(self, couch_data):
+    """
+    Pass attachments={name: source} to save the document and its attachments as one multipart/related request
+    and a single revision.  A source is bytes, a file path, a binary file-like object, an mmap or a (source,
+    content_type) tuple, and is streamed rather than read into memory.  Attachments whose data is bytes or a file
+    (as read by get_ddoc(multipart=True)) are sent the same way.
+    """
     return couch_data
 
   @RelaxedDecorators.endpoint('/:db:/_design/:docid:', method='delete', query_keys=AllowedKeys.DATABASE__DOCUMENT__DELETE__PARAMS)
@@ -126,28 +200,78 @@ class Database():
   def get_ddoc_attachment_info(self, couch_data):
     return couch_data
 
-  # TODO: implement ability for endpoint to return non-json data
-  @RelaxedDecorators.endpoint('/:db:/_design/:docid:/:attname:', query_keys=AllowedKeys.DATABASE__ATTACHMENT__GET__PARAMS)
+  @RelaxedDecorators.endpoint('/:db:/_design/:docid:/:attname:', query_keys=AllowedKeys.DATABASE__ATTACHMENT__GET__PARAMS, raw_response=True)
   def get_ddoc_attachment(self, couch_data):
+    """
+    :returns CouchError if an error occured accessing the couch api
+    :returns bytes the attachment, read whole; see iter_ddoc_attachment to stream it
+    """
     return couch_data
 
-  # TODO: confirm ability to pass custom headers to endpoint decorator
-  @RelaxedDecorators.endpoint('/:db:/_design/:docid:/:attname:', method='put', query_keys=AllowedKeys.DATABASE__ATTACHMENT__SAVE__PARAMS)
+  def iter_ddoc_attachment(self, chunk_size=65536, **kwargs):
+    """
+    Streams the attachment, yielding chunks of at most chunk_size bytes.  Takes the same arguments as
+    get_ddoc_attachment.
+
+    :returns CouchError if an error occured accessing the couch api
+    :returns AttachmentStream iterator over the chunks of the attachment
+    """
+    response = self.get_ddoc_attachment(stream=True, **kwargs)
+    return response if isinstance(response, CouchError) else AttachmentStream(response, chunk_size=chunk_size)
+
+  def download_ddoc_attachment(self, destination, chunk_size=65536, **kwargs):
+    """
+    Streams the attachment into destination, a file path or any object with a write method.
+
+    :returns CouchError if an error occured accessing the couch api
+    :returns int number of bytes written
+    """
+    stream = self.iter_ddoc_attachment(chunk_size=chunk_size, **kwargs)
+    return stream if isinstance(stream, CouchError) else stream.save(destination)
+
+  @RelaxedDecorators.endpoint('/:db:/_design/:docid:/:attname:', method='put', query_keys=AllowedKeys.DATABASE__ATTACHMENT__SAVE__PARAMS, raw_body=True)
   def save_ddoc_attachment(self, couch_data):
+    """
+    Stores data (bytes or a binary file-like object) as the attachment, sent with the content_type argument.
+    (Default: application/octet-stream)
+    """
     return couch_data
 
+  def upload_ddoc_attachment(self, source, content_type=None, **kwargs):
+    """
+    Streams source, a file path, a binary file-like object or an mmap, as the attachment without reading it into
+    memory.  Takes the same arguments as save_ddoc_attachment (uri_segments, params={'rev': ...}).
+
+    :param str content_type: Content type of the attachment. (Default: guessed from the path or attachment name)
+    """
+    attname = kwargs.get('uri_segments', {}).get('attname', None)
+    body, content_type, release = attachment_body(source, name=attname, content_type=content_type)
+    try:
+      return self.save_ddoc_attachment(data=body, content_type=content_type, **kwargs)
+    finally:
+      release()
+
   @RelaxedDecorators.endpoint('/:db:/_design/:docid:/:attname:', method='delete', query_keys=AllowedKeys.DATABASE__ATTACHMENT__DELETE__PARAMS)
   def delete_ddoc_attachment(self, couch_data):
     return couch_data
 
-  @RelaxedDecorators.endpoint('/:db:/_design/:docid:/_view/:view:', query_keys=AllowedKeys.VIEW__PARAMS)
+  @RelaxedDecorators.endpoint('/:db:/_design/:docid:/_view/:view:', query_keys=AllowedKeys.VIEW__PARAMS, cacheable=True)
   def get_view(self, couch_data):
     return couch_data
 
-  @RelaxedDecorators.endpoint('/:db:/_design/:docid:/_view/:view:', query_keys=AllowedKeys.VIEW__PARAMS)
+  @RelaxedDecorators.endpoint('/:db:/_design/:docid:/_view/:view:', query_keys=AllowedKeys.VIEW__PARAMS, cacheable=True)
   def get_view(self, couch_data):
     return couch_data
 
+  def iter_view(self, **kwargs):
+    """
+    Streaming variant of get_view() that yields rows one at a time; accepts the same arguments.
+
+    :returns CouchError if an error occured accessing the couch api
+    :returns RowStream iterator over the rows, exposing total_rows, offset and update_seq once seen
+    """
+    return self._stream_rows(self.get_view, kwargs)
+
   @RelaxedDecorators.endpoint('/:db:/_design/:docid:/_view/:view:', method='post', data_keys=AllowedKeys.DATABASE__VIEW_BY_KEY__DATA)
   def filter_view(self, couch_data):
     return couch_data
@@ -166,10 +290,19 @@ class Database():
 
 
 
-  @RelaxedDecorators.endpoint('/:db:/_all_docs', query_keys=AllowedKeys.VIEW__PARAMS)
+  @RelaxedDecorators.endpoint('/:db:/_all_docs', query_keys=AllowedKeys.VIEW__PARAMS, cacheable=True)
   def get_docs(self, couch_data):
     return couch_data
 
+  def iter_docs(self, **kwargs):
+    """
+    Streaming variant of get_docs() that yields rows one at a time; accepts the same arguments.
+
+    :returns CouchError if an error occured accessing the couch api
+    :returns RowStream iterator over the rows, exposing total_rows, offset and update_seq once seen
+    """
+    return self._stream_rows(self.get_docs, kwargs)
+
   @RelaxedDecorators.endpoint('/:db:/_all_docs', method='post', data_keys=AllowedKeys.DATABASE__ALL_DOCS__DATA)
   def filter_docs(self, couch_data):
     return couch_data
@@ -178,6 +311,15 @@ class Database():
   def get_local_docs(self, couch_data):
     return couch_data
 
+  def iter_local_docs(self, **kwargs):
+    """
+    Streaming variant of get_local_docs() that yields rows one at a time; accepts the same arguments.
+
+    :returns CouchError if an error occured accessing the couch api
+    :returns RowStream iterator over the rows, exposing total_rows, offset and update_seq once seen
+    """
+    return self._stream_rows(self.get_local_docs, kwargs)
+
   @RelaxedDecorators.endpoint('/:db:/_all_docs', method='post', data_keys=AllowedKeys.DATABASE__LOCAL_DOCS__DATA)
   def get_local_docs_by_key(self, couch_data):
     return couch_data
@@ -205,6 +347,15 @@ class Database():
   def get_design_docs(self, couch_data):
     return couch_data
 
+  def iter_design_docs(self, **kwargs):
+    """
+    Streaming variant of get_design_docs() that yields rows one at a time; accepts the same arguments.
+
+    :returns CouchError if an error occured accessing the couch api
+    :returns RowStream iterator over the rows, exposing total_rows, offset and update_seq once seen
+    """
+    return self._stream_rows(self.get_design_docs, kwargs)
+
   @RelaxedDecorators.endpoint('/:db:/_design_docs', method='post', data_keys=AllowedKeys.DATABASE__DESIGN_DOCS__DATA)
   def get_design_docs_by_key(self, couch_data):
     return couch_data
@@ -235,6 +386,27 @@ class Database():
   def find(self, couch_data):
     return couch_data
 
+  def iter_find(self, selector, fields=None, page_size=100, **kwargs):
+    """
+    Iterates over every document matching selector, following the bookmark from page to page and prefetching the
+    next page while the current one is consumed.
+
+    Any keyword argument not listed below is sent as part of the _find request (e.g. sort, use_index,
+    execution_stats=True).
+
+    :param dict selector: Mango selector.
+    :param list fields: Fields to return for each document. (Default: None, i.e. the whole document)
+    :param int page_size: Number of documents requested per page. (Default: 100)
+    :param dict uri_segments: Dynamic segments for the endpoint, as for any other endpoint.
+
+    :returns FindStream iterator over the documents, exposing the aggregated execution_stats
+    """
+    uri_segments = kwargs.pop('uri_segments', None)
+    query = dict(kwargs, selector=selector)
+    if fields is not None:
+      query['fields'] = fields
+    return FindStream(self, query, page_size, uri_segments=uri_segments)
+
   # TODO: confirm body or query parameters.  couchdb docs suggest query parameters and not json body data
   @RelaxedDecorators.endpoint('/:db:/_index', method='post', data_keys=AllowedKeys.DATABASE__INDEX__DATA)
   def save_index(self, couch_data):
@@ -272,6 +444,41 @@ class Database():
   def get_changes(self, couch_data):
     return couch_data
 
+  def iter_changes(self, since='0', feed='continuous', **kwargs):
+    """
+    Streams the _changes feed, yielding changes one at a time as they arrive.  Continuous and longpoll feeds are
+    followed forever and reconnect from the last seen seq after a disconnect; see ChangesFeed.
+
+    Any keyword argument not listed below is sent as a _changes query parameter (e.g. include_docs=True).
+
+    :param str since: Sequence to start from, or 'now'. (Default: '0')
+    :param str feed: One of normal, longpoll or continuous. (Default: continuous)
+    :param dict uri_segments: Dynamic segments for the endpoint, as for any other endpoint.
+    :param float reconnect_delay: Seconds to wait before reconnecting after a disconnect. (Default: 1)
+    :param int max_retries: Consecutive failed reconnects tolerated before the error is raised. (Default: 5)
+
+    :returns CouchError if the initial request failed
+    :returns ChangesFeed iterator over the changes
+    """
+    options = {k: kwargs.pop(k) for k in ('uri_segments', 'reconnect_delay', 'max_retries', 'chunk_size') if k in kwargs}
+    params = encode_params(dict(kwargs, since=str(since), feed=feed))
+
+    # without a heartbeat a silently dropped connection would block a continuous feed forever
+    timeout = None
+    if feed in ('continuous', 'longpoll'):
+      params.setdefault('heartbeat', 10000)
+      timeout = (10, int(params['heartbeat']) / 1000 * 3)
+
+    request_kwargs = {'params': params, 'stream': True, 'timeout': timeout}
+    if 'uri_segments' in options:
+      request_kwargs['uri_segments'] = options['uri_segments']
+
+    response = self.get_changes(**request_kwargs)
+    if isinstance(response, CouchError):
+      return response
+
+    return ChangesFeed(self, response, params, timeout=timeout, **options)
+
     # TODO: make note in this doc string about the lack of data_keys since it supports query keys as well as find data keys
   @RelaxedDecorators.endpoint('/:db:/_changes', method='post', query_keys=AllowedKeys.DATABASE__CHANGES__PARAMS)
   def get_filtered_changes(self, couch_data):
@@ -0,0 +1,170 @@
+from time import perf_counter
+
+from .core import CouchError
+
+HOOK_EVENTS = ('before_send', 'after_response', 'on_error')
+
+
+class Hooks():
+  """
+  Callables notified of every endpoint call made through a session, for metrics, tracing or logging.  Each hook is
+  called with the RequestEvent of the call:
+
+    before_send     after the arguments were validated, right before the request is sent
+    after_response  once a successful response has been decoded
+    on_error        instead of after_response when the call returns a CouchError, or when it raises (the exception
+                    is set as event.error and raised again once the hooks have run)
+
+  Hooks run on the thread making the call and exceptions they raise propagate to the caller.  A session without
+  hooks only pays for one truth test per call.
+
+  Usage:
+    couch.session.hooks.add('after_response', lambda event: latency.observe(event.endpoint, event.network_time))
+    couch.session.hooks.add('on_error', lambda event: log.warning('%s %s: %s', event.method, event.uri, event.status))
+  """
+
+  def __init__(self):
+    self.before_send = ()
+    self.after_response = ()
+    self.on_error = ()
+    self._active = False
+
+  def __bool__(self):
+    return self._active
+
+  def add(self, event, hook):
+    """
+    Registers hook for event, one of 'before_send', 'after_response' and 'on_error'.
+    """
+    self._check(event)
+    # replaced rather than extended, so calls in flight keep iterating the hooks they started with
+    setattr(self, event, getattr(self, event) + (hook,))
+    self._active = True
+    return hook
+
+  def remove(self, event, hook):
+    self._check(event)
+    setattr(self, event, tuple(registered for registered in getattr(self, event) if registered is not hook))
+    self._active = any(getattr(self, name) for name in HOOK_EVENTS)
+
+  def clear(self):
+    for name in HOOK_EVENTS:
+      setattr(self, name, ())
+    self._active = False
+
+  def _check(self, event):
+    if event not in HOOK_EVENTS:
+      raise ValueError(f'Unknown hook event "{event}", expected one of {", ".join(HOOK_EVENTS)}.')
+
+
+class RequestEvent():
+  """
+  A single endpoint call as reported to hooks.  Timings are in seconds and are None for phases that did not run.
+
+  Attributes:
+  :param str endpoint: Name of the endpoint method, e.g. 'get_doc'.
+  :param str method: HTTP method.
+  :param str template: URI template of the endpoint, e.g. '/:db:/:docid:'.
+  :param str uri: Resolved URI, without host or query string. (Default: None until validated)
+  :param int status: HTTP status of the response. (Default: None until received)
+  :param float validation_time: Time spent building the URI and validating params and data.
+  :param float network_time: Time from sending the request until the response headers (or, for non streamed
+    calls, the whole body) arrived, including a re-authenticated second attempt.
+  :param float decode_time: Time spent reading and decoding the response into the value returned.
+  :param int request_bytes: Size of the request body, or None when it was streamed from a file.
+  :param int response_bytes: Size of the response body, or None when it was streamed without a Content-Length.
+  :param error: The CouchError returned or the exception raised by a failed call. (Default: None)
+  """
+
+  __slots__ = ('endpoint', 'method', 'template', 'uri', 'status', 'validation_time', 'network_time', 'decode_time',
+               'request_bytes', 'response_bytes', 'error', '_hooks', '_mark', '_response')
+
+  def __init__(self, hooks, endpoint, plan):
+    self.endpoint = endpoint
+    self.method = plan.method
+    self.template = plan.template
+    self.uri = None
+    self.status = None
+    self.validation_time = None
+    self.network_time = None
+    self.decode_time = None
+    self.request_bytes = None
+    self.response_bytes = None
+    self.error = None
+    self._hooks = hooks
+    self._response = None
+    self._mark = perf_counter()
+
+  def _lap(self):
+    now = perf_counter()
+    elapsed, self._mark = now - self._mark, now
+    return elapsed
+
+  def sending(self, uri):
+    self.validation_time = self._lap()
+    self.uri = uri
+    for hook in self._hooks.before_send:
+      hook(self)
+
+  def received(self, response, body=None):
+    self.network_time = self._lap()
+    self.status = response.status_code
+    request = getattr(response, 'request', None)
+    self.request_bytes = _body_length(request.body if request is not None else body)
+    self._response = response
+
+  def finished(self, result):
+    self.decode_time = self._lap()
+    self._count_response()
+    if isinstance(result, CouchError):
+      self.error = result
+      hooks = self._hooks.on_error
+    else:
+      hooks = self._hooks.after_response
+    for hook in hooks:
+      hook(self)
+
+  def failed(self, error):
+    elapsed = self._lap()
+    if self.validation_time is None:
+      self.validation_time = elapsed
+    elif self.network_time is None:
+      self.network_time = elapsed
+    else:
+      self.decode_time = elapsed
+    self._count_response()
+    self.error = error
+    for hook in self._hooks.on_error:
+      hook(self)
+
+  def _count_response(self):
+    response, self._response = self._response, None
+    if response is not None:
+      self.response_bytes = _response_length(response)
+
+  def __repr__(self):
+    return f'RequestEvent({self.method.upper()} {self.uri or self.template} -> {self.status})'
+
+
+def _body_length(body):
+  if body is None:
+    return 0
+  if isinstance(body, (bytes, bytearray, str)):
+    return len(body)
+  # MultipartBody knows its length, open files do not
+  try:
+    return len(body)
+  except TypeError:
+    return None
+
+
+def _response_length(response):
+  # requests only holds the body once it has been read; AsyncResponse and cached responses always hold it
+  content = getattr(response, '_content', None)
+  if content is None:
+    content = getattr(response, 'content', None)
+  if isinstance(content, (bytes, bytearray)):
+    return len(content)
+
+  length = response.headers.get('Content-Length', None)
+  return int(length) if length is not None else None
@@ -0,0 +1,124 @@
+from collections.abc import Mapping, Sequence
+from re import compile as compile_regex
+
+# one "member": scalar pair at the top level of an object, followed by the next separator
+_LEADING_MEMBER = compile_regex(
+  rb'\s*"((?:[^"\\]|\\.)*)"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null)\s*([,}])')
+_OPENING = compile_regex(rb'\s*([\[{])')
+
+
+class LazyDocument(Mapping):
+  """
+  Read-only mapping over an encoded JSON object that is only decoded when a member is read.  Scalar members at the
+  start of the object (such as _id and _rev of a document, ok, id and rev of a save result, or total_rows and
+  offset of a view response) are read without decoding the rest of the body.
+
+  Attributes:
+  :param bytes raw: The encoded body, e.g. to pass on to another service unchanged.
+
+  Usage:
+    doc = couch.db.get_doc(uri_segments={'docid': 'some-id'}, response_mode='lazy')
+    doc['_rev']   # read from the start of the body
+    doc['items']  # decodes the whole document
+  """
+
+  __slots__ = ('raw', '_codec', '_value', '_head', '_head_complete')
+
+  def __init__(self, raw, codec):
+    self.raw = raw
+    self._codec = codec
+    self._value = None
+    self._head = None
+    self._head_complete = False
+
+  @property
+  def value(self):
+    """
+    The decoded object.
+    """
+    if self._value is None:
+      self._value = self._codec.decode(self.raw)
+    return self._value
+
+  def __getitem__(self, key):
+    if self._value is None:
+      if self._head is None:
+        self._scan_head()
+      if key in self._head:
+        return self._head[key]
+      if self._head_complete:
+        raise KeyError(key)
+    return self.value[key]
+
+  def __iter__(self):
+    return iter(self.value)
+
+  def __len__(self):
+    return len(self.value)
+
+  def __repr__(self):
+    return f'LazyDocument({self.raw[:64]!r}{"..." if len(self.raw) > 64 else ""})'
+
+  def _scan_head(self):
+    head = {}
+    opening = _OPENING.match(self.raw)
+    position = opening.end() if opening is not None else len(self.raw)
+    while True:
+      member = _LEADING_MEMBER.match(self.raw, position)
+      if member is None:
+        break
+      key = member.group(1)
+      head[self._codec.decode(b'"' + key + b'"') if b'\\' in key else key.decode('utf-8')] = self._codec.decode(member.group(2))
+      position = member.end()
+      if member.group(3) == b'}':
+        self._head_complete = True
+        break
+    self._head = head
+
+
+class LazyArray(Sequence):
+  """
+  Read-only sequence over an encoded JSON array (such as a _bulk_docs result) that is only decoded when an item
+  is read.
+
+  Attributes:
+  :param bytes raw: The encoded body.
+  """
+
+  __slots__ = ('raw', '_codec', '_value')
+
+  def __init__(self, raw, codec):
+    self.raw = raw
+    self._codec = codec
+    self._value = None
+
+  @property
+  def value(self):
+    """
+    The decoded list.
+    """
+    if self._value is None:
+      self._value = self._codec.decode(self.raw)
+    return self._value
+
+  def __getitem__(self, index):
+    return self.value[index]
+
+  def __len__(self):
+    return len(self.value)
+
+  def __repr__(self):
+    return f'LazyArray({self.raw[:64]!r}{"..." if len(self.raw) > 64 else ""})'
+
+
+def lazy_response(raw, codec):
+  """
+  Wraps an encoded response body in a LazyDocument, or a LazyArray when the body is an array.  Anything else is
+  small enough to be decoded right away.
+  """
+  opening = _OPENING.match(raw)
+  if opening is None:
+    return codec.decode(raw)
+  if opening.group(1) == b'[':
+    return LazyArray(raw, codec)
+  return LazyDocument(raw, codec)
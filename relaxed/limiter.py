@@ -0,0 +1,165 @@
+import threading
+import time
+
+REQUEST_CLASSES = ('read', 'write', 'view')
+
+
+class TokenBucket():
+  """
+  Limits the rate of requests: tokens accumulate at rate per second up to burst, and every request takes one,
+  waiting for it when the bucket is empty.
+
+  Attributes:
+  :param float rate: Requests per second allowed on average.
+  :param int burst: Requests that may be sent at once after an idle period. (Default: rate, at least 1)
+  :param int waited: Number of requests that had to wait for a token.
+  """
+
+  def __init__(self, rate, burst=None, **kwargs):
+    self.rate = float(rate)
+    self.burst = float(burst if burst is not None else max(rate, 1))
+    self.clock = kwargs.get('clock', time.monotonic)
+    self.sleep = kwargs.get('sleep', time.sleep)
+
+    self.waited = 0
+    self._tokens = self.burst
+    self._updated = self.clock()
+    self._lock = threading.Lock()
+
+  def acquire(self):
+    waited = False
+    while True:
+      with self._lock:
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return
+        delay = (1 - self._tokens) / self.rate
+        if not waited:
+          waited = True
+          self.waited += 1
+      self.sleep(delay)
+
+
+class AdaptiveLimiter():
+  """
+  Limits the number of requests in flight with a limit that adapts to how the cluster copes, additive increase /
+  multiplicative decrease (AIMD) style: every response that arrives in time raises the limit by about one per
+  limit responses, i.e. by one per round trip, while a 429 or 503, a failed request, or a response slower than
+  latency_target multiplies it by backoff.  The limit is decreased at most once per round trip, so a burst of
+  failures of requests sent together counts as one congestion signal.
+
+  Attributes:
+  :param int limit: Current limit. (Default: initial)
+  :param int initial: Limit to start from. (Default: 8)
+  :param int min_limit: Lowest limit. (Default: 1)
+  :param int max_limit: Highest limit. (Default: 256)
+  :param float backoff: Factor applied to the limit on congestion. (Default: 0.5)
+  :param float latency_target: Seconds above which a response counts as congestion. (Default: None, i.e. only
+    429, 503 and failures do)
+  :param int inflight: Requests currently in flight.
+  :param int throttled: Number of congestion signals received.
+  """
+
+  CONGESTION_STATUSES = frozenset((429, 503))
+
+  def __init__(self, **kwargs):
+    self.min_limit = kwargs.get('min_limit', 1)
+    self.max_limit = kwargs.get('max_limit', 256)
+    self.limit = float(kwargs.get('initial', 8))
+    self.backoff = kwargs.get('backoff', 0.5)
+    self.latency_target = kwargs.get('latency_target', None)
+    self.clock = kwargs.get('clock', time.monotonic)
+
+    self.inflight = 0
+    self.throttled = 0
+    self._decreased_at = None
+    self._latency = None
+    self._condition = threading.Condition()
+
+  def acquire(self):
+    with self._condition:
+      while self.inflight >= int(self.limit):
+        self._condition.wait()
+      self.inflight += 1
+
+  def cancel(self):
+    """
+    Ends a request that was abandoned before it could tell anything about the cluster.
+    """
+    with self._condition:
+      self.inflight -= 1
+      self._condition.notify()
+
+  def release(self, elapsed=None, status=None):
+    """
+    Ends a request, adapting the limit to its response time and to the status it was answered with, or None
+    when it failed without a response.
+    """
+    with self._condition:
+      self.inflight -= 1
+      if elapsed is not None:
+        self._latency = elapsed if self._latency is None else 0.8 * self._latency + 0.2 * elapsed
+
+      congested = (status is None or status in self.CONGESTION_STATUSES
+                   or (self.latency_target is not None and elapsed is not None and elapsed > self.latency_target))
+      if congested:
+        self.throttled += 1
+        now = self.clock()
+        if self._decreased_at is None or now - self._decreased_at >= (self._latency or 0):
+          self._decreased_at = now
+          self.limit = max(float(self.min_limit), self.limit * self.backoff)
+      elif status < 500:
+        self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+      self._condition.notify_all()
+
+  def as_dict(self):
+    return {'limit': int(self.limit), 'inflight': self.inflight, 'throttled': self.throttled}
+
+
+class RequestLimiter():
+  """
+  Client side governor for every request of a session, so that a batch job keeps its throughput near what the
+  cluster can serve without starving interactive traffic.  Requests are classed as reads, writes or view queries
+  (views, _find and _explain); each class can have its own concurrency limit and its own rate.  Classes without a
+  limit or a rate are not limited, and neither are long lived feeds (_changes, _db_updates).  A streamed response
+  (iter_view, iter_docs, iter_find, stream=True, response_mode='columnar') holds its slot until it is closed, which
+  the row streams do once they are exhausted; close responses obtained with stream=True when done with them.
+
+  Attributes:
+  :param dict limits: AdaptiveLimiter for any of 'read', 'write' and 'view'. (Default: None)
+  :param dict rates: TokenBucket for any of 'read', 'write' and 'view'. (Default: None)
+
+  Usage:
+    limiter = RequestLimiter(limits={'read': AdaptiveLimiter(initial=16, max_limit=64),
+                                     'write': AdaptiveLimiter(initial=4, max_limit=16, latency_target=0.5),
+                                     'view': AdaptiveLimiter(initial=2, max_limit=8)},
+                             rates={'write': TokenBucket(rate=200, burst=50)})
+    couch = CouchDB(limiter=limiter)
+  """
+
+  def __init__(self, **kwargs):
+    self.limits = dict(kwargs.get('limits', None) or {})
+    self.rates = dict(kwargs.get('rates', None) or {})
+    for name in list(self.limits) + list(self.rates):
+      if name not in REQUEST_CLASSES:
+        raise ValueError(f'Unknown request class "{name}", expected one of {", ".join(REQUEST_CLASSES)}.')
+
+  def acquire(self, request_class):
+    """
+    Waits until a request of request_class may be sent.
+
+    :returns the AdaptiveLimiter to release once the request completes, or None
+    """
+    bucket = self.rates.get(request_class, None)
+    if bucket is not None:
+      bucket.acquire()
+    limiter = self.limits.get(request_class, None)
+    if limiter is not None:
+      limiter.acquire()
+    return limiter
+
+  def as_dict(self):
+    return {name: limiter.as_dict() for name, limiter in self.limits.items()}
@@ -0,0 +1,143 @@
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from .core import CouchError
+
+
+class _LoaderFuture(Future):
+  # asking for the result of a document that is still queued sends its batch right away instead of waiting for
+  # the window to close, so blocking inside a batch scope cannot dead lock
+  def __init__(self, loader):
+    super().__init__()
+    self._loader = loader
+
+  def result(self, timeout=None):
+    if not self.done():
+      self._loader.dispatch()
+    return super().result(timeout)
+
+
+class DocumentLoader():
+  """
+  Coalesces individual document reads into _bulk_get requests.  Reads issued within window seconds of each other,
+  or inside a batch() scope, are deduplicated and fetched with a single Database.bulk_get call, and each caller
+  receives its own document.
+
+  Missing or unreadable documents resolve to a CouchError, the same as Database.get_doc would return.
+
+  Attributes:
+  :param Database db: Database the documents are read from.
+  :param float window: Seconds to wait for further reads after the first one is queued. (Default: 0.002)
+  :param int max_batch: Maximum number of distinct docids per _bulk_get request. (Default: 500)
+
+  Usage:
+    loader = DocumentLoader(couch.db)
+    doc = loader.get_doc('some-id')
+
+    with loader.batch():
+      futures = [loader.load(docid) for docid in docids]
+    docs = [future.result() for future in futures]
+  """
+
+  def __init__(self, db, **kwargs):
+    self.db = db
+    self.window = kwargs.get('window', 0.002)
+    self.max_batch = kwargs.get('max_batch', 500)
+
+    self._lock = threading.Lock()
+    self._pending = {}
+    self._timer = None
+    self._scopes = 0
+
+  def load(self, docid):
+    """
+    Queues docid for the next batch.
+
+    :returns concurrent.futures.Future resolving to the document or a CouchError
+    """
+    with self._lock:
+      future = self._pending.get(docid, None)
+      if future is not None:
+        return future
+
+      future = _LoaderFuture(self)
+      self._pending[docid] = future
+      full = len(self._pending) >= self.max_batch
+      if not full and self._scopes == 0 and self._timer is None:
+        self._timer = threading.Timer(self.window, self.dispatch)
+        self._timer.daemon = True
+        self._timer.start()
+
+    if full:
+      self.dispatch()
+    return future
+
+  def load_many(self, docids):
+    return [self.load(docid) for docid in docids]
+
+  def get_doc(self, docid):
+    """
+    Blocking read of a single document through the loader.
+    """
+    return self.load(docid).result()
+
+  @contextmanager
+  def batch(self):
+    """
+    Holds back every read issued inside the scope and sends them together when the scope exits.
+    """
+    with self._lock:
+      self._scopes += 1
+    try:
+      yield self
+    finally:
+      with self._lock:
+        self._scopes -= 1
+        dispatch = self._scopes == 0
+      if dispatch:
+        self.dispatch()
+
+  def dispatch(self):
+    """
+    Sends every queued read now.
+    """
+    with self._lock:
+      pending, self._pending = self._pending, {}
+      if self._timer is not None:
+        self._timer.cancel()
+        self._timer = None
+
+    if pending:
+      self._fetch(pending)
+
+  def _fetch(self, pending):
+    try:
+      response = self.db.bulk_get(data={'docs': [{'id': docid} for docid in pending]}, response_mode='json')
+    except Exception as e:
+      for future in pending.values():
+        future.set_exception(e)
+      return
+
+    if isinstance(response, CouchError):
+      for future in pending.values():
+        future.set_result(response)
+      return
+
+    for result in response.get('results', []):
+      future = pending.pop(result.get('id', None), None)
+      if future is not None:
+        future.set_result(self._document(result))
+
+    # anything CouchDB did not mention is treated as missing
+    for future in pending.values():
+      future.set_result(CouchError(error='not_found', reason='missing', code=404))
+
+  def _document(self, result):
+    docs = result.get('docs', [])
+    if docs and 'ok' in docs[0]:
+      return docs[0]['ok']
+
+    error = docs[0].get('error', {}) if docs else {}
+    return CouchError(error=error.get('error', 'not_found'), reason=error.get('reason', None),
+                      code=404 if error.get('error', 'not_found') == 'not_found' else None)
@@ -0,0 +1,241 @@
+import json
+import os
+import tempfile
+import uuid
+from io import BytesIO
+
+from .attachments import attachment_body
+
+
+class MultipartBody():
+  """
+  File-like multipart/related body holding a document and the attachments that follow it, in the format CouchDB
+  accepts for PUT /{db}/{docid}.  Attachment sources are read as the body is sent, one after the other, so only a
+  small part of the request is ever in memory; its length is known up front and sent as Content-Length.
+
+  Attachments are given as a dict of name to source, where a source is bytes, a file path, a binary file-like
+  object, an mmap, or a (source, content_type) tuple.  Attachments of the document whose data is bytes or a file
+  (as read by get_doc(multipart=True)) are sent the same way.
+  """
+
+  def __init__(self, doc, attachments):
+    self.boundary = uuid.uuid4().hex
+    self.content_type = f'multipart/related; boundary="{self.boundary}"'
+    self._releases = []
+
+    doc = dict(doc)
+    stubs = dict(doc.get('_attachments', None) or {})
+    sources = []
+    for name, source in attachments.items():
+      content_type = None
+      if isinstance(source, tuple):
+        source, content_type = source
+      body, content_type, release = self._body(source, name, content_type)
+      self._releases.append(release)
+      length = self._length(body)
+      stubs[name] = {'follows': True, 'content_type': content_type, 'length': length}
+      sources.append((name, content_type, body, length))
+    doc['_attachments'] = stubs
+
+    delimiter = f'--{self.boundary}'.encode('ascii')
+    self._parts = [delimiter + b'\r\nContent-Type: application/json\r\n\r\n',
+                   json.dumps(doc, separators=(',', ':')).encode('utf-8')]
+    for name, content_type, body, length in sources:
+      self._parts.append(b'\r\n' + delimiter + f'\r\nContent-Type: {content_type}\r\n'
+                         f'Content-Disposition: attachment; filename="{name}"\r\n\r\n'.encode('utf-8'))
+      self._parts.append(body)
+    self._parts.append(b'\r\n' + delimiter + b'--')
+
+    self._length_total = sum(len(part) if isinstance(part, bytes) else self._length(part) for part in self._parts)
+    self._readers = [BytesIO(part) if isinstance(part, bytes) else part for part in self._parts]
+
+  @classmethod
+  def from_request(cls, kwargs):
+    """
+    Returns the multipart body for an endpoint call, or None when the call has nothing to send as multipart.
+    """
+    doc = kwargs.get('data', None) or {}
+    attachments = dict(kwargs.get('attachments', None) or {})
+    # pre-encoded bodies are sent as they are
+    if isinstance(doc, (bytes, bytearray)):
+      if not attachments:
+        return None
+      doc = json.loads(doc)
+    for name, stub in (doc.get('_attachments', None) or {}).items():
+      data = stub.get('data', None) if isinstance(stub, dict) else None
+      if isinstance(data, bytes) or hasattr(data, 'read'):
+        attachments.setdefault(name, (stub['data'], stub.get('content_type', None)))
+    if not attachments:
+      return None
+
+    doc = dict(doc)
+    doc['_attachments'] = {name: stub for name, stub in (doc.get('_attachments', None) or {}).items()
+                           if name not in attachments}
+    return cls(doc, attachments)
+
+  def __len__(self):
+    return self._length_total
+
+  def read(self, size=-1):
+    chunks = []
+    while self._readers and (size < 0 or size > 0):
+      chunk = self._readers[0].read(size)
+      if not chunk:
+        self._readers.pop(0)
+        continue
+      chunks.append(chunk)
+      if size > 0:
+        size -= len(chunk)
+    return b''.join(chunks)
+
+  def close(self):
+    for release in self._releases:
+      release()
+
+  def _body(self, source, name, content_type):
+    if isinstance(source, (bytes, bytearray)):
+      return BytesIO(bytes(source)), content_type or 'application/octet-stream', lambda: None
+    return attachment_body(source, name=name, content_type=content_type)
+
+  def _length(self, body):
+    if hasattr(body, 'getbuffer'):
+      return len(body.getbuffer()) - body.tell()
+    if hasattr(body, '__len__'):
+      return len(body) - body.tell()
+    return os.fstat(body.fileno()).st_size - body.tell()
+
+
+def multipart_params(params):
+  """
+  Query parameters for a multipart/related document read: attachments are requested inline and atts_since is
+  encoded as the JSON array CouchDB expects.
+  """
+  params = dict(params or {})
+  params['attachments'] = 'true'
+  if isinstance(params.get('atts_since', None), (list, tuple)):
+    params['atts_since'] = json.dumps(list(params['atts_since']))
+  return params
+
+
+def iter_parts(chunks, boundary, spill=None):
+  """
+  Splits a multipart body arriving as chunks of bytes into (headers, body) pairs, one part at a time.  With spill,
+  a body longer than spill bytes is written to a temporary file as it arrives and given as that file, positioned
+  at its start, instead of as bytes.
+  """
+  delimiter = b'\r\n--' + boundary
+  # a delimiter at the very start of the body is not preceded by a line break
+  buffer = bytearray(b'\r\n')
+  chunks = iter(chunks)
+
+  def fill():
+    chunk = next(chunks, None)
+    if chunk is None:
+      return False
+    buffer.extend(chunk)
+    return True
+
+  def find(needle):
+    start = 0
+    while True:
+      index = buffer.find(needle, start)
+      if index >= 0:
+        return index
+      start = max(0, len(buffer) - len(needle) + 1)
+      if not fill():
+        raise ValueError('truncated multipart body')
+
+  def spool():
+    # moves the body out of the buffer as it arrives, keeping back only what could be the start of the delimiter
+    body = None
+    start = 0
+    while True:
+      index = buffer.find(delimiter, start)
+      end = index if index >= 0 else max(0, len(buffer) - len(delimiter) + 1)
+      if body is None and end > spill:
+        body = tempfile.TemporaryFile()
+      if body is not None:
+        body.write(buffer[:end])
+        del buffer[:end]
+        end = 0
+      if index >= 0:
+        if body is None:
+          data = bytes(buffer[:index])
+          del buffer[:index + len(delimiter)]
+          return data
+        del buffer[:len(delimiter)]
+        body.seek(0)
+        return body
+      start = end
+      if not fill():
+        raise ValueError('truncated multipart body')
+
+  del buffer[:find(delimiter) + len(delimiter)]
+  while True:
+    while len(buffer) < 2:
+      if not fill():
+        raise ValueError('truncated multipart body')
+    if buffer[:2] == b'--':
+      return
+
+    end = find(b'\r\n\r\n')
+    headers = {}
+    for line in bytes(buffer[2:end]).decode('latin-1').split('\r\n'):
+      if ':' in line:
+        key, value = line.split(':', 1)
+        headers[key.strip().lower()] = value.strip()
+    del buffer[:end + 4]
+
+    if spill is None:
+      index = find(delimiter)
+      yield headers, bytes(buffer[:index])
+      del buffer[:index + len(delimiter)]
+    else:
+      yield headers, spool()
+
+
+def boundary_of(content_type):
+  for param in content_type.split(';')[1:]:
+    key, _, value = param.strip().partition('=')
+    if key.lower() == 'boundary':
+      return value.strip('"').encode('ascii')
+  return None
+
+
+def read_multipart_doc(response, chunk_size=65536, spill_size=None):
+  """
+  Decodes a multipart/related document response: the document comes first, followed by the body of every
+  attachment marked follows, which is stored as bytes under the attachment's data.  Plain JSON responses (sent
+  when the document has no attachments to return) are decoded as usual.
+
+  With spill_size, attachments longer than spill_size bytes are written to temporary files as they arrive instead
+  of being kept in memory; their data is then the file, positioned at its start and removed once closed.
+  """
+  content_type = response.headers.get('Content-Type', '')
+  if not content_type.startswith('multipart/'):
+    return response.json()
+
+  parts = iter_parts(response.iter_content(chunk_size=chunk_size), boundary_of(content_type), spill_size)
+  try:
+    _, body = next(parts)
+    if not isinstance(body, bytes):
+      with body:
+        body = body.read()
+    doc = json.loads(body)
+    following = [name for name, stub in (doc.get('_attachments', None) or {}).items() if stub.get('follows', False)]
+    for index, (headers, body) in enumerate(parts):
+      name = _filename(headers.get('content-disposition', '')) or following[index]
+      stub = doc['_attachments'][name]
+      stub.pop('follows', None)
+      stub['data'] = body
+  finally:
+    response.close()
+  return doc
+
+
+def _filename(disposition):
+  for param in disposition.split(';')[1:]:
+    key, _, value = param.strip().partition('=')
+    if key.lower() == 'filename':
+      return value.strip('"')
+  return None
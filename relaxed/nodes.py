@@ -0,0 +1,223 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .scheduler import shared_scheduler
+
+
+class Node():
+  """
+  A single CouchDB node of a NodePool and what the pool knows about it.
+
+  Attributes:
+  :param str address: Scheme, host and port of the node, e.g. 'http://10.0.0.1:5984'.
+  :param int outstanding: Requests currently in flight to the node.
+  :param float latency: Exponentially weighted moving average of the node's response time, in seconds.
+  :param bool healthy: False while the node is ejected.
+  :param int failures: Consecutive failed requests or probes.
+  :param int requests: Requests sent to the node so far.
+  """
+
+  __slots__ = ('address', 'outstanding', 'latency', 'healthy', 'failures', 'requests', 'ejected_at')
+
+  def __init__(self, address):
+    self.address = address.rstrip('/')
+    self.outstanding = 0
+    self.latency = None
+    self.healthy = True
+    self.failures = 0
+    self.requests = 0
+    self.ejected_at = None
+
+  def __repr__(self):
+    return f'Node({self.address!r}, healthy={self.healthy}, outstanding={self.outstanding})'
+
+
+class NodePool():
+  """
+  Spreads the requests of a session over the nodes of a cluster, so that no single node coordinates every request
+  and no proxy is needed in front of the cluster.
+
+  Requests go to the healthy node with the fewest requests in flight ('least_outstanding'), or to the better of
+  two randomly chosen healthy nodes by average latency weighted by requests in flight ('latency').  A node is
+  ejected after eject_after consecutive failures (connection errors, timeouts and 502, 503 and 504 responses) or
+  a failed /_up probe, and readmitted once a probe succeeds again.  Without probes (probe_interval=0) an ejected
+  node is readmitted for a trial after readmit_after seconds.  When every node is ejected, the one ejected the
+  longest ago is used rather than failing without trying.
+
+  A request that failed without a response is sent again to another node when its method is idempotent.
+
+  Attributes:
+  :param list nodes: Addresses of the nodes, e.g. ['http://10.0.0.1:5984', 'http://10.0.0.2:5984'].
+  :param str strategy: 'least_outstanding' or 'latency'. (Default: least_outstanding)
+  :param int eject_after: Consecutive failures that eject a node. (Default: 3)
+  :param float readmit_after: Seconds after which an ejected node is tried again when no probes run. (Default: 30)
+  :param float probe_interval: Seconds between /_up probes of every node, 0 disables them. (Default: 10)
+  :param float probe_timeout: Timeout of a single probe. (Default: 2)
+  :param float decay: Weight of the newest response time in the latency average. (Default: 0.3)
+
+  Usage:
+    couch = CouchDB(nodes=['http://10.0.0.1:5984', 'http://10.0.0.2:5984', 'http://10.0.0.3:5984'],
+                    load_balancing='latency', username='admin', password='secret', auto_connect=True)
+    couch.session.node_pool.as_dict()
+  """
+
+  STRATEGIES = ('least_outstanding', 'latency')
+  FAILURE_STATUSES = frozenset((502, 503, 504))
+  FAILOVER_METHODS = frozenset(('get', 'head', 'put', 'delete'))
+
+  def __init__(self, nodes, **kwargs):
+    if not nodes:
+      raise ValueError('A NodePool needs at least one node.')
+
+    self.nodes = [node if isinstance(node, Node) else Node(node) for node in nodes]
+    self.strategy = kwargs.get('strategy', 'least_outstanding')
+    if self.strategy not in self.STRATEGIES:
+      raise ValueError(f'Unknown load balancing strategy "{self.strategy}", expected one of {", ".join(self.STRATEGIES)}.')
+    self.eject_after = kwargs.get('eject_after', 3)
+    self.readmit_after = kwargs.get('readmit_after', 30)
+    self.probe_interval = kwargs.get('probe_interval', 10)
+    self.probe_timeout = kwargs.get('probe_timeout', 2)
+    self.decay = kwargs.get('decay', 0.3)
+    self.clock = kwargs.get('clock', time.monotonic)
+
+    self.ejections = 0
+    self.readmissions = 0
+    self._transport = None
+    self._probe_job = None
+    self._lock = threading.Lock()
+
+  def __del__(self):
+    if getattr(self, '_probe_job', None) is not None:
+      shared_scheduler().cancel(self._probe_job)
+
+  def as_dict(self):
+    return {'ejections': self.ejections, 'readmissions': self.readmissions,
+            'nodes': {node.address: {'healthy': node.healthy, 'outstanding': node.outstanding,
+                                     'latency': node.latency, 'requests': node.requests} for node in self.nodes}}
+
+  def start_probing(self, transport):
+    """
+    Probes every node's /_up with transport every probe_interval seconds, on the shared scheduler thread.
+    """
+    self._transport = transport
+    if self.probe_interval and self._probe_job is None:
+      self._probe_job = shared_scheduler().schedule(self.probe, self.probe_interval)
+
+  def acquire(self, exclude=()):
+    """
+    Picks the node for the next request and counts the request as in flight until release().
+    """
+    with self._lock:
+      now = self.clock()
+      if not self.probe_interval or self._transport is None:
+        for node in self.nodes:
+          if not node.healthy and now - node.ejected_at >= self.readmit_after:
+            self._readmit(node)
+            # on trial: its next failure ejects it again
+            node.failures = self.eject_after - 1
+
+      candidates = [node for node in self.nodes if node.healthy and node not in exclude]
+      if not candidates:
+        candidates = [node for node in self.nodes if node.healthy]
+      if not candidates:
+        candidates = [min(self.nodes, key=lambda node: node.ejected_at)]
+
+      node = self._choose(candidates)
+      node.outstanding += 1
+      node.requests += 1
+      return node
+
+  def _choose(self, candidates):
+    if len(candidates) == 1:
+      return candidates[0]
+
+    if self.strategy == 'latency':
+      # power of two choices: nearly as good as the best node, without every client piling onto it
+      first, second = random.sample(candidates, 2)
+      return min(first, second, key=self._cost)
+
+    fewest = min(node.outstanding for node in candidates)
+    return random.choice([node for node in candidates if node.outstanding == fewest])
+
+  def _cost(self, node):
+    # nodes without a measurement yet are tried first so that they get one
+    return (node.latency or 0.0) * (node.outstanding + 1)
+
+  def release(self, node, elapsed=None, status=None):
+    """
+    Records the outcome of a request acquired from the pool: its response time and the status it was answered
+    with, or None when it failed without a response.
+    """
+    failed = status is None or status in self.FAILURE_STATUSES
+    with self._lock:
+      node.outstanding -= 1
+      if failed:
+        self._failed(node)
+        return
+
+      node.failures = 0
+      if elapsed is not None:
+        node.latency = elapsed if node.latency is None else (self.decay * elapsed + (1 - self.decay) * node.latency)
+      if not node.healthy:
+        self._readmit(node)
+
+  def cancel(self, node):
+    """
+    Ends a request acquired from the pool that was never sent, without recording any outcome.
+    """
+    with self._lock:
+      node.outstanding -= 1
+
+  def probe(self):
+    """
+    Requests /_up from every node, ejecting those that do not answer 200 within probe_timeout and readmitting those
+    that do.  Nodes are probed concurrently, so a pass takes at most probe_timeout however many nodes are down and
+    never holds up the other jobs of the shared scheduler thread for longer.
+    """
+    executor = ThreadPoolExecutor(max_workers=len(self.nodes), thread_name_prefix='relaxed-probe')
+    try:
+      probes = [(node, executor.submit(self._probe, node)) for node in self.nodes]
+      done, _ = wait([future for _, future in probes], timeout=self.probe_timeout)
+    finally:
+      # a probe still waiting on its socket finishes on its own
+      executor.shutdown(wait=False)
+
+    for node, future in probes:
+      up = future in done and future.result()
+      with self._lock:
+        if up:
+          node.failures = 0
+          if not node.healthy:
+            self._readmit(node)
+        elif node.healthy:
+          self._eject(node)
+
+  def _probe(self, node):
+    try:
+      response = self._transport.request('get', f'{node.address}/_up', timeout=self.probe_timeout)
+      up = response.status_code == 200
+      response.close()
+      return up
+    except Exception:
+      return False
+
+  def _failed(self, node):
+    node.failures += 1
+    if node.healthy and node.failures >= self.eject_after:
+      self._eject(node)
+    elif not node.healthy:
+      # a failed trial after readmit_after restarts the wait
+      node.ejected_at = self.clock()
+
+  def _eject(self, node):
+    node.healthy = False
+    node.ejected_at = self.clock()
+    self.ejections += 1
+
+  def _readmit(self, node):
+    node.healthy = True
+    node.failures = 0
+    node.ejected_at = None
+    self.readmissions += 1
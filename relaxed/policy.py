@@ -0,0 +1,186 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+  """Requests to the host are failing fast because its circuit is open"""
+  pass
+
+
+class RetryPolicy():
+  """
+  Retries requests that failed on the way (connection errors and timeouts) or were answered with a transient
+  status, waiting an exponentially growing, jittered delay between attempts.  A Retry-After header sent with a 429
+  or 503 is honoured instead of the computed delay, up to max_backoff.
+
+  Only idempotent methods are retried, and only when their body can be sent again (not when it streams from an
+  open file), so a retry can never apply a change twice.
+
+  Attributes:
+  :param int retries: Attempts made after the first one. (Default: 3)
+  :param float backoff: Delay before the first retry, doubled for every following one. (Default: 0.1)
+  :param float max_backoff: Longest delay between two attempts, including delays asked for with Retry-After. (Default: 10)
+  :param bool jitter: Wait a random delay between 0 and the computed one ("full jitter"), so that clients failing
+    together do not retry together. (Default: True)
+  :param tuple statuses: Response statuses that are retried. (Default: (429, 502, 503, 504))
+  :param tuple methods: Methods that are retried. (Default: ('get', 'head', 'put', 'delete'))
+  :param int retried: Number of retries made so far.
+  :param int exhausted: Number of requests that still failed after their last retry.
+
+  Usage:
+    couch = CouchDB(retry_policy=RetryPolicy(retries=5, backoff=0.2), circuit_breaker=CircuitBreaker())
+  """
+
+  def __init__(self, **kwargs):
+    self.retries = kwargs.get('retries', 3)
+    self.backoff = kwargs.get('backoff', 0.1)
+    self.max_backoff = kwargs.get('max_backoff', 10)
+    self.jitter = kwargs.get('jitter', True)
+    self.statuses = frozenset(kwargs.get('statuses', (429, 502, 503, 504)))
+    self.methods = frozenset(kwargs.get('methods', ('get', 'head', 'put', 'delete')))
+    self.sleep = kwargs.get('sleep', time.sleep)
+
+    self.retried = 0
+    self.exhausted = 0
+    self._lock = threading.Lock()
+
+  def as_dict(self):
+    return {'retried': self.retried, 'exhausted': self.exhausted}
+
+  def retry(self, method, attempt, status=None):
+    """
+    Returns whether attempt (0 for the first) of a request with method should be followed by another one, given
+    the status it was answered with, or None when it failed without a response.
+    """
+    if method not in self.methods or (status is not None and status not in self.statuses):
+      return False
+
+    with self._lock:
+      if attempt < self.retries:
+        self.retried += 1
+        return True
+      self.exhausted += 1
+      return False
+
+  def delay(self, attempt, response=None):
+    """
+    Seconds to wait before the attempt following attempt.
+    """
+    if response is not None and response.status_code in (429, 503):
+      retry_after = _retry_after(response.headers.get('Retry-After', None))
+      if retry_after is not None:
+        return min(retry_after, self.max_backoff)
+
+    delay = min(self.backoff * (2 ** attempt), self.max_backoff)
+    return random.uniform(0, delay) if self.jitter else delay
+
+
+class _Circuit():
+  __slots__ = ('failures', 'opened_at', 'trial_at')
+
+  def __init__(self):
+    self.failures = 0
+    self.opened_at = None
+    self.trial_at = None
+
+
+class CircuitBreaker():
+  """
+  Tracks consecutive failures per host and, once failure_threshold of them happened in a row, fails every request
+  to that host with CircuitOpenError for reset_timeout seconds instead of letting threads queue behind a node that
+  is down.  After reset_timeout a single trial request is let through: its success closes the circuit again, its
+  failure keeps it open for another reset_timeout.
+
+  Connection errors, timeouts and 502, 503 and 504 responses count as failures; any other response shows the node
+  is up.
+
+  Attributes:
+  :param int failure_threshold: Consecutive failures that open a host's circuit. (Default: 5)
+  :param float reset_timeout: Seconds a circuit stays open before a trial request is let through. (Default: 30)
+  :param int opened: Number of times a circuit was opened.
+  :param int rejected: Number of requests failed fast because their host's circuit was open.
+  """
+
+  FAILURE_STATUSES = frozenset((502, 503, 504))
+
+  def __init__(self, **kwargs):
+    self.failure_threshold = kwargs.get('failure_threshold', 5)
+    self.reset_timeout = kwargs.get('reset_timeout', 30)
+    self.clock = kwargs.get('clock', time.monotonic)
+
+    self.opened = 0
+    self.rejected = 0
+    self._circuits = {}
+    self._lock = threading.Lock()
+
+  def as_dict(self):
+    return {'opened': self.opened, 'rejected': self.rejected,
+            'open': sorted(host for host, circuit in self._circuits.items() if circuit.opened_at is not None)}
+
+  def is_open(self, host):
+    circuit = self._circuits.get(host, None)
+    return circuit is not None and circuit.opened_at is not None
+
+  def before(self, host):
+    """
+    Raises CircuitOpenError if a request to host must not be sent now.
+    """
+    circuit = self._circuits.get(host, None)
+    if circuit is None or circuit.opened_at is None:
+      return
+
+    with self._lock:
+      now = self.clock()
+      if circuit.opened_at is not None and now - circuit.opened_at >= self.reset_timeout:
+        # half open: one trial at a time, and a new one if the last never reported back
+        if circuit.trial_at is None or now - circuit.trial_at >= self.reset_timeout:
+          circuit.trial_at = now
+          return
+      elif circuit.opened_at is None:
+        return
+      self.rejected += 1
+    raise CircuitOpenError(f'Circuit to {host} is open after {circuit.failures} consecutive failures.')
+
+  def record(self, host, status=None):
+    """
+    Records the outcome of a request to host: the status it was answered with, or None when it failed without a
+    response.
+    """
+    failed = status is None or status in self.FAILURE_STATUSES
+    circuit = self._circuits.get(host, None)
+    if circuit is None:
+      if not failed:
+        return
+      with self._lock:
+        circuit = self._circuits.setdefault(host, _Circuit())
+
+    with self._lock:
+      if not failed:
+        circuit.failures = 0
+        circuit.opened_at = circuit.trial_at = None
+        return
+
+      circuit.failures += 1
+      if circuit.trial_at is not None or (circuit.opened_at is None and circuit.failures >= self.failure_threshold):
+        if circuit.opened_at is None:
+          self.opened += 1
+        circuit.opened_at = self.clock()
+        circuit.trial_at = None
+
+
+def _retry_after(value):
+  # either a number of seconds or an HTTP date
+  if value is None:
+    return None
+  try:
+    return max(float(value), 0)
+  except ValueError:
+    pass
+  try:
+    return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+  except (TypeError, ValueError, IndexError):
+    return None
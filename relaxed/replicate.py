@@ -0,0 +1,214 @@
+import hashlib
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .bulk import BulkWriter
+from .core import CouchError
+
+# per document errors that sending the document again cannot fix, e.g. a rejection by validate_doc_update
+PERMANENT_ERRORS = frozenset(('forbidden', 'unauthorized'))
+
+
+class Replicator():
+  """
+  Replicates one database into another from the client, following the CouchDB replication protocol: changes are
+  read from the source in batches (style=all_docs), the revisions the target lacks are found with _revs_diff,
+  read from the source with _bulk_get (revs=true) and stored on the target with _bulk_docs (new_edits=false).
+
+  Batches move through a fetch stage and a write stage running on their own thread pools, so reading changes,
+  fetching revisions and writing them overlap.  Once every batch up to a sequence has been written, that
+  sequence is checkpointed in a _local document on the target, and a later run resumes from it.
+
+  Attributes:
+  :param Database source: Database replicated from.
+  :param Database target: Database replicated to. It must exist.
+  :param int batch_size: Number of changes per batch. (Default: 500)
+  :param int fetch_workers: Number of batches fetched from the source concurrently. (Default: 2)
+  :param int write_workers: Number of batches written to the target concurrently. (Default: 2)
+  :param bool attachments: Replicate attachments inline, sending only those added since the revisions the target
+    already has. (Default: True)
+  :param function transform: Called with every document before it is written; returns the document to write, or
+    None to skip it. It must keep _id, _rev and _revisions. (Default: None)
+  :param function on_batch: Called with the report of every batch, in sequence order. (Default: None)
+  :param str replication_id: Id of the checkpoint document. (Default: derived from the source and target)
+  :param dict stats: Totals over the run so far.
+  :param CouchError error: Set if a request failed, a revision could not be read from the source or a document
+    could not be written for any reason but a permanent rejection ('forbidden', 'unauthorized'), in which case
+    the run stops at the last checkpoint so that the next run replicates the batch again.
+
+  Every batch report is a dict with: batch, last_seq, changes, missing_revisions, docs_written,
+  doc_write_failures, seconds, docs_per_second and pending (number of changes on the source past last_seq).
+
+  Usage:
+    replicator = Replicator(source.db, target.db, batch_size=1000, on_batch=print)
+    stats = replicator.run()
+  """
+
+  def __init__(self, source, target, **kwargs):
+    self.source = source
+    self.target = target
+    self.batch_size = kwargs.get('batch_size', 500)
+    self.fetch_workers = kwargs.get('fetch_workers', 2)
+    self.write_workers = kwargs.get('write_workers', 2)
+    self.attachments = kwargs.get('attachments', True)
+    self.transform = kwargs.get('transform', None)
+    self.on_batch = kwargs.get('on_batch', None)
+    self.replication_id = kwargs.get('replication_id', None) or self._replication_id()
+
+    self.stats = {}
+    self.error = None
+    self._checkpoint_rev = None
+
+  def _replication_id(self):
+    endpoints = f'{self.source.session.address}/{self.source._db}>{self.target.session.address}/{self.target._db}'
+    return 'relaxed-' + hashlib.md5(endpoints.encode('utf-8')).hexdigest()
+
+  def run(self, since=None):
+    """
+    Replicates every change made since the last checkpoint (or since the given sequence) and returns the stats.
+    """
+    self.error = None
+    self.stats = {'batches': 0, 'changes': 0, 'missing_revisions': 0, 'docs_written': 0,
+                  'doc_write_failures': 0, 'last_seq': None, 'seconds': 0.0}
+    started = time.time()
+
+    if since is None:
+      since = self._read_checkpoint()
+      if isinstance(since, CouchError):
+        self.error = since
+        return self.stats
+
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=self.fetch_workers) as fetchers, \
+         ThreadPoolExecutor(max_workers=self.write_workers) as writers:
+      batch_number = 0
+      while self.error is None:
+        changes = self.source.get_changes(params={'since': str(since), 'style': 'all_docs', 'limit': self.batch_size},
+                                          response_mode='json')
+        if isinstance(changes, CouchError):
+          self.error = changes
+          break
+
+        results = changes.get('results', [])
+        if results:
+          batch_number += 1
+          batch = {'batch': batch_number, 'last_seq': changes.get('last_seq', None), 'changes': len(results),
+                   'pending': changes.get('pending', None), 'started': time.time()}
+          fetched = fetchers.submit(self._fetch, results)
+          in_flight.append((batch, writers.submit(self._write, fetched)))
+          since = batch['last_seq']
+
+        done = len(results) < self.batch_size
+        while in_flight and (done or len(in_flight) > self.fetch_workers + self.write_workers):
+          batch, written = in_flight.popleft()
+          self._complete(batch, written.result())
+        if done:
+          break
+
+      # after an error, let the batches already submitted finish without checkpointing them
+      for _, written in in_flight:
+        written.result()
+
+    self.stats['seconds'] = time.time() - started
+    return self.stats
+
+  def _fetch(self, results):
+    revs = {change['id']: [rev['rev'] for rev in change.get('changes', [])] for change in results}
+    diff = self.target.get_revs_diff(data=revs, response_mode='json')
+    if isinstance(diff, CouchError):
+      return diff
+
+    requests = []
+    for docid, missing in diff.items():
+      for rev in missing.get('missing', []):
+        request = {'id': docid, 'rev': rev}
+        if self.attachments and missing.get('possible_ancestors', None):
+          request['atts_since'] = missing['possible_ancestors']
+        requests.append(request)
+    if not requests:
+      return [], 0
+
+    params = {'revs': 'true', 'attachments': 'true'} if self.attachments else {'revs': 'true'}
+    response = self.source.bulk_get(params=params, data={'docs': requests}, response_mode='json')
+    if isinstance(response, CouchError):
+      return response
+
+    docs = []
+    for result in response.get('results', []):
+      for entry in result.get('docs', []):
+        if 'ok' in entry:
+          docs.append(entry['ok'])
+        else:
+          # a revision that cannot be read now might be readable later; checkpointing past it would lose it
+          error = entry.get('error', None) or {}
+          return CouchError(error=error.get('error', 'bulk_get_failed'),
+                            reason=f'Revision {error.get("rev", None)} of {result.get("id", None)} could not be read: '
+                                   f'{error.get("reason", None)}')
+    if len(docs) < len(requests):
+      return CouchError(error='bulk_get_failed', reason=f'{len(requests) - len(docs)} revisions were not returned.')
+    return docs, len(requests)
+
+  def _write(self, fetched):
+    fetched = fetched.result()
+    if isinstance(fetched, CouchError):
+      return fetched
+
+    docs, missing = fetched
+    if self.transform is not None:
+      docs = [doc for doc in (self.transform(doc) for doc in docs) if doc is not None]
+    if not docs:
+      return missing, 0, 0
+
+    writer = BulkWriter(self.target, max_docs=self.batch_size, max_workers=1)
+    results = writer.save(docs, new_edits=False)
+    errors = [result for result in results if 'error' in result]
+    for result in errors:
+      # only permanent rejections are counted and checkpointed past, anything else stops the run
+      if result['error'] not in PERMANENT_ERRORS:
+        return CouchError(error=result['error'], reason=f'{result.get("id", None)}: {result.get("reason", None)}')
+    return missing, len(docs) - len(errors), len(errors)
+
+  def _complete(self, batch, written):
+    if isinstance(written, CouchError):
+      self.error = written
+      return
+    if self.error is not None:
+      return
+
+    checkpoint = self._save_checkpoint(batch['last_seq'])
+    if isinstance(checkpoint, CouchError):
+      self.error = checkpoint
+      return
+
+    missing, docs_written, failures = written
+    seconds = time.time() - batch.pop('started')
+    report = dict(batch, missing_revisions=missing, docs_written=docs_written, doc_write_failures=failures,
+                  seconds=seconds, docs_per_second=docs_written / seconds if seconds > 0 else 0.0)
+
+    for key in ('changes', 'missing_revisions', 'docs_written', 'doc_write_failures'):
+      self.stats[key] += report[key]
+    self.stats['batches'] += 1
+    self.stats['last_seq'] = batch['last_seq']
+
+    if self.on_batch is not None:
+      self.on_batch(report)
+
+  def _read_checkpoint(self):
+    checkpoint = self.target.get_local_doc(uri_segments={'docid': self.replication_id}, response_mode='json')
+    if isinstance(checkpoint, CouchError):
+      return '0' if checkpoint.status_code == 404 else checkpoint
+
+    self._checkpoint_rev = checkpoint.get('_rev', None)
+    return checkpoint.get('source_last_seq', '0')
+
+  def _save_checkpoint(self, seq):
+    data = {'source_last_seq': seq, 'updated': time.time()}
+    if self._checkpoint_rev is not None:
+      data['_rev'] = self._checkpoint_rev
+
+    result = self.target.save_local_named_doc(uri_segments={'docid': self.replication_id}, data=data,
+                                             response_mode='json')
+    if not isinstance(result, CouchError):
+      self._checkpoint_rev = result.get('rev', None)
+    return result
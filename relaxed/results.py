@@ -0,0 +1,187 @@
+from array import array
+from collections.abc import Sequence
+
+from .streaming import RowStream
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+
+class Row():
+  """
+  A single row of a ViewResult.
+  """
+
+  __slots__ = ('id', 'key', 'value', 'doc')
+
+  def __init__(self, id, key, value, doc=None):
+    self.id = id
+    self.key = key
+    self.value = value
+    self.doc = doc
+
+  def __eq__(self, other):
+    return isinstance(other, Row) and (self.id, self.key, self.value, self.doc) == (other.id, other.key, other.value, other.doc)
+
+  def __repr__(self):
+    return f'Row(id={self.id!r}, key={self.key!r}, value={self.value!r})'
+
+
+def _numeric_record(value):
+  return type(value) is dict and value and all(type(member) in (int, float) for member in value.values())
+
+
+class _RecordValues(Sequence):
+  # values that are all objects with the same numeric members (e.g. the _stats reduction), kept as one column per
+  # member and rebuilt into dicts only when read
+  __slots__ = ('columns', '_length')
+
+  def __init__(self, columns, length):
+    self.columns = columns
+    self._length = length
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in range(*index.indices(self._length))]
+    return {name: column[index] for name, column in self.columns.items()}
+
+  def __len__(self):
+    return self._length
+
+
+class _ValueColumn():
+  # collects the values of a view one at a time in the most compact form that can hold all of them seen so far:
+  # an array of int64, then of float64, one such column per member for objects with numeric members, and a plain
+  # list once nothing more compact fits, including ints a double cannot hold exactly mixed with floats
+  __slots__ = ('values', 'records', 'length')
+
+  def __init__(self):
+    self.values = array('q')
+    self.records = None
+    self.length = 0
+
+  def append(self, value):
+    self.length += 1
+    if self.records is not None:
+      if _numeric_record(value) and value.keys() == self.records.keys():
+        for name, member in value.items():
+          self.records[name].append(member)
+        return
+      self.values = list(self.result()[0])
+      self.records = None
+
+    values = self.values
+    if isinstance(values, array):
+      if type(value) is int and values.typecode == 'q' and _INT64_MIN <= value <= _INT64_MAX:
+        values.append(value)
+        return
+      # ints only join float64 when the double holds them exactly, e.g. not the _sum of counters past 2**53
+      if type(value) is float or (type(value) is int and float(value) == value):
+        if values.typecode == 'q' and all(float(member) == member for member in values):
+          self.values = values = array('d', values)
+        if values.typecode == 'd':
+          values.append(value)
+          return
+      if self.length == 1 and _numeric_record(value):
+        self.records = {name: _ValueColumn() for name in value}
+        for name, member in value.items():
+          self.records[name].append(member)
+        return
+      self.values = values = list(values)
+    values.append(value)
+
+  def result(self):
+    """
+    Returns the values and, for objects with numeric members, the column of every member.
+    """
+    if self.records is None:
+      return self.values, None
+    columns = {name: column.values for name, column in self.records.items()}
+    return _RecordValues(columns, next(iter(self.records.values())).length), columns
+
+
+class ViewResult(Sequence):
+  """
+  Compact, column oriented result of a view, _all_docs or filter_view request.  Instead of one dict per row it
+  keeps parallel keys, ids and values columns (and docs when include_docs was requested); numeric values are
+  stored in an array of int64 or float64 and objects with numeric members, such as the output of _stats, in one
+  such array per member.  Array columns expose the buffer protocol, so they can be handed to NumPy without
+  copying:
+
+    result = couch.db.get_view(uri_segments={'docid': 'stats', 'view': 'by_day'}, params={'group': 'true'},
+                               response_mode='columnar')
+    totals = numpy.frombuffer(result.values, dtype=result.values.typecode)
+    sums = numpy.frombuffer(result.value_columns['sum'], dtype='d')
+
+  Rows are decoded one at a time from the response as it is read, so the intermediate list of dicts never exists.
+  Indexing or iterating returns slotted Row objects built on demand.
+
+  Attributes:
+  :param list keys: Key of every row.
+  :param list ids: Document id of every row, or None for reduced results.
+  :param values: Value of every row: an array('q') or array('d') when all values are numbers, a sequence of dicts
+    when all values are objects with the same numeric members, otherwise a list.
+  :param dict value_columns: Column per member when values are objects with numeric members, otherwise None.
+  :param list docs: Document of every row when include_docs was requested, otherwise None.
+  :param int total_rows: Total number of rows in the view. (Default: None)
+  :param int offset: Offset of the first row. (Default: None)
+  :param str update_seq: Sequence the view was updated to (requires update_seq=true). (Default: None)
+  """
+
+  __slots__ = ('keys', 'ids', 'values', 'value_columns', 'docs', 'total_rows', 'offset', 'update_seq', 'error')
+
+  def __init__(self, keys, ids, values, docs=None, value_columns=None, total_rows=None, offset=None, update_seq=None):
+    self.keys = keys
+    self.ids = ids
+    self.values = values
+    self.value_columns = value_columns
+    self.docs = docs
+    self.total_rows = total_rows
+    self.offset = offset
+    self.update_seq = update_seq
+    self.error = None
+
+  @classmethod
+  def from_rows(cls, rows, **meta):
+    """
+    Builds a result from any iterable of row dicts.
+    """
+    keys, ids, docs = [], [], []
+    values = _ValueColumn()
+    has_ids = has_docs = False
+    for row in rows:
+      keys.append(row.get('key', None))
+      values.append(row.get('value', None))
+      row_id = row.get('id', None)
+      ids.append(row_id)
+      has_ids = has_ids or row_id is not None
+      doc = row.get('doc', None)
+      docs.append(doc)
+      has_docs = has_docs or 'doc' in row
+    values, value_columns = values.result()
+    return cls(keys, ids if has_ids else None, values, docs if has_docs else None, value_columns, **meta)
+
+  @classmethod
+  def from_response(cls, response, chunk_size=65536):
+    """
+    Builds a result from a (streamed) requests.Response, decoding its rows one at a time.
+    """
+    stream = RowStream(response, chunk_size=chunk_size)
+    result = cls.from_rows(stream)
+    result.total_rows = stream.total_rows
+    result.offset = stream.offset
+    result.update_seq = stream.update_seq
+    result.error = stream.error
+    return result
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in range(*index.indices(len(self.keys)))]
+    return Row(self.ids[index] if self.ids is not None else None, self.keys[index], self.values[index],
+               self.docs[index] if self.docs is not None else None)
+
+  def __len__(self):
+    return len(self.keys)
+
+  def __repr__(self):
+    return f'ViewResult(rows={len(self.keys)}, total_rows={self.total_rows!r})'
@@ -0,0 +1,251 @@
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .core import CouchError
+
+# marks the end of a range in the page queues
+_DONE = object()
+
+
+class ParallelScanner():
+  """
+  Reads a whole _all_docs or view index with several concurrent requests.  The key space is split into ranges
+  whose boundaries are sampled from the index itself (one skip/limit=1 request per boundary), and every range is
+  read page by page with startkey/endkey on a thread pool.  CouchDB walks every skipped row, so sampling a
+  boundary costs time proportional to its offset; with many ranges over a very large index, split() once and
+  reuse the ranges with iter_pages.
+
+  Rows are returned in key order by default, draining the ranges one after the other while the following ranges
+  are already being read into bounded buffers; with ordered=False rows are returned as soon as any range delivers
+  them.
+
+  The number of ranges defaults to the number of shards reported by _shards, so that a scan spreads over the
+  whole cluster, but never fewer than max_workers.  Shards are hash partitioned, so their boundaries cannot be
+  used as key ranges; only their count is.
+
+  Attributes:
+  :param Database db: Database to scan.
+  :param int max_workers: Number of ranges read concurrently. (Default: 4)
+  :param int ranges: Number of ranges the key space is split into. (Default: None, i.e. from _shards)
+  :param int page_size: Rows requested per page. (Default: 1000)
+  :param int buffer: Pages read ahead per range before its worker waits for the caller. (Default: 4)
+  :param list boundaries: (key, docid) of the first row of every range but the first, after a scan started.
+  :param int rows: Number of rows returned so far.
+  :param int pages: Number of pages read so far.
+  :param CouchError error: Set if a request failed, in which case the scan stops.  A request that raises (e.g. a
+    connection error) stops the scan too, and the exception is raised by the iterator.
+
+  Usage:
+    scanner = ParallelScanner(couch.db, max_workers=8)
+    for row in scanner.scan(params={'include_docs': True}):
+      ...
+
+    for row in scanner.scan(ddoc='reports', view='by_date', ordered=False):
+      ...
+  """
+
+  def __init__(self, db, **kwargs):
+    self.db = db
+    self.max_workers = kwargs.get('max_workers', 4)
+    self.ranges = kwargs.get('ranges', None)
+    self.page_size = kwargs.get('page_size', 1000)
+    self.buffer = kwargs.get('buffer', 4)
+
+    self.boundaries = []
+    self.rows = 0
+    self.pages = 0
+    self.error = None
+    self._lock = threading.Lock()
+
+  def scan(self, ddoc=None, view=None, params=None, ordered=True):
+    """
+    Returns an iterator over every row of the view (or of _all_docs when no view is given).
+
+    :param str ddoc: Design document of the view. (Default: None)
+    :param str view: Name of the view. (Default: None, i.e. _all_docs)
+    :param dict params: Additional query parameters sent with every page, e.g. {'include_docs': True}. Key range
+      and paging parameters are managed by the scanner. (Default: None)
+    :param bool ordered: Return the rows in key order. (Default: True)
+    """
+    self.rows = 0
+    self.pages = 0
+    self.error = None
+    fetch = self._fetcher(ddoc, view, self._encode(params or {}))
+    return self._iterate(fetch, ordered)
+
+  def split(self, ddoc=None, view=None, params=None):
+    """
+    Samples the index and returns its key ranges, for callers that read the ranges themselves with iter_pages.
+
+    :returns CouchError if an error occured accessing the couch api
+    :returns list (start, end) of every range, where start and end are (key, docid) boundaries or None at either
+      end of the index
+    """
+    fetch = self._fetcher(ddoc, view, self._encode(params or {}))
+    boundaries = self._sample(fetch, self._range_count())
+    if isinstance(boundaries, CouchError):
+      return boundaries
+    self.boundaries = boundaries
+    edges = [None] + boundaries + [None]
+    return list(zip(edges[:-1], edges[1:]))
+
+  def iter_pages(self, start, end, ddoc=None, view=None, params=None):
+    """
+    Reads the range from start (inclusive) to end (exclusive) page by page.
+
+    :returns iterator of (rows, next) for every page, where next is the boundary the following page starts from,
+      or None after the last page; a CouchError is yielded instead if a request fails
+    """
+    fetch = self._fetcher(ddoc, view, self._encode(params or {}))
+    return self._pages(fetch, start, end)
+
+  def _fetcher(self, ddoc, view, params):
+    if view is None:
+      return lambda extra: self.db.get_docs(params=dict(params, **extra), response_mode='json')
+
+    segments = {'docid': ddoc, 'view': view}
+    return lambda extra: self.db.get_view(uri_segments=segments, params=dict(params, **extra), response_mode='json')
+
+  def _encode(self, params):
+    encoded = {}
+    for key, value in params.items():
+      if isinstance(value, bool):
+        encoded[key] = 'true' if value else 'false'
+      elif key in ('key', 'keys', 'startkey', 'start_key', 'endkey', 'end_key') and not isinstance(value, str):
+        encoded[key] = json.dumps(value)
+      else:
+        encoded[key] = value
+    return encoded
+
+  def _range_count(self):
+    if self.ranges is not None:
+      return self.ranges
+
+    shards = self.db.get_shards(response_mode='json')
+    if isinstance(shards, CouchError):
+      return self.max_workers
+    return max(len(shards.get('shards', {})), self.max_workers)
+
+  def _sample(self, fetch, count):
+    head = fetch({'limit': 0})
+    if isinstance(head, CouchError):
+      return head
+
+    total = head.get('total_rows', 0)
+    boundaries = []
+    for index in range(1, min(count, total)):
+      page = fetch({'limit': 1, 'skip': total * index // count})
+      if isinstance(page, CouchError):
+        return page
+
+      for row in page.get('rows', []):
+        boundary = (row['key'], row.get('id', None))
+        if not boundaries or boundaries[-1] != boundary:
+          boundaries.append(boundary)
+    return boundaries
+
+  def _iterate(self, fetch, ordered):
+    boundaries = self._sample(fetch, self._range_count())
+    if isinstance(boundaries, CouchError):
+      self.error = boundaries
+      return
+    self.boundaries = boundaries
+
+    edges = [None] + boundaries + [None]
+    ranges = list(zip(edges[:-1], edges[1:]))
+    stop = threading.Event()
+    if ordered:
+      queues = [queue.Queue(maxsize=self.buffer) for _ in ranges]
+    else:
+      shared = queue.Queue(maxsize=self.buffer * self.max_workers)
+      queues = [shared] * len(ranges)
+
+    executor = ThreadPoolExecutor(max_workers=self.max_workers)
+    try:
+      for (start, end), pages in zip(ranges, queues):
+        executor.submit(self._read_range, fetch, start, end, pages, stop)
+
+      if ordered:
+        for pages in queues:
+          for row in self._drain(pages, 1):
+            yield row
+      else:
+        for row in self._drain(queues[0], len(ranges)):
+          yield row
+    finally:
+      stop.set()
+      executor.shutdown(wait=False)
+
+  def _drain(self, pages, ranges):
+    while ranges > 0:
+      page = pages.get()
+      if page is _DONE:
+        ranges -= 1
+        continue
+      if isinstance(page, CouchError):
+        self.error = page
+        return
+      if isinstance(page, Exception):
+        raise page
+
+      with self._lock:
+        self.pages += 1
+        self.rows += len(page)
+      for row in page:
+        yield row
+
+  def _read_range(self, fetch, start, end, pages, stop):
+    # every range ends with _DONE, a CouchError or the exception it raised, or the caller would wait for it forever
+    try:
+      for page in self._pages(fetch, start, end):
+        if isinstance(page, CouchError):
+          self._put(pages, page, stop)
+          return
+        if stop.is_set() or not self._put(pages, page[0], stop):
+          return
+    except Exception as error:
+      self._put(pages, error, stop)
+      return
+    self._put(pages, _DONE, stop)
+
+  def _pages(self, fetch, start, end):
+    extra = {'limit': self.page_size + 1}
+    if start is not None:
+      extra.update(self._position('start', start))
+    if end is not None:
+      extra.update(self._position('end', end))
+      extra['inclusive_end'] = 'false'
+
+    while True:
+      page = fetch(extra)
+      if isinstance(page, CouchError):
+        yield page
+        return
+
+      rows = page.get('rows', [])
+      if len(rows) <= self.page_size:
+        yield rows, None
+        return
+
+      # the row past the page is where the next page starts
+      following = (rows[-1]['key'], rows[-1].get('id', None))
+      yield rows[:self.page_size], following
+      extra.update(self._position('start', following))
+
+  def _position(self, side, boundary):
+    key, docid = boundary
+    position = {f'{side}key': json.dumps(key)}
+    if docid is not None:
+      position[f'{side}key_docid'] = docid
+    return position
+
+  def _put(self, pages, item, stop):
+    while not stop.is_set():
+      try:
+        pages.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        continue
+    return False
@@ -0,0 +1,102 @@
+import heapq
+import itertools
+import threading
+import time
+import weakref
+
+
+class _Job():
+  __slots__ = ('callback', 'interval', 'cancelled')
+
+  def __init__(self, callback, interval):
+    self.callback = callback
+    self.interval = interval
+    self.cancelled = False
+
+
+class Scheduler():
+  """
+  Runs periodic jobs for any number of sessions on a single daemon thread, started with the first job.  Jobs hold
+  their callback through a weak reference, so scheduling a session's renewal does not keep the session alive; the
+  job is dropped once the session has been garbage collected.
+
+  Callbacks run one at a time on the scheduler thread and exceptions they raise are ignored, so they should be
+  short (e.g. a single request).
+
+  Usage:
+    job = shared_scheduler().schedule(session.renew_session, 290)
+    shared_scheduler().cancel(job)
+  """
+
+  def __init__(self):
+    self._jobs = []
+    self._counter = itertools.count()
+    self._condition = threading.Condition()
+    self._thread = None
+
+  def __len__(self):
+    with self._condition:
+      return sum(1 for _, _, job in self._jobs if not job.cancelled)
+
+  def schedule(self, callback, interval):
+    """
+    Calls callback every interval seconds, starting interval seconds from now.
+
+    :returns job handle to pass to cancel()
+    """
+    reference = weakref.WeakMethod(callback) if hasattr(callback, '__self__') else (lambda: callback)
+    job = _Job(reference, interval)
+    with self._condition:
+      heapq.heappush(self._jobs, (time.monotonic() + interval, next(self._counter), job))
+      if self._thread is None or not self._thread.is_alive():
+        self._thread = threading.Thread(target=self._run, name='relaxed-scheduler', daemon=True)
+        self._thread.start()
+      self._condition.notify()
+    return job
+
+  def cancel(self, job):
+    with self._condition:
+      job.cancelled = True
+      self._condition.notify()
+
+  def _run(self):
+    while True:
+      with self._condition:
+        while self._jobs and self._jobs[0][2].cancelled:
+          heapq.heappop(self._jobs)
+        if not self._jobs:
+          # nothing left to run; schedule() starts a new thread when needed
+          self._thread = None
+          return
+
+        due, _, job = self._jobs[0]
+        delay = due - time.monotonic()
+        if delay > 0:
+          self._condition.wait(delay)
+          continue
+
+        heapq.heappop(self._jobs)
+        callback = job.callback()
+        if callback is not None:
+          heapq.heappush(self._jobs, (due + job.interval, next(self._counter), job))
+
+      if callback is not None:
+        try:
+          callback()
+        except Exception:
+          pass
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_scheduler():
+  """
+  Returns the process wide scheduler used for session keep alive.
+  """
+  global _shared
+  with _shared_lock:
+    if _shared is None:
+      _shared = Scheduler()
+    return _shared
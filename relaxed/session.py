@@ -1,9 +1,15 @@
-import requests
+import base64
+import binascii
+import threading
 
-from timeloop import Timeloop
-from datetime import timedelta
+import requests
 
 from .core import RelaxedDecorators, CouchError
+from .codec import get_codec
+from .hooks import Hooks
+from .nodes import NodePool
+from .scheduler import shared_scheduler
+from .transport import Transport
 
 # TODO: Refactor to extend requests.Session and not dict
 
@@ -28,10 +34,43 @@ class Session():
   :param str host: Address that the CouchDB server is served from. (Default: http://127.0.0.1)
   :param int port: Port number that the CouchDB server is listening on. (Default: 5984)
   :param int keep_alive: Determines if automatic session renewal will be attempted and at what frequency. If > 0, session renewal is performed every keep_alive seconds. (Default: 0)
+    Renewal of every session in the process runs on one shared scheduler thread.  Independently of keep_alive, a
+    request refused with 401 while username and password are known re-authenticates once, shared by every request
+    that was refused concurrently, and is sent again.
   :param bool auto_connect: Determines if an authentication attempt will be made during instancing of this object. (Default: False)
   :param bool basic_auth: Sets authentication method to the CouchDB server to Basic. If basic authentication is used, auto_connect has no effect. (Default: False)
 
   :param dict custom_headers: Dictionary of custom headers to add to each request to the CouchDB server. (Default: None)
+
+  :param int pool_connections: Number of per-host connection pools kept by the session's transport. (Default: 10)
+  :param int pool_maxsize: Maximum number of keep-alive connections kept open to a single host. (Default: 10)
+  :param bool pool_block: Wait for a free connection instead of opening an unpooled one when all are busy. (Default: False)
+  :param float idle_timeout: Seconds after which idle pooled connections are discarded instead of reused.
+    0 disables the check. (Default: 0)
+  :param Transport transport: An existing transport to share with another session. (Default: None)
+  :param bool trusted: Skips AllowedKeys validation of params and data for every endpoint.  Only use it when the
+    arguments are known to be valid. (Default: False)
+  :param ETagCache etag_cache: Cache revalidating get_doc, get_ddoc, get_view and get_docs responses with their
+    ETag. (Default: None)
+  :param codec: JSON codec used to encode request bodies and decode responses: a codec object or one of 'json',
+    'orjson' and 'ujson'. (Default: None, i.e. orjson or ujson when installed, otherwise json)
+  :param str response_mode: How successful responses are returned: 'json' decodes them, 'raw' returns the body as
+    bytes and 'lazy' returns a LazyDocument (or LazyArray) decoded on first access.  Any endpoint call can override
+    it with response_mode=, where view, _all_docs and filter_view calls also accept 'columnar' to get a compact
+    ViewResult. (Default: json)
+  :param Hooks hooks: Callables notified before every request is sent, after its response was decoded and on
+    errors, with timings and byte counts. Hooks can also be added later with session.hooks.add(). (Default: None)
+  :param RetryPolicy retry_policy: Retries idempotent requests that failed with a connection error or a transient
+    status, with exponential backoff. (Default: None, i.e. no retries)
+  :param CircuitBreaker circuit_breaker: Fails requests fast with CircuitOpenError while the server keeps failing.
+    (Default: None)
+  :param list nodes: Addresses of the nodes of a cluster, e.g. ['http://10.0.0.1:5984', 'http://10.0.0.2:5984'].
+    Requests are spread over the healthy nodes and host and port are ignored. See NodePool. (Default: None)
+  :param str load_balancing: How nodes are chosen: 'least_outstanding' or 'latency'. (Default: least_outstanding)
+  :param float probe_interval: Seconds between /_up probes of every node, 0 disables them. (Default: 10)
+  :param NodePool node_pool: An existing pool to use instead of nodes. (Default: None)
+  :param RequestLimiter limiter: Limits the concurrency and rate of reads, writes and view queries, adapting the
+    limits to the latency and 429/503 responses of the cluster. May be shared by several sessions. (Default: None)
   """
 
   def __init__(self, **kwargs):
@@ -42,18 +81,40 @@ class Session():
     self.custom_headers = kwargs.get('custom_headers', {})  # TODO: implement
 
     self._keep_alive = kwargs.get('keep_alive', 0)
-    self._keep_alive_timeloop = Timeloop()
-    self._keep_alive_timeloop.logger.setLevel('WARNING')
+    self._keep_alive_job = None
 
     self._name = kwargs.get('username', None)
     self._password = kwargs.get('password', None)
     self.auth_token = kwargs.get('auth_token', None)
+    # serializes re-authentication, and the replacement of the token by concurrently received cookies
+    self._auth_lock = threading.Lock()
+    self._token_lock = threading.Lock()
+
+    self.trusted = kwargs.get('trusted', False)
+    self.etag_cache = kwargs.get('etag_cache', None)
+    self.codec = get_codec(kwargs.get('codec', None))
+    self.response_mode = kwargs.get('response_mode', 'json')
+    self.hooks = kwargs.get('hooks', None) if kwargs.get('hooks', None) is not None else Hooks()
+    self.retry_policy = kwargs.get('retry_policy', None)
+    self.circuit_breaker = kwargs.get('circuit_breaker', None)
+    self.limiter = kwargs.get('limiter', None)
 
     self._auto_connect = kwargs.get('auto_connect', False)
 
     self._basic_auth = kwargs.get('basic_auth', False)  # TODO: implement basic auth
     self._admin_party = kwargs.get('admin_party', False)  # TODO: implement admin party
 
+    self.transport = kwargs.get('transport', None) or Transport(**kwargs)
+
+    self.node_pool = kwargs.get('node_pool', None)
+    if (self.node_pool is None and kwargs.get('nodes', None)):
+      self.node_pool = NodePool(kwargs.get('nodes'), strategy=kwargs.get('load_balancing', 'least_outstanding'),
+                                probe_interval=kwargs.get('probe_interval', 10))
+    if (self.node_pool is not None):
+      # the cluster is still identified by one address, e.g. in replication checkpoint ids
+      self.address = self.node_pool.nodes[0].address
+      self.node_pool.start_probing(self.transport)
+
     self._headers = {
       'Content-type': 'application/json',
       'Accept': 'application/json'}
@@ -66,16 +127,57 @@ class Session():
       self.authenticate(data={'name': self._name, 'password': self._password})
 
   def __del__(self):
-    if (self._keep_alive > 0):
-      self._keep_alive_timeloop.stop()
+    if (getattr(self, '_keep_alive_job', None) is not None):
+      shared_scheduler().cancel(self._keep_alive_job)
+
+  @property
+  def transport_stats(self):
+    """
+    Connection reuse counters of the pooled transport shared by every Server, Database and User of this session.
+    """
+    return self.transport.stats
 
   def _create_basic_auth_header(self):
     return requests.auth.HTTPBasicAuth(self._name, self._password)(requests.Request()).headers
 
-  def set_auth_token_from_headers(self, headers):
+  def set_auth_token_from_headers(self, headers, force=False):
     # if a new auth token is issued, include it in the response, otherwise, return the original
-    if ('Set-Cookie' in headers):
-      self.auth_token = headers.get('Set-Cookie').split(';', 2)[0].split('=')[1]
+    if ('Set-Cookie' not in headers):
+      return
+    name, _, token = headers.get('Set-Cookie').split(';', 1)[0].partition('=')
+    if name.strip() != 'AuthSession':
+      return
+
+    # responses to concurrent requests arrive in any order; a cookie issued before the current one is ignored
+    with self._token_lock:
+      issued, current = _issued_at(token), _issued_at(self.auth_token)
+      if force or issued is None or current is None or issued >= current:
+        self.auth_token = token
+
+  def refresh_authentication(self, stale_token):
+    """
+    Authenticates again after a request sent with stale_token was refused.  Only one caller authenticates at a
+    time; callers that waited for it find the token already replaced and use the new one.
+
+    Requests sent without a token are not retried: their 401 is the answer to an anonymous request, not an
+    expired session.
+
+    :returns bool True if a request refused with stale_token should be sent again
+    """
+    if (stale_token is None or self._name is None or self._password is None or self._basic_auth):
+      return False
+
+    with self._auth_lock:
+      if (self.auth_token != stale_token):
+        return True
+      # requests sent meanwhile keep using the stale token and wait here once it is refused
+      response = self.authenticate(data={'name': self._name, 'password': self._password}, stream=True)
+      if isinstance(response, CouchError):
+        return False
+      # the new cookie replaces the refused one whatever the clock of the node that issued it
+      self.set_auth_token_from_headers(response.headers, force=True)
+      response.close()
+      return self.auth_token != stale_token
 
   @RelaxedDecorators.endpoint('/_session', method='post', data_keys={'name': str, 'password': str})
   def authenticate(self, doc):
@@ -108,8 +210,21 @@ class Session():
     Enables or disables keep alive.
     """
     if (isEnabled is False):
-      self._keep_alive_timeloop.stop()
+      if (self._keep_alive_job is not None):
+        shared_scheduler().cancel(self._keep_alive_job)
+        self._keep_alive_job = None
     elif (isEnabled and self._keep_alive > 0 and self.auth_token is not None):
-      if (len(self._keep_alive_timeloop.jobs) == 0):
-        self._keep_alive_timeloop._add_job(func=self.renew_session, interval=timedelta(seconds=self._keep_alive))
-        self._keep_alive_timeloop.start()
+      if (self._keep_alive_job is None):
+        self._keep_alive_job = shared_scheduler().schedule(self.renew_session, self._keep_alive)
+
+
+def _issued_at(token):
+  # AuthSession is the urlsafe base64 encoding of "name:timestamp:hmac" with the timestamp in hex
+  if not token:
+    return None
+  try:
+    decoded = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    # the name cannot hold a colon, the hmac bytes can
+    return int(decoded.split(b':', 2)[1], 16)
+  except (binascii.Error, ValueError, IndexError):
+    return None
@@ -0,0 +1,469 @@
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .core import CouchError
+
+_DISCONNECTS = (requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout)
+
+_STRUCTURAL = re.compile(rb'["\\\[\]{}]')
+_STRING_SPECIAL = re.compile(rb'["\\]')
+_SCALAR_END = re.compile(rb'[,\]}\s]')
+_WHITESPACE = b' \t\r\n'
+
+
+def encode_params(params):
+  """
+  Encodes booleans the way CouchDB expects them in a query string ("true"/"false" rather than "True"/"False").
+  """
+  return {k: (json.dumps(v) if isinstance(v, bool) else v) for k, v in params.items() if v is not None}
+
+
+class ChangesFeed():
+  """
+  Iterator over a database's _changes feed that parses changes line by line as they arrive, so memory use stays
+  constant however long the feed is followed.
+
+  Heartbeats (empty lines) are skipped.  For continuous and longpoll feeds the iterator follows the feed forever,
+  reconnecting from the last seen seq whenever the server ends the response or the connection drops.  A normal
+  feed ends after the last change, but still resumes from the last seen seq if the connection drops mid-way.
+
+  Attributes:
+  :param str last_seq: Sequence of the last change seen, or the last_seq reported by the server.
+  :param int pending: Number of changes the server reported as still pending, if known.
+  :param int heartbeats: Number of heartbeats received.
+  :param CouchError error: Set if reconnecting was refused by the server, in which case iteration stops.
+
+  Usage:
+    feed = couch.db.iter_changes(since='now', feed='continuous', include_docs=True)
+    for change in feed:
+      ...
+  """
+
+  def __init__(self, db, response, params, **kwargs):
+    self._db = db
+    self._response = response
+    self._params = dict(params)
+    self._uri_segments = kwargs.get('uri_segments', None)
+    self._timeout = kwargs.get('timeout', None)
+    self._reconnect_delay = kwargs.get('reconnect_delay', 1)
+    self._max_retries = kwargs.get('max_retries', 5)
+    self._chunk_size = kwargs.get('chunk_size', 1024)
+
+    self._follow = self._params.get('feed', 'normal') in ('continuous', 'longpoll')
+    self.last_seq = self._params.get('since', None)
+    self.pending = None
+    self.heartbeats = 0
+    self.error = None
+    self._closed = False
+    self._changes = self._iterate()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    return next(self._changes)
+
+  def close(self):
+    """
+    Stops following the feed and releases the connection.  May be called from another thread than the one
+    iterating, in which case iteration ends at the next heartbeat or change at the latest.
+    """
+    self._closed = True
+    response, self._response = self._response, None
+    if response is not None:
+      response.close()
+    try:
+      self._changes.close()
+    except ValueError:
+      # the generator is running in another thread; it notices _closed instead
+      pass
+
+  def _reconnect(self):
+    params = dict(self._params)
+    if self.last_seq is not None:
+      params['since'] = str(self.last_seq)
+
+    kwargs = {'params': params, 'stream': True, 'timeout': self._timeout}
+    if self._uri_segments is not None:
+      kwargs['uri_segments'] = self._uri_segments
+    return self._db.get_changes(**kwargs)
+
+  def _iterate(self):
+    failures = 0
+    while not self._closed:
+      response = self._response
+      if response is not None:
+        try:
+          for change in self._parse(response):
+            failures = 0
+            yield change
+          if not self._follow:
+            return
+        except _DISCONNECTS:
+          if self._closed:
+            return
+          failures = self._backoff(failures)
+        except Exception:
+          if self._closed:
+            return
+          raise
+        finally:
+          response.close()
+          self._response = None
+
+      if self._closed:
+        return
+
+      try:
+        response = self._reconnect()
+      except _DISCONNECTS:
+        failures = self._backoff(failures)
+        continue
+
+      if isinstance(response, CouchError):
+        self.error = response
+        return
+      self._response = response
+
+  def _backoff(self, failures):
+    failures += 1
+    if failures > self._max_retries:
+      raise
+    time.sleep(self._reconnect_delay)
+    return failures
+
+  def _parse(self, response):
+    for line in response.iter_lines(chunk_size=self._chunk_size):
+      line = line.strip()
+      if not line:
+        self.heartbeats += 1
+        continue
+
+      for change in self._parse_line(line):
+        if 'seq' in change:
+          self.last_seq = change['seq']
+        yield change
+
+  def _parse_line(self, line):
+    # continuous feeds send one JSON object per line.  normal and longpoll feeds are a single JSON object, but
+    # CouchDB writes it with one result per line:
+    #   {"results":[
+    #   {"seq":...,"id":...,"changes":[...]},
+    #   ],
+    #   "last_seq":"...","pending":0}
+    if line.startswith(b'{"results":['):
+      if line.endswith(b'}'):
+        # the whole feed arrived on a single line (e.g. reformatted by a proxy)
+        body = json.loads(line)
+        self._set_last_seq(body)
+        return body.get('results', [])
+      return []
+
+    if line.startswith(b']'):
+      return []
+
+    if line.startswith(b'"last_seq"'):
+      self._set_last_seq(json.loads(b'{' + line))
+      return []
+
+    change = json.loads(line.rstrip(b','))
+    if 'last_seq' in change and 'id' not in change:
+      self._set_last_seq(change)
+      return []
+    return [change]
+
+  def _set_last_seq(self, body):
+    self.last_seq = body.get('last_seq', self.last_seq)
+    self.pending = body.get('pending', self.pending)
+
+
+class JSONScanner():
+  """
+  Incremental scanner over a stream of byte chunks holding one JSON document.  It only ever buffers the value
+  being read plus one chunk, so a complete row can be sliced out and decoded on its own while the rest of the
+  document is still arriving.
+  """
+
+  def __init__(self, chunks):
+    self._chunks = iter(chunks)
+    self._buffer = bytearray()
+    self._pos = 0
+
+  def _fill(self):
+    chunk = next(self._chunks, None)
+    if chunk is None:
+      raise ValueError('Unexpected end of JSON stream.')
+    self._buffer.extend(chunk)
+
+  def compact(self):
+    """
+    Drops the bytes of values that have already been read.
+    """
+    if self._pos > 65536 or self._pos == len(self._buffer):
+      del self._buffer[:self._pos]
+      self._pos = 0
+
+  def peek(self):
+    """
+    Skips whitespace and returns the next byte without consuming it.
+    """
+    buf = self._buffer
+    while True:
+      while self._pos < len(buf) and buf[self._pos] in _WHITESPACE:
+        self._pos += 1
+      if self._pos < len(buf):
+        return buf[self._pos:self._pos + 1]
+      self._fill()
+
+  def expect(self, token):
+    if self.peek() != token:
+      raise ValueError(f'Malformed JSON stream, expected {token!r}.')
+    self._pos += 1
+
+  def read_value(self):
+    """
+    Returns the undecoded bytes of the next complete JSON value.
+    """
+    first = self.peek()
+    if first in (b'{', b'['):
+      return self._read_until_balanced()
+    if first == b'"':
+      return self._read_string()
+    return self._read_scalar()
+
+  def _take(self, end):
+    value = bytes(self._buffer[self._pos:end])
+    self._pos = end
+    return value
+
+  def _read_string(self):
+    buf = self._buffer
+    i = self._pos + 1
+    while True:
+      match = _STRING_SPECIAL.search(buf, i)
+      if match is None or (buf[match.start()] == 0x5C and match.start() + 1 >= len(buf)):
+        i = len(buf) if match is None else match.start()
+        self._fill()
+        continue
+      i = match.start()
+      if buf[i] == 0x5C:
+        i += 2
+        continue
+      return self._take(i + 1)
+
+  def _read_scalar(self):
+    buf = self._buffer
+    while True:
+      match = _SCALAR_END.search(buf, self._pos)
+      if match is not None:
+        return self._take(match.start())
+      self._fill()
+
+  def _read_until_balanced(self):
+    buf = self._buffer
+    i = self._pos
+    depth = 0
+    in_string = False
+    while True:
+      if in_string:
+        match = _STRING_SPECIAL.search(buf, i)
+        if match is None or (buf[match.start()] == 0x5C and match.start() + 1 >= len(buf)):
+          i = len(buf) if match is None else match.start()
+          self._fill()
+          continue
+        i = match.start()
+        if buf[i] == 0x5C:
+          i += 2
+          continue
+        in_string = False
+        i += 1
+        continue
+
+      match = _STRUCTURAL.search(buf, i)
+      if match is None:
+        i = len(buf)
+        self._fill()
+        continue
+
+      i = match.start()
+      token = buf[i]
+      if token == 0x22:
+        in_string = True
+      elif token in b'{[':
+        depth += 1
+      else:
+        depth -= 1
+        if depth == 0:
+          return self._take(i + 1)
+      i += 1
+
+
+def iter_rows(chunks, on_meta, rows_key='rows'):
+  """
+  Yields the decoded elements of the rows_key array of a streamed JSON object one at a time.  Every other member of
+  the object is decoded and passed to on_meta(key, value) as soon as it has been read.
+  """
+  scanner = JSONScanner(chunks)
+  scanner.expect(b'{')
+  while True:
+    token = scanner.peek()
+    if token == b'}':
+      return
+    if token == b',':
+      scanner.expect(b',')
+      continue
+
+    key = json.loads(scanner.read_value())
+    scanner.expect(b':')
+    if key != rows_key or scanner.peek() != b'[':
+      on_meta(key, json.loads(scanner.read_value()))
+      continue
+
+    scanner.expect(b'[')
+    while True:
+      token = scanner.peek()
+      if token == b']':
+        scanner.expect(b']')
+        break
+      if token == b',':
+        scanner.expect(b',')
+        continue
+      yield json.loads(scanner.read_value())
+      scanner.compact()
+
+
+class RowStream():
+  """
+  Iterator over the rows of an _all_docs, _design_docs, _local_docs or view response.  Rows are decoded one at a
+  time as they arrive, so peak memory is bounded by the size of a single row.
+
+  Attributes:
+  :param int total_rows: Total number of rows in the view, once it has been seen. (Default: None)
+  :param int offset: Offset of the first row, once it has been seen. (Default: None)
+  :param str update_seq: Sequence the view was updated to, once it has been seen (requires update_seq=true).
+  :param dict meta: Every top level member of the response other than rows seen so far.
+  :param CouchError error: Set if the server reported an error after it started sending rows.
+
+  Usage:
+    rows = couch.db.iter_docs(params={'include_docs': 'true'})
+    for row in rows:
+      ...
+  """
+
+  def __init__(self, response, chunk_size=65536):
+    self._response = response
+    self.total_rows = None
+    self.offset = None
+    self.update_seq = None
+    self.meta = {}
+    self.error = None
+    self._rows = iter_rows(response.iter_content(chunk_size=chunk_size), self._set_meta)
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    try:
+      return next(self._rows)
+    except StopIteration:
+      self.close()
+      raise
+
+  def close(self):
+    """
+    Stops reading rows and releases the connection.
+    """
+    self._rows.close()
+    self._response.close()
+
+  def _set_meta(self, key, value):
+    self.meta[key] = value
+    if key in ('total_rows', 'offset', 'update_seq'):
+      setattr(self, key, value)
+    elif key == 'error':
+      self.error = CouchError(error=value, reason=self.meta.get('reason', None), code=self._response.status_code)
+    elif key == 'reason' and self.error is not None:
+      self.error.reason = value
+
+
+class FindStream():
+  """
+  Iterator over every document matched by a Mango query.  Pages are requested with the bookmark of the previous
+  page, and the next page is requested as soon as a page arrives, so it is already on its way while the caller
+  consumes the current one.
+
+  Attributes:
+  :param dict execution_stats: Sum of the execution_stats of every page read so far (requires execution_stats=True).
+  :param int pages: Number of pages read so far.
+  :param str bookmark: Bookmark of the last page read.
+  :param list warnings: Warnings reported by the server, such as a missing index.
+  :param CouchError error: Set if a page request failed, in which case iteration stops.
+  """
+
+  def __init__(self, db, query, page_size, uri_segments=None):
+    self._db = db
+    self._query = query
+    self._page_size = page_size
+    self._uri_segments = uri_segments
+
+    self.execution_stats = {}
+    self.pages = 0
+    self.bookmark = None
+    self.warnings = []
+    self.error = None
+    self._docs = self._iterate()
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    return next(self._docs)
+
+  def close(self):
+    self._docs.close()
+
+  def _fetch(self, bookmark):
+    data = dict(self._query, limit=self._page_size)
+    if bookmark is not None:
+      data['bookmark'] = bookmark
+
+    kwargs = {'data': data, 'response_mode': 'json'}
+    if self._uri_segments is not None:
+      kwargs['uri_segments'] = self._uri_segments
+    return self._db.find(**kwargs)
+
+  def _iterate(self):
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+      page = executor.submit(self._fetch, None)
+      while page is not None:
+        result = page.result()
+        if isinstance(result, CouchError):
+          self.error = result
+          return
+
+        docs = self._record(result)
+        next_bookmark = result.get('bookmark', None)
+        more = len(docs) >= self._page_size and next_bookmark is not None and next_bookmark != self.bookmark
+        self.bookmark = next_bookmark
+        page = executor.submit(self._fetch, next_bookmark) if more else None
+
+        for doc in docs:
+          yield doc
+    finally:
+      executor.shutdown(wait=False)
+
+  def _record(self, result):
+    self.pages += 1
+    if 'warning' in result:
+      self.warnings.append(result['warning'])
+    for key, value in result.get('execution_stats', {}).items():
+      if isinstance(value, (int, float)) and not isinstance(value, bool):
+        self.execution_stats[key] = self.execution_stats.get(key, 0) + value
+    return result.get('docs', [])
@@ -0,0 +1,116 @@
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class TransportStats():
+  """
+  Thread safe counters describing how a Transport has used its connection pools.
+
+  Attributes:
+  :param int requests: Number of requests sent through the transport.
+  :param int connections: Number of new TCP (and TLS) connections that had to be opened.
+  :param int idle_resets: Number of times the pools were emptied because they sat idle longer than idle_timeout.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.requests = 0
+    self.connections = 0
+    self.idle_resets = 0
+
+  @property
+  def reused(self):
+    """
+    Number of requests that were served over an already established connection.
+    """
+    return max(self.requests - self.connections, 0)
+
+  def as_dict(self):
+    return {'requests': self.requests, 'connections': self.connections,
+            'reused': self.reused, 'idle_resets': self.idle_resets}
+
+  def _increment(self, counter):
+    with self._lock:
+      setattr(self, counter, getattr(self, counter) + 1)
+
+
+class _NoCookiePersistence(DefaultCookiePolicy):
+  # the AuthSession cookie is managed by Session.auth_token; never let the pooled session store its own copy
+  def set_ok(self, cookie, request):
+    return False
+
+
+class _CountingAdapter(HTTPAdapter):
+  def __init__(self, stats, **kwargs):
+    # must be available before HTTPAdapter.__init__ calls init_poolmanager
+    self._stats = stats
+    super().__init__(**kwargs)
+
+  def init_poolmanager(self, *args, **kwargs):
+    super().init_poolmanager(*args, **kwargs)
+    stats = self._stats
+
+    class CountingHTTPConnectionPool(HTTPConnectionPool):
+      def _new_conn(self):
+        stats._increment('connections')
+        return super()._new_conn()
+
+    class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+      def _new_conn(self):
+        stats._increment('connections')
+        return super()._new_conn()
+
+    self.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPConnectionPool,
+                                               'https': CountingHTTPSConnectionPool}
+
+
+class Transport():
+  """
+  Pooled, keep-alive HTTP transport shared by every object that talks to the same CouchDB session.
+
+  Attributes:
+  :param int pool_connections: Number of per-host connection pools to keep. (Default: 10)
+  :param int pool_maxsize: Maximum number of connections kept open to a single host. (Default: 10)
+  :param bool pool_block: Block when every connection to a host is busy instead of opening a throw away
+    connection. (Default: False)
+  :param float idle_timeout: Seconds a pool may sit unused before its connections are discarded rather than
+    reused. CouchDB closes idle sockets on its side, so reusing them after a long pause only produces
+    connection resets. 0 disables the check. (Default: 0)
+  """
+
+  def __init__(self, **kwargs):
+    self.pool_connections = kwargs.get('pool_connections', 10)
+    self.pool_maxsize = kwargs.get('pool_maxsize', 10)
+    self.pool_block = kwargs.get('pool_block', False)
+    self.idle_timeout = kwargs.get('idle_timeout', 0)
+
+    self.stats = TransportStats()
+    self._last_used = None
+
+    self._session = requests.Session()
+    self._session.cookies.set_policy(_NoCookiePersistence())
+    adapter = _CountingAdapter(self.stats,
+                               pool_connections=self.pool_connections,
+                               pool_maxsize=self.pool_maxsize,
+                               pool_block=self.pool_block)
+    self._session.mount('http://', adapter)
+    self._session.mount('https://', adapter)
+    self._adapter = adapter
+
+  def request(self, method, url, **kwargs):
+    now = time.monotonic()
+    if (self.idle_timeout and self._last_used is not None and now - self._last_used > self.idle_timeout):
+      self._adapter.poolmanager.clear()
+      self.stats._increment('idle_resets')
+    self._last_used = now
+
+    self.stats._increment('requests')
+    return self._session.request(method.upper(), url, **kwargs)
+
+  def close(self):
+    self._session.close()
@@ -0,0 +1,168 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from .core import CouchError
+
+ALGORITHMS = ('server', 'random', 'sequential', 'utc_random', 'utc_id')
+
+
+class UUIDPool():
+  """
+  Thread safe source of document ids that takes the round trip to /_uuids out of the write path.
+
+  With algorithm='server' ids are fetched from /_uuids in batches of batch_size; a background refill starts as
+  soon as fewer than low_water ids remain, so callers only wait on the network when ids are taken faster than
+  one batch per round trip.  The other algorithms generate ids locally, without any request, the way CouchDB's
+  algorithms of the same name do, so that ids keep their index friendly ordering:
+
+    random      32 random hex digits
+    sequential  26 random hex digits followed by a 6 digit counter growing by a random step; the prefix changes
+                when the counter overflows
+    utc_random  microseconds since the epoch in 14 hex digits followed by 18 random hex digits
+    utc_id      microseconds since the epoch in 14 hex digits followed by utc_id_suffix
+
+  Attributes:
+  :param Server server: Server whose /_uuids is used by the 'server' algorithm. (Default: None)
+  :param str algorithm: One of 'server', 'random', 'sequential', 'utc_random' and 'utc_id'. (Default: server)
+  :param int batch_size: Ids requested per /_uuids request (CouchDB's max_count defaults to 1000). (Default: 1000)
+  :param int low_water: Remaining ids below which a refill starts. (Default: batch_size // 4)
+  :param str utc_id_suffix: Suffix of utc_id ids. (Default: None)
+  :param int requests: Number of /_uuids requests made.
+  :param int waits: Number of times a caller had to wait for ids from the server.
+  :param CouchError error: Set when the last /_uuids request failed.
+
+  Usage:
+    ids = UUIDPool(server=couch.server)
+    couch.db.save_named_doc(uri_segments={'docid': ids.get()}, data=doc)
+    couch.db.bulk_save(data={'docs': [dict(doc, _id=docid) for doc, docid in zip(docs, ids.take(len(docs)))]})
+
+    ids = UUIDPool(algorithm='sequential')
+  """
+
+  def __init__(self, **kwargs):
+    self.server = kwargs.get('server', None)
+    self.algorithm = kwargs.get('algorithm', 'server')
+    if self.algorithm not in ALGORITHMS:
+      raise ValueError(f'Unknown uuid algorithm "{self.algorithm}", expected one of {", ".join(ALGORITHMS)}.')
+    if self.algorithm == 'server' and self.server is None:
+      raise ValueError('The server algorithm needs a Server to request /_uuids from.')
+    if self.algorithm == 'utc_id' and not kwargs.get('utc_id_suffix', None):
+      raise ValueError('The utc_id algorithm needs a utc_id_suffix.')
+
+    self.batch_size = kwargs.get('batch_size', 1000)
+    self.low_water = kwargs.get('low_water', self.batch_size // 4)
+    self.utc_id_suffix = kwargs.get('utc_id_suffix', None)
+    self.clock = kwargs.get('clock', time.time)
+
+    self.requests = 0
+    self.waits = 0
+    self.error = None
+    self._ids = deque()
+    self._refilling = False
+    self._condition = threading.Condition()
+
+    self._prefix = None
+    self._sequence = 0
+    self._last_microseconds = 0
+
+  def get(self):
+    """
+    Returns the next id.
+
+    :returns CouchError if ids had to be requested from the server and the request failed
+    :returns str id
+    """
+    ids = self.take(1)
+    return ids if isinstance(ids, CouchError) else ids[0]
+
+  def take(self, count):
+    """
+    Returns the next count ids.
+
+    :returns CouchError if ids had to be requested from the server and the request failed
+    :returns list of str ids
+    """
+    if self.algorithm != 'server':
+      with self._condition:
+        return [self._generate() for _ in range(0, count)]
+
+    with self._condition:
+      while len(self._ids) < count:
+        if not self._refilling:
+          self._refilling = True
+          self._condition.release()
+          try:
+            error = self._refill(count - len(self._ids))
+          finally:
+            self._condition.acquire()
+          if error is not None:
+            return error
+        else:
+          self.waits += 1
+          self._condition.wait()
+
+      ids = [self._ids.popleft() for _ in range(0, count)]
+      if len(self._ids) < self.low_water and not self._refilling:
+        self._refilling = True
+        threading.Thread(target=self._refill_in_background, name='relaxed-uuids', daemon=True).start()
+      return ids
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    uuid = self.get()
+    if isinstance(uuid, CouchError):
+      raise StopIteration
+    return uuid
+
+  def _refill(self, needed=0):
+    # runs without the lock held; exactly one refill is in flight at a time, and it always ends by waking the
+    # callers waiting for it, even when the request raised
+    fetched = []
+    error = None
+    try:
+      while len(fetched) < max(needed, 1):
+        self.requests += 1
+        response = self.server.generate_uuids(params={'count': self.batch_size}, response_mode='json')
+        if isinstance(response, CouchError):
+          error = response
+          break
+        fetched.extend([response] if isinstance(response, str) else response)
+    except Exception as exception:
+      error = CouchError(error='connection_error', reason=str(exception))
+      raise
+    finally:
+      with self._condition:
+        self._ids.extend(fetched)
+        self.error = error
+        self._refilling = False
+        self._condition.notify_all()
+    return error
+
+  def _refill_in_background(self):
+    try:
+      self._refill()
+    except Exception:
+      # recorded in self.error; the next caller short of ids requests them itself
+      pass
+
+  def _generate(self):
+    if self.algorithm == 'random':
+      return os.urandom(16).hex()
+
+    if self.algorithm == 'sequential':
+      self._sequence += random.randint(1, 0xffe)
+      if self._prefix is None or self._sequence >= 0xfff000:
+        self._prefix = os.urandom(13).hex()
+        self._sequence = random.randint(1, 0xffe)
+      return f'{self._prefix}{self._sequence:06x}'
+
+    # utc ids stay in creation order even when several are made within the same microsecond
+    microseconds = max(int(self.clock() * 1000000), self._last_microseconds + 1)
+    self._last_microseconds = microseconds
+    suffix = os.urandom(9).hex() if self.algorithm == 'utc_random' else self.utc_id_suffix
+    return f'{microseconds:014x}{suffix}'
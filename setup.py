@@ -24,12 +24,14 @@ VERSION = '0.0.1'
 
 # What packages are required for this module to be executed?
 REQUIRED = [
-    'requests', 'timeloop'
+    'requests'
 ]
 
 # What packages are optional?
 EXTRAS = {
-    # 'fancy feature': ['django'],
+    'async': ['aiohttp'],
+    'orjson': ['orjson'],
+    'ujson': ['ujson'],
 }
 
 # The rest you shouldn't have to touch too much :)
@@ -114,9 +116,9 @@ setup(
     # If your package is a single module, use this instead of 'packages':
     # py_modules=['mypackage'],
 
-    # entry_points={
-    #     'console_scripts': ['mycli=mymodule:cli'],
-    # },
+    entry_points={
+        'console_scripts': ['relaxed=relaxed.cli:main'],
+    },
     install_requires=REQUIRED,
     extras_require=EXTRAS,
     include_package_data=True,
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from pytest_httpserver import HTTPServer
+
+from relaxed import AllowedKeys, CouchError, InvalidKeysException
+from relaxed.aio import AsyncCouchDB, AsyncDatabase, AsyncServer, AsyncSession
+from relaxed.db import Database
+from relaxed.server import Server
+from relaxed.session import Session
+
+aiohttp = pytest.importorskip('aiohttp')
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+def run(coroutine_fn):
+  async def runner():
+    async with AsyncCouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='_local') as couch:
+      return await coroutine_fn(couch)
+  return asyncio.run(runner())
+
+
+def test_every_sync_endpoint_has_an_awaitable_twin():
+  for sync_cls, async_cls in [(Server, AsyncServer), (Database, AsyncDatabase), (Session, AsyncSession)]:
+    endpoints = [name for name, attr in vars(sync_cls).items() if hasattr(attr, '_endpoint')]
+    assert len(endpoints) > 0
+    for name in endpoints:
+      assert asyncio.iscoroutinefunction(getattr(async_cls, name))
+
+
+def test_get_info(httpserver: HTTPServer):
+  expected_json = {"couchdb": "Welcome", "version": "1.3.1"}
+  httpserver.expect_request("/",  method="GET").respond_with_json(expected_json)
+
+  response = run(lambda couch: couch.server.get_info())
+  assert response == expected_json
+
+
+def test_errors_are_returned_as_couch_errors(httpserver: HTTPServer):
+  httpserver.expect_request("/_up",  method="GET").respond_with_json({"error": "not_found", "reason": "missing"}, status=404)
+
+  response = run(lambda couch: couch.server.get_server_status())
+  assert isinstance(response, CouchError) is True
+  assert response.status_code == 404
+  assert response.reason == 'missing'
+
+
+def test_allowed_keys_are_validated():
+  with pytest.raises(InvalidKeysException):
+    run(lambda couch: couch.server.get_database_names(params={'nonexisting_key': ''}))
+
+
+def test_unsupported_arguments_raise_before_sending():
+  attachments = {'a.txt': {'content_type': 'text/plain', 'data': b'hello'}}
+  with pytest.raises(ValueError):
+    run(lambda couch: couch.db.save_named_doc(uri_segments={'docid': 'doc'}, data={'a': 1}, attachments=attachments))
+  with pytest.raises(ValueError):
+    run(lambda couch: couch.db.get_doc(uri_segments={'docid': 'doc'}, multipart=True))
+  with pytest.raises(ValueError):
+    run(lambda couch: couch.db.get_view(uri_segments={'docid': 'ddoc', 'view': 'v'}, response_mode='columnar'))
+
+
+def test_post_processing_is_shared_with_sync_client(httpserver: HTTPServer):
+  httpserver.expect_request("/_uuids",  method="GET", query_string="count=1").respond_with_json({"uuids": ["75480ca477454894678e22eec6002413"]})
+
+  response = run(lambda couch: couch.server.generate_uuids(params={'count': 1}))
+  assert response == "75480ca477454894678e22eec6002413"
+
+
+def test_head_endpoints_return_etag(httpserver: HTTPServer):
+  httpserver.expect_request("/_local/testdoc",  method="HEAD").respond_with_json({}, headers={'ETag': 'revidhere'})
+
+  response = run(lambda couch: couch.db.get_doc_info(uri_segments={'docid': 'testdoc'}))
+  assert response == 'revidhere'
+
+
+def test_authenticate_sets_auth_token_and_sends_cookie(httpserver: HTTPServer):
+  httpserver.expect_request("/_session",  method="POST").respond_with_json({"ok": True}, headers={'Set-Cookie': 'AuthSession=cm9vdDo1MEJCRkYwMjq0LO0ylOIwShrgt8y-UkhI-c6BGw; Version=1; Path=/; HttpOnly'})
+  httpserver.expect_request("/_session",  method="GET", headers={'Cookie': 'AuthSession=cm9vdDo1MEJCRkYwMjq0LO0ylOIwShrgt8y-UkhI-c6BGw'}).respond_with_json({"ok": True})
+
+  async def scenario(couch):
+    await couch.session.authenticate(data={'name': 'test', 'password': 'test'})
+    return couch.session.auth_token, await couch.session.get_session_info()
+
+  auth_token, info = run(scenario)
+  assert auth_token == 'cm9vdDo1MEJCRkYwMjq0LO0ylOIwShrgt8y-UkhI-c6BGw'
+  assert info == {"ok": True}
+
+
+def test_many_concurrent_requests(httpserver: HTTPServer):
+  httpserver.expect_request("/_up",  method="GET").respond_with_json({"status": "ok"})
+
+  async def scenario(couch):
+    return await asyncio.gather(*[couch.server.get_server_status() for k in range(0, 50)])
+
+  responses = run(scenario)
+  assert responses == [{"status": "ok"}] * 50
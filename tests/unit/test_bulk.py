@@ -0,0 +1,136 @@
+import json
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from relaxed import BulkWriter, CouchDB
+from relaxed.codec import JSONCodec
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='testdb')
+  yield
+
+
+class BulkDocsHandler():
+  """ answers _bulk_docs like CouchDB, optionally failing the first requests with the given statuses."""
+
+  def __init__(self, failures=None, max_docs=None):
+    self.failures = list(failures or [])
+    self.max_docs = max_docs
+    self.chunk_sizes = []
+
+  def __call__(self, request):
+    body = json.loads(request.data)
+    if self.failures:
+      return Response(json.dumps({"error": "unavailable", "reason": "try later"}), status=self.failures.pop(0), content_type='application/json')
+    if self.max_docs is not None and len(body['docs']) > self.max_docs:
+      return Response(json.dumps({"error": "too_large", "reason": "body too large"}), status=413, content_type='application/json')
+
+    self.chunk_sizes.append(len(body['docs']))
+    if body.get('new_edits', True) is False:
+      results = [{"id": doc['_id'], "error": "forbidden", "reason": "nope"} for doc in body['docs'] if doc['_id'] == 'bad']
+    else:
+      results = [{"ok": True, "id": doc['_id'], "rev": "1-abc"} for doc in body['docs']]
+    return Response(json.dumps(results), status=201, content_type='application/json')
+
+
+def test_bulk_writer_chunks_by_count_and_keeps_input_order(httpserver: HTTPServer):
+  handler = BulkDocsHandler()
+  httpserver.expect_request("/testdb/_bulk_docs", method="POST").respond_with_handler(handler)
+
+  docs = ({'_id': f'doc{k:03}'} for k in range(0, 25))
+  results = BulkWriter(couch.db, max_docs=10, max_workers=3).save(docs)
+
+  assert [result['id'] for result in results] == [f'doc{k:03}' for k in range(0, 25)]
+  assert sorted(handler.chunk_sizes) == [5, 10, 10]
+
+
+def test_bulk_writer_chunks_by_encoded_size(httpserver: HTTPServer):
+  handler = BulkDocsHandler()
+  httpserver.expect_request("/testdb/_bulk_docs", method="POST").respond_with_handler(handler)
+
+  docs = [{'_id': f'doc{k}', 'payload': 'x' * 100} for k in range(0, 6)]
+  results = BulkWriter(couch.db, max_bytes=300).save(docs)
+
+  assert len(results) == 6
+  assert all(size <= 2 for size in handler.chunk_sizes)
+
+
+def test_bulk_writer_retries_transient_failures(httpserver: HTTPServer):
+  handler = BulkDocsHandler(failures=[503, 429])
+  httpserver.expect_request("/testdb/_bulk_docs", method="POST").respond_with_handler(handler)
+
+  results = BulkWriter(couch.db, backoff=0).save([{'_id': 'a'}, {'_id': 'b'}])
+  assert results == [{"ok": True, "id": "a", "rev": "1-abc"}, {"ok": True, "id": "b", "rev": "1-abc"}]
+
+
+def test_bulk_writer_reports_failed_chunks_per_document(httpserver: HTTPServer):
+  handler = BulkDocsHandler(failures=[400])
+  httpserver.expect_request("/testdb/_bulk_docs", method="POST").respond_with_handler(handler)
+
+  results = BulkWriter(couch.db, backoff=0).save([{'_id': 'a'}, {'_id': 'b'}])
+  assert results == [{'id': 'a', 'error': 'unavailable', 'reason': 'try later'},
+                     {'id': 'b', 'error': 'unavailable', 'reason': 'try later'}]
+
+
+def test_bulk_writer_splits_chunks_the_server_refuses_as_too_large(httpserver: HTTPServer):
+  handler = BulkDocsHandler(max_docs=2)
+  httpserver.expect_request("/testdb/_bulk_docs", method="POST").respond_with_handler(handler)
+
+  results = BulkWriter(couch.db).save([{'_id': f'doc{k}'} for k in range(0, 7)])
+  assert [result['id'] for result in results] == [f'doc{k}' for k in range(0, 7)]
+  assert max(handler.chunk_sizes) <= 2
+
+
+def test_bulk_writer_without_new_edits_reports_every_document(httpserver: HTTPServer):
+  handler = BulkDocsHandler()
+  httpserver.expect_request("/testdb/_bulk_docs", method="POST").respond_with_handler(handler)
+
+  results = BulkWriter(couch.db).save([{'_id': 'good', '_rev': '3-x'}, {'_id': 'bad', '_rev': '1-y'}], new_edits=False)
+  assert results == [{'ok': True, 'id': 'good', 'rev': '3-x'}, {"id": "bad", "error": "forbidden", "reason": "nope"}]
+
+
+def test_bulk_writer_retries_ambiguous_failures_only_for_documents_with_ids(httpserver: HTTPServer):
+  handler = BulkDocsHandler(failures=[500, 502])
+  httpserver.expect_request("/testdb/_bulk_docs", method="POST").respond_with_handler(handler)
+
+  # the first attempt may have created the document already, sending it again would create another one
+  results = BulkWriter(couch.db, backoff=0).save([{'_id': 'a'}, {'value': 1}])
+  assert results == [{'id': 'a', 'error': 'unavailable', 'reason': 'try later'},
+                     {'id': None, 'error': 'unavailable', 'reason': 'try later'}]
+  assert handler.failures == [502]
+
+  results = BulkWriter(couch.db, backoff=0).save([{'_id': 'a'}, {'_id': 'b'}])
+  assert [result['id'] for result in results] == ['a', 'b']
+  assert handler.failures == []
+
+
+def test_bulk_writer_encodes_every_document_once_with_the_session_codec(httpserver: HTTPServer):
+  handler = BulkDocsHandler()
+  httpserver.expect_request("/testdb/_bulk_docs", method="POST").respond_with_handler(handler)
+
+  class CountingCodec(JSONCodec):
+    encoded = []
+
+    def encode(self, obj):
+      self.encoded.append(obj)
+      return super().encode(obj)
+
+  codec = CountingCodec()
+  couch = CouchDB(host="http://127.0.0.1", port=8000, db='testdb', codec=codec)
+  docs = [{'_id': f'doc{k}', 'text': 'é'} for k in range(0, 5)]
+  results = BulkWriter(couch.db, max_docs=2).save(docs)
+
+  assert [result['id'] for result in results] == [doc['_id'] for doc in docs]
+  assert codec.encoded == docs
+  assert sorted(handler.chunk_sizes) == [1, 2, 2]
@@ -0,0 +1,199 @@
+import json
+import time
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from relaxed import CouchDB, DocumentCache, ETagCache
+from relaxed.cache import LRU
+from relaxed.codec import JSONCodec
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+def test_lru_evicts_by_entry_count_and_bytes():
+  lru = LRU(max_entries=2, max_bytes=100)
+  lru.put('a', 1, 10)
+  lru.put('b', 2, 10)
+  lru.get('a')
+  lru.put('c', 3, 10)
+  assert 'b' not in lru
+  assert lru.get('a') == 1
+
+  lru.put('d', 4, 95)
+  assert len(lru) == 1
+  assert lru.size == 95
+  assert lru.evictions == 3
+
+  # entries larger than the whole cache are never kept
+  assert lru.put('e', 5, 101) is False
+  assert 'e' not in lru
+
+
+def test_get_doc_revalidates_with_etag(httpserver: HTTPServer):
+  cache = ETagCache()
+  couch = CouchDB(host="http://127.0.0.1", port=8000, db='testdb', etag_cache=cache)
+  doc = {"_id": "doc1", "_rev": "1-abc", "text": "hello"}
+
+  httpserver.expect_oneshot_request("/testdb/doc1", method="GET").respond_with_json(doc, headers={'ETag': '"1-abc"'})
+  httpserver.expect_oneshot_request("/testdb/doc1", method="GET", headers={'If-None-Match': '"1-abc"'}).respond_with_response(Response(status=304, headers={'ETag': '"1-abc"'}))
+
+  first = couch.db.get_doc(uri_segments={'docid': 'doc1'})
+  first['text'] = 'mutated by the caller'
+  second = couch.db.get_doc(uri_segments={'docid': 'doc1'})
+
+  assert second == doc
+  assert cache.stats['hits'] == 1
+  assert cache.stats['misses'] == 1
+  assert cache.stats['revalidations'] == 1
+  assert cache.stats['entries'] == 1
+
+
+def test_changed_documents_replace_the_cached_body(httpserver: HTTPServer):
+  cache = ETagCache()
+  couch = CouchDB(host="http://127.0.0.1", port=8000, db='testdb', etag_cache=cache)
+
+  httpserver.expect_oneshot_request("/testdb/_all_docs", method="GET").respond_with_json({"rows": []}, headers={'ETag': '"a"'})
+  httpserver.expect_oneshot_request("/testdb/_all_docs", method="GET", headers={'If-None-Match': '"a"'}).respond_with_json({"rows": [{"id": "x"}]}, headers={'ETag': '"b"'})
+  httpserver.expect_oneshot_request("/testdb/_all_docs", method="GET", headers={'If-None-Match': '"b"'}).respond_with_response(Response(status=304))
+
+  couch.db.get_docs()
+  assert couch.db.get_docs() == {"rows": [{"id": "x"}]}
+  assert couch.db.get_docs() == {"rows": [{"id": "x"}]}
+  assert cache.stats['hits'] == 1
+  assert cache.stats['misses'] == 2
+
+
+def test_304_is_answered_even_if_the_entry_is_evicted_meanwhile(httpserver: HTTPServer):
+  cache = ETagCache()
+  couch = CouchDB(host="http://127.0.0.1", port=8000, db='testdb', etag_cache=cache)
+  doc = {"_id": "doc1", "_rev": "1-abc"}
+
+  def not_modified(request):
+    # another thread fills the cache while the request is in flight
+    cache.invalidate()
+    return Response(status=304, headers={'ETag': '"1-abc"'})
+
+  httpserver.expect_oneshot_request("/testdb/doc1", method="GET").respond_with_json(doc, headers={'ETag': '"1-abc"'})
+  httpserver.expect_oneshot_request("/testdb/doc1", method="GET", headers={'If-None-Match': '"1-abc"'}).respond_with_handler(not_modified)
+
+  couch.db.get_doc(uri_segments={'docid': 'doc1'})
+  assert couch.db.get_doc(uri_segments={'docid': 'doc1'}) == doc
+  assert cache.stats['hits'] == 1
+
+
+def test_a_shared_cache_keeps_servers_apart(httpserver: HTTPServer):
+  other = HTTPServer('127.0.0.1', 8001)
+  other.start()
+  try:
+    cache = ETagCache()
+    first = CouchDB(host="http://127.0.0.1", port=8000, db='testdb', etag_cache=cache)
+    second = CouchDB(host="http://127.0.0.1", port=8001, db='testdb', etag_cache=cache)
+    httpserver.expect_request("/testdb/doc1", method="GET").respond_with_json({"server": 1}, headers={'ETag': '"1-a"'})
+    other.expect_request("/testdb/doc1", method="GET").respond_with_json({"server": 2}, headers={'ETag': '"1-a"'})
+
+    assert first.db.get_doc(uri_segments={'docid': 'doc1'}) == {"server": 1}
+    assert second.db.get_doc(uri_segments={'docid': 'doc1'}) == {"server": 2}
+    assert 'If-None-Match' not in other.log[0][0].headers
+    assert cache.stats['entries'] == 2
+  finally:
+    other.clear()
+    other.stop()
+
+
+def test_query_parameters_are_part_of_the_cache_key(httpserver: HTTPServer):
+  cache = ETagCache()
+  couch = CouchDB(host="http://127.0.0.1", port=8000, db='testdb', etag_cache=cache)
+
+  httpserver.expect_request("/testdb/_design/ddoc/_view/v", method="GET").respond_with_json({"rows": []}, headers={'ETag': '"v"'})
+  couch.db.get_view(uri_segments={'docid': 'ddoc', 'view': 'v'}, params={'limit': 1})
+  couch.db.get_view(uri_segments={'docid': 'ddoc', 'view': 'v'}, params={'limit': 2})
+
+  assert len(cache) == 2
+  assert cache.revalidations == 0
+
+
+def test_uncacheable_endpoints_ignore_the_cache(httpserver: HTTPServer):
+  cache = ETagCache()
+  couch = CouchDB(host="http://127.0.0.1", port=8000, db='testdb', etag_cache=cache)
+
+  httpserver.expect_request("/testdb", method="GET").respond_with_json({"db_name": "testdb"}, headers={'ETag': '"x"'})
+  couch.db.get()
+  assert len(cache) == 0
+
+
+class ChangesHandler():
+  """ serves an empty continuous _changes response until a change is queued."""
+
+  def __init__(self):
+    self.queued = []
+
+  def __call__(self, request):
+    time.sleep(0.01)
+    body = ''.join(json.dumps(change) + '\n' for change in self.queued) or '\n'
+    self.queued = []
+    return Response(body, content_type='application/json')
+
+
+def wait_for(condition, timeout=5):
+  deadline = time.time() + timeout
+  while not condition() and time.time() < deadline:
+    time.sleep(0.01)
+  assert condition()
+
+
+def test_document_cache_evicts_documents_when_they_change(httpserver: HTTPServer):
+  changes = ChangesHandler()
+  couch = CouchDB(host="http://127.0.0.1", port=8000, db='testdb')
+  httpserver.expect_request("/testdb/_changes", method="GET").respond_with_handler(changes)
+  httpserver.expect_oneshot_request("/testdb/doc1", method="GET").respond_with_json({"_id": "doc1", "_rev": "1-a"})
+  httpserver.expect_oneshot_request("/testdb/doc1", method="GET").respond_with_json({"_id": "doc1", "_rev": "2-b"})
+
+  cache = DocumentCache(couch.db).start()
+  try:
+    assert cache.get_doc('doc1')['_rev'] == '1-a'
+    assert cache.get_doc('doc1')['_rev'] == '1-a'
+    assert cache.stats['hits'] == 1
+
+    changes.queued.append({"seq": "5-x", "id": "doc1", "changes": [{"rev": "2-b"}]})
+    wait_for(lambda: cache.invalidations == 1)
+
+    assert cache.get_doc('doc1')['_rev'] == '2-b'
+    assert cache.stats['misses'] == 2
+  finally:
+    cache.stop()
+
+
+def test_document_cache_warm_start_and_refresh(httpserver: HTTPServer):
+  changes = ChangesHandler()
+  couch = CouchDB(host="http://127.0.0.1", port=8000, db='testdb')
+  httpserver.expect_request("/testdb/_changes", method="GET").respond_with_handler(changes)
+  httpserver.expect_oneshot_request("/testdb/_bulk_get", method="POST").respond_with_json({"results": [
+    {"id": "a", "docs": [{"ok": {"_id": "a", "_rev": "1-a"}}]},
+    {"id": "b", "docs": [{"error": {"id": "b", "error": "not_found", "reason": "missing"}}]}]})
+
+  cache = DocumentCache(couch.db, warm=['a', 'b'], refresh=True).start()
+  try:
+    assert cache.get_doc('a') == {"_id": "a", "_rev": "1-a"}
+    assert cache.stats['hits'] == 1
+
+    changes.queued.append({"seq": "6-x", "id": "a", "changes": [{"rev": "2-a"}], "doc": {"_id": "a", "_rev": "2-a"}})
+    wait_for(lambda: cache.invalidations == 1)
+    assert cache.get_doc('a') == {"_id": "a", "_rev": "2-a"}
+    assert cache.stats['hits'] == 2
+  finally:
+    cache.stop()
+
+
+def test_cached_bodies_are_decoded_with_the_session_codec():
+  class TaggingCodec(JSONCodec):
+    def decode(self, data):
+      return dict(super().decode(data), decoded_by='codec')
+
+  cache = ETagCache()
+  cached = cache.resolve('key', Response(status=304), ('"1-a"', b'{"a": 1}'), TaggingCodec())
+  assert cached.json() == {'a': 1, 'decoded_by': 'codec'}
@@ -0,0 +1,175 @@
+import gzip
+import json
+import os
+import threading
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from relaxed import CouchDB, CouchError
+from relaxed.cli import _parser, dump, main, restore
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='testdb')
+  yield
+
+
+class AllDocsHandler():
+  """ answers _all_docs with include_docs over a fixed set of documents, optionally failing after some requests."""
+
+  def __init__(self, count=30, fail_after=None):
+    self.ids = [f'doc{i:04d}' for i in range(0, count)]
+    self.fail_after = fail_after
+    self.requests = 0
+    self._lock = threading.Lock()
+
+  def __call__(self, request):
+    with self._lock:
+      self.requests += 1
+      if self.fail_after is not None and self.requests > self.fail_after:
+        return Response(json.dumps({"error": "unavailable", "reason": "down"}), status=503, content_type='application/json')
+
+    args = request.args
+    assert args['include_docs'] == 'true'
+    ids = self.ids
+    if 'startkey' in args:
+      ids = [docid for docid in ids if docid >= json.loads(args['startkey'])]
+    if 'endkey' in args:
+      ids = [docid for docid in ids if docid < json.loads(args['endkey'])]
+    ids = ids[int(args.get('skip', 0)):][:int(args['limit'])]
+    rows = [{"id": docid, "key": docid, "value": {"rev": "1-a"}, "doc": {"_id": docid, "_rev": "1-a"}} for docid in ids]
+    return Response(json.dumps({"total_rows": len(self.ids), "offset": 0, "rows": rows}), content_type='application/json')
+
+
+def read_dump(directory):
+  docs = []
+  for name in sorted(os.listdir(directory)):
+    if name.endswith('.ndjson.gz'):
+      with gzip.open(os.path.join(directory, name), 'rb') as f:
+        docs.extend(json.loads(line) for line in f)
+  return docs
+
+
+def test_dump_writes_every_document_once(httpserver: HTTPServer, tmp_path):
+  handler = AllDocsHandler(count=30)
+  httpserver.expect_request("/testdb/_all_docs").respond_with_handler(handler)
+
+  assert dump(couch.db, str(tmp_path), workers=2, ranges=3, page_size=4, log=lambda message: None) == 30
+  assert sorted(doc['_id'] for doc in read_dump(tmp_path)) == handler.ids
+
+  manifest = json.loads((tmp_path / 'manifest.json').read_text())
+  assert manifest['db'] == 'testdb'
+  assert len(manifest['shards']) == 3
+  assert all(shard['done'] for shard in manifest['shards'])
+
+  # a finished dump has nothing left to do
+  assert dump(couch.db, str(tmp_path), workers=2, ranges=3, page_size=4, log=lambda message: None) == 0
+
+
+def test_interrupted_dump_resumes_from_the_checkpoint(httpserver: HTTPServer, tmp_path):
+  failing = AllDocsHandler(count=30, fail_after=6)
+  httpserver.expect_request("/testdb/_all_docs").respond_with_handler(failing)
+
+  result = dump(couch.db, str(tmp_path), workers=1, ranges=2, page_size=4, log=lambda message: None)
+  assert isinstance(result, CouchError)
+  partial = json.loads((tmp_path / 'manifest.json').read_text())
+  assert not all(shard['done'] for shard in partial['shards'])
+
+  httpserver.clear()
+  healthy = AllDocsHandler(count=30)
+  httpserver.expect_request("/testdb/_all_docs").respond_with_handler(healthy)
+
+  resumed = dump(couch.db, str(tmp_path), workers=1, ranges=2, page_size=4, log=lambda message: None)
+  assert resumed < 30
+  assert sorted(doc['_id'] for doc in read_dump(tmp_path)) == healthy.ids
+
+
+def test_restore_replays_with_new_edits_false_and_resumes(httpserver: HTTPServer, tmp_path):
+  httpserver.expect_request("/testdb/_all_docs").respond_with_handler(AllDocsHandler(count=30))
+  dump(couch.db, str(tmp_path), workers=2, ranges=3, page_size=5, log=lambda message: None)
+  first_shard = json.loads((tmp_path / 'manifest.json').read_text())['shards'][0]['file']
+
+  saved = []
+
+  def bulk_docs(request):
+    body = json.loads(request.data)
+    assert body['new_edits'] is False
+    saved.extend(doc['_id'] for doc in body['docs'])
+    return Response(json.dumps([]), status=201, content_type='application/json')
+
+  httpserver.expect_request("/restored/_bulk_docs", method="POST").respond_with_handler(bulk_docs)
+  target = CouchDB(host="http://127.0.0.1", port=8000, db='restored').db
+
+  # pretend an earlier run already saved the first 4 lines of the first shard
+  (tmp_path / 'restore-restored.json').write_text(json.dumps({'shards': {first_shard: {'lines': 4, 'done': False}}}))
+
+  assert restore(target, str(tmp_path), workers=2, batch_size=3, log=lambda message: None) == 0
+  assert len(saved) == 26
+  assert sorted(saved) == [f'doc{i:04d}' for i in range(4, 30)]
+
+  checkpoint = json.loads((tmp_path / 'restore-restored.json').read_text())
+  assert all(progress['done'] for progress in checkpoint['shards'].values())
+
+
+def test_main_dump_command(httpserver: HTTPServer, tmp_path, capsys):
+  httpserver.expect_request("/testdb/_shards").respond_with_json({"shards": {"00000000-7fffffff": [], "80000000-ffffffff": []}})
+  httpserver.expect_request("/testdb/_all_docs").respond_with_handler(AllDocsHandler(count=10))
+
+  assert main(['--host', 'http://127.0.0.1', '--port', '8000', '--workers', '2', 'dump', 'testdb', str(tmp_path)]) == 0
+  assert 'dumped 10 documents' in capsys.readouterr().out
+  assert len(read_dump(tmp_path)) == 10
+
+
+def test_main_restore_creates_the_database(httpserver: HTTPServer, tmp_path, capsys):
+  httpserver.expect_request("/testdb/_all_docs").respond_with_handler(AllDocsHandler(count=10))
+  dump(couch.db, str(tmp_path), workers=2, ranges=2, page_size=5, log=lambda message: None)
+
+  created = []
+  httpserver.expect_request("/restored", method="GET").respond_with_json(
+    {'error': 'not_found', 'reason': 'Database does not exist.'}, status=404)
+  httpserver.expect_request("/restored", method="PUT").respond_with_handler(
+    lambda request: created.append(True) or Response(json.dumps({'ok': True}), status=201,
+                                                     content_type='application/json'))
+  httpserver.expect_request("/restored/_bulk_docs", method="POST").respond_with_json([], status=201)
+
+  assert main(['--host', 'http://127.0.0.1', '--port', '8000', 'restore', str(tmp_path), 'restored', '--create',
+               '--workers', '3']) == 0
+  assert created == [True]
+  assert 'restore complete' in capsys.readouterr().out
+
+
+def test_restore_stops_before_a_batch_that_failed(httpserver: HTTPServer, tmp_path):
+  httpserver.expect_request("/testdb/_all_docs").respond_with_handler(AllDocsHandler(count=10))
+  dump(couch.db, str(tmp_path), workers=1, ranges=1, page_size=10, log=lambda message: None)
+  shard = json.loads((tmp_path / 'manifest.json').read_text())['shards'][0]['file']
+
+  def bulk_docs(request):
+    docs = json.loads(request.data)['docs']
+    errors = {'doc0001': 'forbidden', 'doc0005': 'unknown_error'}
+    return Response(json.dumps([{'id': doc['_id'], 'rev': doc['_rev'], 'error': errors[doc['_id']], 'reason': 'no'}
+                                for doc in docs if doc['_id'] in errors]), status=201, content_type='application/json')
+
+  httpserver.expect_request("/restored/_bulk_docs", method="POST").respond_with_handler(bulk_docs)
+  target = CouchDB(host="http://127.0.0.1", port=8000, db='restored').db
+
+  assert restore(target, str(tmp_path), workers=1, batch_size=4, log=lambda message: None) == 2
+  checkpoint = json.loads((tmp_path / 'restore-restored.json').read_text())
+  # the rejected line is recorded, the batch with the transient failure is left for the next run
+  assert checkpoint['shards'][shard] == {'lines': 4, 'done': False, 'failed': [2]}
+
+
+def test_workers_is_accepted_before_and_after_the_command():
+  assert _parser().parse_args(['--workers', '2', 'dump', 'testdb', 'out']).workers == 2
+  assert _parser().parse_args(['dump', 'testdb', 'out', '--workers', '8']).workers == 8
+  assert _parser().parse_args(['restore', 'out', 'testdb', '--workers', '3']).workers == 3
+  assert _parser().parse_args(['restore', 'out', 'testdb']).workers == 4
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from relaxed import CouchDB, InvalidKeysException
+from relaxed.codec import CODECS, JSONCodec, available_codecs, get_codec
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='testdb', codec='json')
+  yield
+
+
+class CountingCodec(JSONCodec):
+  """ stdlib codec that records how often it was used."""
+
+  def __init__(self):
+    super().__init__()
+    self.encoded = 0
+    self.decoded = 0
+
+  def encode(self, obj):
+    self.encoded += 1
+    return super().encode(obj)
+
+  def decode(self, data):
+    self.decoded += 1
+    return super().decode(data)
+
+
+@pytest.mark.parametrize("name", available_codecs())
+def test_codecs_round_trip(name):
+  codec = get_codec(name)
+  doc = {"_id": "naïve/é", "n": 1, "f": 1.5, "ok": True, "none": None, "list": [1, "two", {"three": 3}], "url": "a/b"}
+
+  encoded = codec.encode(doc)
+  assert isinstance(encoded, bytes)
+  assert json.loads(encoded.decode('utf-8')) == doc
+  assert codec.decode(encoded) == doc
+  assert b'\\/' not in encoded
+
+
+def test_get_codec_picks_the_fastest_installed():
+  assert get_codec().name == available_codecs()[0]
+  assert available_codecs()[-1] == 'json'
+
+
+def test_get_codec_rejects_unknown_names():
+  with pytest.raises(ValueError):
+    get_codec('yaml')
+  assert set(CODECS) == {'json', 'orjson', 'ujson'}
+
+
+def test_session_codec_encodes_and_decodes(httpserver: HTTPServer):
+  codec = CountingCodec()
+  couch = CouchDB(host="http://127.0.0.1", port=8000, db='testdb', codec=codec)
+  httpserver.expect_request("/testdb/_find", method="POST", json={"selector": {"a": 1}}).respond_with_json({"docs": []})
+
+  assert couch.db.find(data={"selector": {"a": 1}}) == {"docs": []}
+  assert (codec.encoded, codec.decoded) == (1, 1)
+
+
+def test_pre_encoded_bodies_are_sent_unchanged_and_not_validated(httpserver: HTTPServer):
+  body = b'{"docs":[{"_id":"a"},{"_id":"b"}],"new_edits":false}'
+  received = {}
+
+  def handler(request):
+    received['body'] = request.get_data()
+    return Response(json.dumps([]), status=201, content_type='application/json')
+
+  httpserver.expect_request("/testdb/_bulk_docs", method="POST").respond_with_handler(handler)
+
+  assert couch.db.bulk_save(data=body) == []
+  assert received['body'] == body
+
+  with pytest.raises(InvalidKeysException):
+    couch.db.bulk_save(data={"documents": []})
+
+
+def test_pre_encoded_named_docs_are_sent_unchanged(httpserver: HTTPServer):
+  body = b'{"a":1}'
+  received = {}
+
+  def handler(request):
+    received['body'] = request.get_data()
+    received['type'] = request.headers['Content-Type']
+    return Response(json.dumps({'ok': True, 'id': 'd', 'rev': '1-a'}), status=201, content_type='application/json')
+
+  httpserver.expect_request("/testdb/d", method="PUT").respond_with_handler(handler)
+
+  assert couch.db.save_named_doc(uri_segments={'docid': 'd'}, data=body) == {'ok': True, 'id': 'd', 'rev': '1-a'}
+  assert received == {'body': body, 'type': 'application/json'}
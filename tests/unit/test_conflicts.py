@@ -0,0 +1,132 @@
+import json
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from relaxed import CouchDB, ConflictResolver
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='testdb')
+  yield
+
+
+class FakeCouch():
+  """ doc0 to doc4 each have a winner 2-b and a conflicting 2-a; doc5 has a deleted leaf only; doc6 has none."""
+
+  def __init__(self):
+    self.leaves = {}
+    for i in range(0, 5):
+      self.leaves[f'doc{i}'] = {'2-b': {'_id': f'doc{i}', '_rev': '2-b', 'n': i, 'side': 'b'},
+                                '2-a': {'_id': f'doc{i}', '_rev': '2-a', 'n': i * 10, 'side': 'a'}}
+    self.leaves['doc5'] = {'3-c': {'_id': 'doc5', '_rev': '3-c'}, '2-d': {'_id': 'doc5', '_rev': '2-d', '_deleted': True}}
+    self.leaves['doc6'] = {'1-a': {'_id': 'doc6', '_rev': '1-a'}}
+    self.bulk_gets = 0
+    self.written = []
+    self.conflicting = set()
+
+  def changes(self, request):
+    assert request.args['style'] == 'all_docs'
+    since = int(request.args['since'])
+    limit = int(request.args['limit'])
+    ids = sorted(self.leaves)[since:since + limit]
+    results = [{'id': docid, 'seq': str(since + index + 1),
+                'changes': [{'rev': rev} for rev in sorted(self.leaves[docid], reverse=True)]}
+               for index, docid in enumerate(ids)]
+    return Response(json.dumps({'results': results, 'last_seq': since + len(ids)}), content_type='application/json')
+
+  def bulk_get(self, request):
+    self.bulk_gets += 1
+    docs = json.loads(request.data)['docs']
+    results = [{'id': doc['id'], 'docs': [{'ok': self.leaves[doc['id']][doc['rev']]}]} for doc in docs]
+    return Response(json.dumps({'results': results}), content_type='application/json')
+
+  def bulk_docs(self, request):
+    docs = json.loads(request.data)['docs']
+    self.written.extend(docs)
+    results = [{'id': doc['_id'], 'error': 'conflict', 'reason': 'Document update conflict.'}
+               if doc['_id'] in self.conflicting else {'id': doc['_id'], 'rev': '3-x'} for doc in docs]
+    return Response(json.dumps(results), status=201, content_type='application/json')
+
+  def serve(self, httpserver):
+    httpserver.expect_request('/testdb/_changes', method='GET').respond_with_handler(self.changes)
+    httpserver.expect_request('/testdb/_bulk_get', method='POST').respond_with_handler(self.bulk_get)
+    httpserver.expect_request('/testdb/_bulk_docs', method='POST').respond_with_handler(self.bulk_docs)
+
+
+def test_losing_revisions_are_deleted_in_bulk(httpserver: HTTPServer):
+  fake = FakeCouch()
+  fake.serve(httpserver)
+
+  resolver = ConflictResolver(couch.db, batch_size=2)
+  stats = resolver.resolve()
+
+  assert resolver.error is None
+  assert stats == {'conflicted': 5, 'merged': 0, 'deleted_revisions': 5, 'write_failures': 0, 'batches': 3}
+  assert sorted((doc['_id'], doc['_rev'], doc['_deleted']) for doc in fake.written) == \
+    [(f'doc{i}', '2-a', True) for i in range(0, 5)]
+  assert fake.bulk_gets == 3
+
+
+def test_merge_builds_the_winner(httpserver: HTTPServer):
+  fake = FakeCouch()
+  fake.serve(httpserver)
+
+  def merge(docid, leaves):
+    assert [leaf['_rev'] for leaf in leaves] == ['2-b', '2-a']
+    # keep the losing side, with the sum of both
+    return dict(leaves[1], n=sum(leaf['n'] for leaf in leaves))
+
+  stats = ConflictResolver(couch.db, merge=merge).resolve()
+
+  assert stats['merged'] == 5 and stats['deleted_revisions'] == 5
+  written = {(doc['_id'], doc['_rev']): doc for doc in fake.written}
+  assert written[('doc2', '2-a')] == {'_id': 'doc2', '_rev': '2-a', 'n': 22, 'side': 'a'}
+  assert written[('doc2', '2-b')] == {'_id': 'doc2', '_rev': '2-b', '_deleted': True}
+
+
+def test_leaves_are_kept_when_the_winner_is_not_saved(httpserver: HTTPServer):
+  fake = FakeCouch()
+  fake.conflicting.add('doc2')
+  fake.serve(httpserver)
+
+  stats = ConflictResolver(couch.db, merge=lambda docid, leaves: dict(leaves[1], merged=True)).resolve()
+
+  assert stats['merged'] == 4 and stats['deleted_revisions'] == 4
+  # the failed winner and the deletion skipped because of it
+  assert stats['write_failures'] == 2
+  assert [doc for doc in fake.written if doc['_id'] == 'doc2'] == \
+    [{'_id': 'doc2', '_rev': '2-a', 'n': 20, 'side': 'a', 'merged': True}]
+  # every winner is written before any leaf is deleted
+  assert [doc.get('_deleted', False) for doc in fake.written] == [False] * 5 + [True] * 4
+
+
+def test_conflicts_found_in_a_view(httpserver: HTTPServer):
+  fake = FakeCouch()
+  fake.serve(httpserver)
+  rows = [{'id': 'doc1', 'key': 'doc1', 'value': None,
+           'doc': {'_id': 'doc1', '_rev': '2-b', '_conflicts': ['2-a']}}]
+  httpserver.expect_request('/testdb/_design/conflicts/_view/all', method='GET').respond_with_json(
+    {'total_rows': 1, 'offset': 0, 'rows': rows})
+
+  resolver = ConflictResolver(couch.db, view=('conflicts', 'all'))
+  assert list(resolver.find()) == [('doc1', ['2-b', '2-a'])]
+  assert resolver.resolve()['deleted_revisions'] == 1
+  assert fake.written == [{'_id': 'doc1', '_rev': '2-a', '_deleted': True}]
+
+
+def test_stops_on_errors(httpserver: HTTPServer):
+  httpserver.expect_request('/testdb/_changes', method='GET').respond_with_json({'error': 'unauthorized'}, status=401)
+
+  resolver = ConflictResolver(couch.db)
+  assert resolver.resolve()['batches'] == 0
+  assert resolver.error.status_code == 401
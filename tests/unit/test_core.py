@@ -32,3 +32,43 @@ def test_get_a_valid_user(httpserver: HTTPServer):
   response = couch.user.get(id='testuser')
 
   assert response == expected_json
+
+def test_endpoint_plan_percent_encodes_segments():
+  from relaxed.core import EndpointPlan
+
+  plan = EndpointPlan('/:db:/:docid:/:attname:')
+  assert plan.build_uri({'db': 'a/b', 'docid': 'some id?', 'attname': 'dir/file name.txt'}) == '/a%2Fb/some%20id%3F/dir/file%20name.txt'
+  assert plan.build_uri({'db': 'db', 'docid': '_design/my/ddoc', 'attname': 'x'}) == '/db/_design/my%2Fddoc/x'
+
+  with pytest.raises(Exception):
+    plan.build_uri({'db': 'db'})
+
+  assert EndpointPlan('/_up').build_uri(None) == '/_up'
+
+
+def test_endpoint_plan_validates_value_types():
+  from relaxed.core import EndpointPlan
+
+  plan = EndpointPlan('/:db:/_find', method='post', data_keys=AllowedKeys.DATABASE__FIND__DATA,
+                      query_keys=AllowedKeys.DATABASE__CHANGES__PARAMS)
+
+  plan.validate_data({'selector': {}, 'limit': 10, 'execution_stats': True, 'bookmark': 'abc'})
+  for invalid in [{'limit': '10'}, {'limit': True}, {'execution_stats': 1}, {'bookmark': 5}, {'nonexisting_key': 1}, ['limit']]:
+    with pytest.raises(InvalidKeysException):
+      plan.validate_data(invalid)
+
+  # query parameters may be passed pre-encoded
+  plan.validate_params({'limit': '10', 'include_docs': 'true', 'since': 'now'})
+  with pytest.raises(InvalidKeysException):
+    plan.validate_params({'limit': [10]})
+
+
+def test_trusted_session_skips_validation(httpserver: HTTPServer):
+  expected_json = ["_users"]
+  httpserver.expect_request("/_all_dbs",  method="GET").respond_with_json(expected_json)
+
+  trusted = CouchDB(host="http://127.0.0.1", port=8000, trusted=True)
+  assert trusted.server.get_database_names(params={'nonexisting_key': ''}) == expected_json
+
+  with pytest.raises(InvalidKeysException):
+    couch.server.get_database_names(params={'nonexisting_key': ''})
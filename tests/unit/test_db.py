@@ -1,7 +1,13 @@
+import io
+import json
+import mmap
+
 import pytest
 from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
 
 from relaxed import AllowedKeys, CouchDB, CouchError, InvalidKeysException
+from relaxed.multipart import iter_parts
 from relaxed.server import Server
 
 
@@ -24,3 +30,155 @@ def test_get_doc_info(httpserver: HTTPServer):
   response = couch.db.get_doc_info(uri_segments={'docid': 'testdoc'})
 
   assert response == expected
+
+
+def test_get_attachment_returns_bytes(httpserver: HTTPServer):
+  body = bytes(range(0, 256))
+  httpserver.expect_request("/_local/testdoc/blob.bin").respond_with_data(body, content_type='application/octet-stream')
+
+  assert couch.db.get_attachment(uri_segments={'docid': 'testdoc', 'attname': 'blob.bin'}) == body
+
+
+def test_iter_attachment_yields_chunks(httpserver: HTTPServer):
+  body = bytes(range(0, 256)) * 40
+  httpserver.expect_request("/_local/testdoc/blob.bin").respond_with_data(body, content_type='image/png')
+
+  stream = couch.db.iter_attachment(chunk_size=1024, uri_segments={'docid': 'testdoc', 'attname': 'blob.bin'})
+  chunks = list(stream)
+
+  assert stream.content_type == 'image/png'
+  assert stream.content_length == len(body)
+  assert all(len(chunk) <= 1024 for chunk in chunks)
+  assert b''.join(chunks) == body
+
+
+def test_download_attachment_into_a_file(httpserver: HTTPServer, tmp_path):
+  body = b'\x00\xff' * 5000
+  httpserver.expect_request("/_local/_design/app/logo.png").respond_with_data(body, content_type='image/png')
+
+  destination = tmp_path / 'logo.png'
+  written = couch.db.download_ddoc_attachment(str(destination), uri_segments={'docid': 'app', 'attname': 'logo.png'})
+
+  assert written == len(body)
+  assert destination.read_bytes() == body
+
+
+def test_download_attachment_errors(httpserver: HTTPServer):
+  httpserver.expect_request("/_local/testdoc/missing.bin").respond_with_json({"error": "not_found", "reason": "missing"}, status=404)
+
+  response = couch.db.download_attachment(io.BytesIO(), uri_segments={'docid': 'testdoc', 'attname': 'missing.bin'})
+  assert isinstance(response, CouchError)
+  assert response.status_code == 404
+
+
+@pytest.mark.parametrize("kind", ["path", "file", "mmap"])
+def test_upload_attachment_streams_the_source(httpserver: HTTPServer, tmp_path, kind):
+  body = bytes(range(0, 256)) * 100
+  path = tmp_path / 'report.pdf'
+  path.write_bytes(body)
+  received = {}
+
+  def handler(request):
+    received.update(body=request.get_data(), content_type=request.headers.get('Content-Type'), rev=request.args.get('rev'))
+    return Response(json.dumps({"ok": True, "id": "testdoc", "rev": "2-b"}), status=201, content_type='application/json')
+
+  httpserver.expect_request("/_local/testdoc/report.pdf", method="PUT").respond_with_handler(handler)
+
+  with open(path, 'rb') as f:
+    source = {'path': str(path), 'file': f, 'mmap': mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)}[kind]
+    response = couch.db.upload_attachment(source, uri_segments={'docid': 'testdoc', 'attname': 'report.pdf'}, params={'rev': '1-a'})
+
+  assert response['rev'] == '2-b'
+  assert received == {'body': body, 'content_type': 'application/pdf', 'rev': '1-a'}
+
+
+def test_save_named_doc_with_attachments_sends_one_multipart_request(httpserver: HTTPServer, tmp_path):
+  path = tmp_path / 'photo.png'
+  path.write_bytes(b'\x89PNG' + bytes(range(0, 256)) * 10)
+  received = {}
+
+  def handler(request):
+    received.update(content_type=request.headers.get('Content-Type'), length=request.headers.get('Content-Length'),
+                    body=request.get_data())
+    return Response(json.dumps({"ok": True, "id": "testdoc", "rev": "1-a"}), status=201, content_type='application/json')
+
+  httpserver.expect_request("/_local/testdoc", method="PUT").respond_with_handler(handler)
+  response = couch.db.save_named_doc(uri_segments={'docid': 'testdoc'}, data={'title': 'holiday'},
+                                     attachments={'photo.png': str(path), 'notes.txt': (b'hello', 'text/plain')})
+  assert response['rev'] == '1-a'
+
+  boundary = received['content_type'].split('boundary=')[1].strip('"').encode('ascii')
+  assert received['content_type'].startswith('multipart/related')
+  assert int(received['length']) == len(received['body'])
+
+  parts = list(iter_parts([received['body']], boundary))
+  doc = json.loads(parts[0][1])
+  assert doc['title'] == 'holiday'
+  assert doc['_attachments'] == {'photo.png': {'follows': True, 'content_type': 'image/png', 'length': 2564},
+                                 'notes.txt': {'follows': True, 'content_type': 'text/plain', 'length': 5}}
+  assert parts[1][1] == path.read_bytes()
+  assert parts[1][0]['content-disposition'] == 'attachment; filename="photo.png"'
+  assert parts[2][1] == b'hello'
+
+
+def test_get_doc_multipart_returns_attachment_bodies(httpserver: HTTPServer):
+  doc = {'_id': 'testdoc', '_rev': '2-b', '_attachments': {
+    'old.txt': {'stub': True, 'content_type': 'text/plain', 'length': 3, 'revpos': 1},
+    'new.bin': {'follows': True, 'content_type': 'application/octet-stream', 'length': 4, 'revpos': 2}}}
+  body = (b'--abc\r\nContent-Type: application/json\r\n\r\n' + json.dumps(doc).encode('utf-8') +
+          b'\r\n--abc\r\nContent-Disposition: attachment; filename="new.bin"\r\nContent-Type: application/octet-stream\r\n\r\n'
+          b'\x00\r\n\xff\r\n--abc--')
+
+  httpserver.expect_request("/_local/testdoc", query_string={'attachments': 'true', 'atts_since': '["1-a"]'},
+                            headers={'Accept': 'multipart/related'}).respond_with_data(body, content_type='multipart/related; boundary="abc"')
+
+  result = couch.db.get_doc(uri_segments={'docid': 'testdoc'}, multipart=True, params={'atts_since': ['1-a']})
+  assert result['_attachments']['new.bin']['data'] == b'\x00\r\n\xff'
+  assert 'follows' not in result['_attachments']['new.bin']
+  assert result['_attachments']['old.txt'] == doc['_attachments']['old.txt']
+
+
+def test_get_doc_multipart_spills_large_attachments_to_files(httpserver: HTTPServer):
+  doc = {'_id': 'testdoc', '_rev': '2-b', '_attachments': {
+    'small.txt': {'follows': True, 'content_type': 'text/plain', 'length': 2, 'revpos': 2},
+    'large.bin': {'follows': True, 'content_type': 'application/octet-stream', 'length': 300, 'revpos': 2}}}
+  large = bytes(range(0, 250)) + b'\r\n--ab' * 10
+  body = (b'--abc\r\nContent-Type: application/json\r\n\r\n' + json.dumps(doc).encode('utf-8') +
+          b'\r\n--abc\r\nContent-Disposition: attachment; filename="small.txt"\r\n\r\nhi'
+          b'\r\n--abc\r\nContent-Disposition: attachment; filename="large.bin"\r\n\r\n' + large + b'\r\n--abc--')
+
+  # every chunk size moves the delimiter to another place relative to the chunks
+  for chunk_size in (1, 7, 64, 4096):
+    parts = list(iter_parts([body[i:i + chunk_size] for i in range(0, len(body), chunk_size)], b'abc', spill=100))
+    assert parts[1][1] == b'hi'
+    assert parts[2][1].read() == large
+
+  httpserver.expect_request("/_local/testdoc").respond_with_data(body, content_type='multipart/related; boundary="abc"')
+  result = couch.db.get_doc(uri_segments={'docid': 'testdoc'}, multipart=True, spill_size=100)
+  assert result['_attachments']['small.txt']['data'] == b'hi'
+  with result['_attachments']['large.bin']['data'] as spilled:
+    assert spilled.read() == large
+
+
+def test_multipart_round_trip_sends_only_changed_attachments(httpserver: HTTPServer):
+  received = {}
+
+  def handler(request):
+    received.update(body=request.get_data(), content_type=request.headers.get('Content-Type'))
+    return Response(json.dumps({"ok": True, "id": "testdoc", "rev": "3-c"}), status=201, content_type='application/json')
+
+  httpserver.expect_request("/_local/testdoc", method="PUT").respond_with_handler(handler)
+  doc = {'_id': 'testdoc', '_rev': '2-b', '_attachments': {
+    'old.txt': {'stub': True, 'content_type': 'text/plain', 'length': 3, 'revpos': 1},
+    'new.bin': {'content_type': 'application/x-thing', 'data': b'\x01\x02'},
+    'spilled.bin': {'content_type': 'application/x-thing', 'data': io.BytesIO(b'\x03')}}}
+  couch.db.save_named_doc(uri_segments={'docid': 'testdoc'}, data=doc)
+
+  boundary = received['content_type'].split('boundary=')[1].strip('"').encode('ascii')
+  parts = list(iter_parts([received['body']], boundary))
+  sent = json.loads(parts[0][1])
+  assert sent['_attachments']['old.txt']['stub'] is True
+  assert sent['_attachments']['new.bin'] == {'follows': True, 'content_type': 'application/x-thing', 'length': 2}
+  assert parts[1][1] == b'\x01\x02'
+  assert sent['_attachments']['spilled.bin']['length'] == 1
+  assert parts[2][1] == b'\x03'
@@ -0,0 +1,92 @@
+import pytest
+import requests
+from pytest_httpserver import HTTPServer
+
+from relaxed import CouchDB, CouchError, InvalidKeysException
+from relaxed.hooks import Hooks
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='testdb')
+  yield
+
+
+def record(events):
+  hooks = couch.session.hooks
+  for name in ('before_send', 'after_response', 'on_error'):
+    hooks.add(name, lambda event, name=name: events.append((name, event)))
+
+
+def test_hooks_are_inactive_until_added():
+  hooks = Hooks()
+  assert not hooks
+
+  hook = hooks.add('after_response', print)
+  assert hooks
+  hooks.remove('after_response', hook)
+  assert not hooks
+
+  with pytest.raises(ValueError):
+    hooks.add('after_everything', print)
+
+
+def test_hooks_report_successful_calls(httpserver: HTTPServer):
+  body = b'{"_id": "some doc", "value": 1}'
+  httpserver.expect_request('/testdb/some doc', method='GET').respond_with_data(body, content_type='application/json')
+  events = []
+  record(events)
+
+  response = couch.db.get_doc(uri_segments={'docid': 'some doc'})
+
+  assert response == {'_id': 'some doc', 'value': 1}
+  assert [name for name, _ in events] == ['before_send', 'after_response']
+  event = events[-1][1]
+  assert event is events[0][1]
+  assert (event.endpoint, event.method, event.template) == ('get_doc', 'get', '/:db:/:docid:')
+  assert event.uri == '/testdb/some%20doc'
+  assert event.status == 200
+  assert event.request_bytes == 0
+  assert event.response_bytes == len(body)
+  assert all(timing >= 0 for timing in (event.validation_time, event.network_time, event.decode_time))
+  assert event.error is None
+
+
+def test_hooks_report_request_bytes_and_couch_errors(httpserver: HTTPServer):
+  httpserver.expect_request('/testdb/_bulk_docs', method='POST').respond_with_json({'error': 'forbidden', 'reason': 'no'}, status=403)
+  events = []
+  record(events)
+
+  response = couch.db.bulk_save(data={'docs': [{'_id': 'a'}]})
+
+  assert isinstance(response, CouchError)
+  assert [name for name, _ in events] == ['before_send', 'on_error']
+  event = events[-1][1]
+  assert event.status == 403
+  assert event.error is response
+  assert event.request_bytes == len(couch.session.codec.encode({'docs': [{'_id': 'a'}]}))
+
+
+def test_hooks_report_exceptions():
+  events = []
+  record(events)
+
+  with pytest.raises(InvalidKeysException):
+    couch.db.get_doc(uri_segments={'docid': 'a'}, params={'unknown': 1})
+  assert [name for name, _ in events] == ['on_error']
+  assert isinstance(events[0][1].error, InvalidKeysException)
+
+  session = CouchDB(host='http://127.0.0.1', port=1, db='testdb').session
+  failures = []
+  session.hooks.add('on_error', failures.append)
+  with pytest.raises(requests.exceptions.ConnectionError):
+    session.get_session_info()
+  assert failures[0].network_time is not None
+  assert failures[0].status is None
@@ -0,0 +1,79 @@
+import json
+
+import pytest
+from pytest_httpserver import HTTPServer
+
+from relaxed import CouchDB, CouchError, LazyArray, LazyDocument
+from relaxed.codec import get_codec
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='testdb')
+  yield
+
+
+DOC = {"_id": "doc\"1", "_rev": "2-abc", "items": [{"_id": "nested", "n": 1}], "total": 12.5}
+
+
+def test_lazy_document_reads_leading_members_without_decoding(httpserver: HTTPServer):
+  httpserver.expect_request("/testdb/doc1").respond_with_json(DOC)
+
+  doc = couch.db.get_doc(uri_segments={'docid': 'doc1'}, response_mode='lazy')
+  assert isinstance(doc, LazyDocument)
+  assert doc['_id'] == 'doc"1'
+  assert doc['_rev'] == '2-abc'
+  assert doc._value is None
+  assert doc['items'] == DOC['items']
+  assert dict(doc) == DOC
+  assert json.loads(doc.raw) == DOC
+
+
+def test_lazy_document_knows_missing_keys_of_flat_objects():
+  doc = LazyDocument(b'{"ok":true,"id":"a","rev":"1-x"}', get_codec('json'))
+  assert doc['rev'] == '1-x'
+  with pytest.raises(KeyError):
+    doc['error']
+  assert doc._value is None
+
+
+def test_lazy_view_response_exposes_total_rows_cheaply(httpserver: HTTPServer):
+  rows = [{"id": f"doc{i}", "key": i, "value": None} for i in range(0, 100)]
+  httpserver.expect_request("/testdb/_all_docs").respond_with_json({"total_rows": 100, "offset": 0, "rows": rows})
+
+  result = couch.db.get_docs(response_mode='lazy')
+  assert result['total_rows'] == 100
+  assert result._value is None
+  assert len(result['rows']) == 100
+
+
+def test_lazy_arrays_and_raw_bytes(httpserver: HTTPServer):
+  body = [{"ok": True, "id": "a", "rev": "1-x"}, {"id": "b", "error": "conflict", "reason": "Document update conflict."}]
+  httpserver.expect_request("/testdb/_bulk_docs", method="POST").respond_with_json(body, status=201)
+
+  result = couch.db.bulk_save(data={"docs": [{"_id": "a"}, {"_id": "b"}]}, response_mode='lazy')
+  assert isinstance(result, LazyArray)
+  assert list(result) == body
+
+  raw = couch.db.bulk_save(data={"docs": [{"_id": "a"}, {"_id": "b"}]}, response_mode='raw')
+  assert json.loads(raw) == body
+
+
+def test_session_response_mode_and_errors(httpserver: HTTPServer):
+  couch = CouchDB(host="http://127.0.0.1", port=8000, db='testdb', response_mode='raw')
+  httpserver.expect_request("/testdb/doc1").respond_with_json(DOC)
+  httpserver.expect_request("/testdb/missing").respond_with_json({"error": "not_found", "reason": "missing"}, status=404)
+
+  assert json.loads(couch.db.get_doc(uri_segments={'docid': 'doc1'})) == DOC
+  assert couch.db.get_doc(uri_segments={'docid': 'doc1'}, response_mode='json') == DOC
+
+  error = couch.db.get_doc(uri_segments={'docid': 'missing'})
+  assert isinstance(error, CouchError)
+  assert error.status_code == 404
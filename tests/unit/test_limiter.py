@@ -0,0 +1,112 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from relaxed import CouchDB, Database
+from relaxed.limiter import AdaptiveLimiter, RequestLimiter, TokenBucket
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+def test_endpoints_are_classed():
+  assert Database.get_doc._plan.request_class == 'read'
+  assert Database.filter_docs._plan.request_class == 'read'
+  assert Database.save_doc._plan.request_class == 'write'
+  assert Database.get_view._plan.request_class == 'view'
+  assert Database.find._plan.request_class == 'view'
+  assert Database.get_changes._plan.request_class is None
+
+
+def test_limit_grows_by_one_per_round_trip_and_halves_on_congestion():
+  now = [0.0]
+  limiter = AdaptiveLimiter(initial=4, max_limit=5, clock=lambda: now[0])
+  for _ in range(0, 4):
+    limiter.acquire()
+    limiter.release(0.1, 200)
+  assert limiter.as_dict()['limit'] == 4
+  limiter.acquire()
+  limiter.release(0.1, 201)
+  assert limiter.as_dict()['limit'] == 5
+
+  # a burst of 429s within one round trip halves the limit once
+  for _ in range(0, 3):
+    limiter.acquire()
+  for _ in range(0, 3):
+    limiter.release(0.1, 429)
+  assert limiter.as_dict() == {'limit': 2, 'inflight': 0, 'throttled': 3}
+
+  now[0] = 1.0
+  limiter.acquire()
+  limiter.release(None, None)
+  assert limiter.as_dict()['limit'] == 1
+
+
+def test_latency_target_counts_as_congestion():
+  limiter = AdaptiveLimiter(initial=8, latency_target=0.5)
+  limiter.acquire()
+  limiter.release(0.8, 200)
+  assert limiter.as_dict()['limit'] == 4
+
+
+def test_token_bucket_waits_for_tokens():
+  now = [0.0]
+  delays = []
+
+  def sleep(delay):
+    delays.append(delay)
+    now[0] += delay
+
+  bucket = TokenBucket(rate=10, burst=2, clock=lambda: now[0], sleep=sleep)
+  for _ in range(0, 4):
+    bucket.acquire()
+  assert delays == pytest.approx([0.1, 0.1])
+  assert bucket.waited == 2
+
+
+def test_limits_concurrency_per_class(httpserver: HTTPServer):
+  writes = AdaptiveLimiter(initial=2, max_limit=2)
+  reads = AdaptiveLimiter(initial=3)
+  couch = CouchDB(host='http://127.0.0.1', port=8000, db='testdb',
+                  limiter=RequestLimiter(limits={'write': writes, 'read': reads}))
+  seen = []
+
+  def save(request):
+    seen.append(writes.inflight)
+    return Response('{"ok": true}', status=201, content_type='application/json')
+
+  httpserver.expect_request('/testdb/doc', method='PUT').respond_with_handler(save)
+  httpserver.expect_request('/testdb/busy', method='GET').respond_with_json({'error': 'too_many_requests'}, status=429)
+
+  with ThreadPoolExecutor(max_workers=8) as executor:
+    list(executor.map(lambda _: couch.db.save_named_doc(uri_segments={'docid': 'doc'}, data={}), range(0, 16)))
+
+  assert len(seen) == 16 and max(seen) <= 2
+  assert writes.as_dict() == {'limit': 2, 'inflight': 0, 'throttled': 0}
+
+  couch.db.get_doc(uri_segments={'docid': 'busy'})
+  assert reads.as_dict()['limit'] == 1
+  with pytest.raises(ValueError):
+    RequestLimiter(limits={'views': reads})
+
+
+def test_streamed_rows_hold_their_slot_until_read(httpserver: HTTPServer):
+  rows = [{'id': f'doc{i}', 'key': i, 'value': None} for i in range(0, 3)]
+  httpserver.expect_request('/testdb/_design/d/_view/v').respond_with_json({'total_rows': 3, 'offset': 0, 'rows': rows})
+  httpserver.expect_request('/testdb/_design/d/_view/missing').respond_with_json({'error': 'not_found'}, status=404)
+  views = AdaptiveLimiter(initial=2)
+  couch = CouchDB(host='http://127.0.0.1', port=8000, db='testdb', limiter=RequestLimiter(limits={'view': views}))
+
+  stream = couch.db.iter_view(uri_segments={'docid': 'd', 'view': 'v'})
+  assert views.inflight == 1
+  assert [row['id'] for row in stream] == ['doc0', 'doc1', 'doc2']
+  assert views.inflight == 0
+
+  # closing early, or a streamed error, gives the slot back as well
+  couch.db.iter_view(uri_segments={'docid': 'd', 'view': 'v'}).close()
+  couch.db.iter_view(uri_segments={'docid': 'd', 'view': 'missing'})
+  assert views.inflight == 0
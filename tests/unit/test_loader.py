@@ -0,0 +1,86 @@
+import json
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from relaxed import CouchDB, CouchError, DocumentLoader
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='testdb')
+  yield
+
+
+class BulkGetHandler():
+  def __init__(self):
+    self.requests = []
+
+  def __call__(self, request):
+    ids = [doc['id'] for doc in json.loads(request.data)['docs']]
+    self.requests.append(ids)
+    results = []
+    for docid in ids:
+      if docid == 'missing':
+        results.append({"id": docid, "docs": [{"error": {"id": docid, "rev": "undefined", "error": "not_found", "reason": "missing"}}]})
+      else:
+        results.append({"id": docid, "docs": [{"ok": {"_id": docid, "_rev": "1-abc"}}]})
+    return Response(json.dumps({"results": results}), content_type='application/json')
+
+
+def test_loads_in_a_batch_scope_share_one_deduplicated_request(httpserver: HTTPServer):
+  handler = BulkGetHandler()
+  httpserver.expect_request("/testdb/_bulk_get", method="POST").respond_with_handler(handler)
+
+  loader = DocumentLoader(couch.db)
+  with loader.batch():
+    futures = loader.load_many(['a', 'b', 'a', 'missing'])
+    assert handler.requests == []
+
+  assert handler.requests == [['a', 'b', 'missing']]
+  assert futures[0] is futures[2]
+  assert futures[1].result() == {"_id": "b", "_rev": "1-abc"}
+
+  missing = futures[3].result()
+  assert isinstance(missing, CouchError) is True
+  assert missing.status_code == 404
+
+
+def test_loads_within_the_window_are_coalesced(httpserver: HTTPServer):
+  handler = BulkGetHandler()
+  httpserver.expect_request("/testdb/_bulk_get", method="POST").respond_with_handler(handler)
+
+  loader = DocumentLoader(couch.db, window=0.05)
+  futures = loader.load_many(['a', 'b'])
+  assert loader.get_doc('c') == {"_id": "c", "_rev": "1-abc"}
+  assert [future.result() for future in futures] == [{"_id": "a", "_rev": "1-abc"}, {"_id": "b", "_rev": "1-abc"}]
+  assert handler.requests == [['a', 'b', 'c']]
+
+
+def test_batches_are_split_at_max_batch(httpserver: HTTPServer):
+  handler = BulkGetHandler()
+  httpserver.expect_request("/testdb/_bulk_get", method="POST").respond_with_handler(handler)
+
+  loader = DocumentLoader(couch.db, max_batch=2)
+  with loader.batch():
+    futures = loader.load_many(['a', 'b', 'c'])
+
+  assert [future.result()['_id'] for future in futures] == ['a', 'b', 'c']
+  assert handler.requests == [['a', 'b'], ['c']]
+
+
+def test_failed_bulk_get_resolves_every_caller_with_the_error(httpserver: HTTPServer):
+  httpserver.expect_request("/testdb/_bulk_get", method="POST").respond_with_json({"error": "unauthorized", "reason": "nope"}, status=401)
+
+  loader = DocumentLoader(couch.db)
+  response = loader.get_doc('a')
+  assert isinstance(response, CouchError) is True
+  assert response.status_code == 401
@@ -0,0 +1,104 @@
+import json
+import time
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from relaxed import CouchDB
+from relaxed.nodes import NodePool
+from relaxed.transport import Transport
+
+DEAD = 'http://127.0.0.1:1'
+LIVE = 'http://127.0.0.1:8000'
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture
+def second_server():
+  server = HTTPServer('127.0.0.1', 8001)
+  server.start()
+  yield server
+  server.clear()
+  server.stop()
+
+
+def test_requests_are_spread_over_nodes(httpserver: HTTPServer, second_server: HTTPServer):
+  for server in (httpserver, second_server):
+    server.expect_request('/testdb/doc', method='GET').respond_with_json({'_id': 'doc'})
+  couch = CouchDB(nodes=[LIVE, 'http://127.0.0.1:8001'], db='testdb', probe_interval=0)
+
+  for _ in range(0, 40):
+    assert couch.db.get_doc(uri_segments={'docid': 'doc'}) == {'_id': 'doc'}
+
+  stats = couch.session.node_pool.as_dict()['nodes']
+  assert stats[LIVE]['requests'] > 0 and stats['http://127.0.0.1:8001']['requests'] > 0
+  assert stats[LIVE]['requests'] + stats['http://127.0.0.1:8001']['requests'] == 40
+  assert all(node['outstanding'] == 0 and node['latency'] is not None for node in stats.values())
+
+
+def test_fails_over_and_ejects_dead_nodes(httpserver: HTTPServer):
+  httpserver.expect_request('/testdb/doc', method='GET').respond_with_json({'_id': 'doc'})
+  now = [0.0]
+  pool = NodePool([DEAD, LIVE], eject_after=2, probe_interval=0, readmit_after=30, clock=lambda: now[0])
+  couch = CouchDB(node_pool=pool, db='testdb')
+
+  for _ in range(0, 20):
+    assert couch.db.get_doc(uri_segments={'docid': 'doc'}) == {'_id': 'doc'}
+  assert not pool.nodes[0].healthy
+  assert pool.ejections == 1
+  assert pool.nodes[0].requests == 2
+
+  # readmitted on trial once readmit_after passed, and ejected again by its next failure
+  now[0] = 30.0
+  for _ in range(0, 20):
+    assert couch.db.get_doc(uri_segments={'docid': 'doc'}) == {'_id': 'doc'}
+  assert pool.readmissions == 1
+  assert pool.ejections == 2
+  assert pool.nodes[0].requests == 3
+
+
+def test_probes_eject_and_readmit(httpserver: HTTPServer):
+  httpserver.expect_ordered_request('/_up', method='GET').respond_with_json({'status': 'maintenance_mode'}, status=404)
+  httpserver.expect_ordered_request('/_up', method='GET').respond_with_json({'status': 'ok'})
+  pool = NodePool([LIVE, DEAD], probe_interval=0)
+  pool.start_probing(Transport())
+
+  pool.probe()
+  assert [node.healthy for node in pool.nodes] == [False, False]
+
+  pool.probe()
+  assert [node.healthy for node in pool.nodes] == [True, False]
+  assert pool.acquire() is pool.nodes[0]
+
+
+def test_a_probe_pass_is_bounded_by_one_probe_timeout():
+  class SlowTransport():
+    """ answers /_up after the delay of the node, in seconds."""
+
+    def request(self, method, url, timeout=None):
+      time.sleep({'http://10.0.0.1': 0.2, 'http://10.0.0.2': 0.2, 'http://10.0.0.3': 1.5}[url[:-len('/_up')]])
+      return Response(json.dumps({'status': 'ok'}), status=200)
+
+  pool = NodePool(['http://10.0.0.1', 'http://10.0.0.2', 'http://10.0.0.3'], probe_interval=0, probe_timeout=0.5)
+  pool.start_probing(SlowTransport())
+
+  started = time.monotonic()
+  pool.probe()
+  assert time.monotonic() - started < 1
+  assert [node.healthy for node in pool.nodes] == [True, True, False]
+
+
+def test_every_node_ejected_still_tries_one():
+  pool = NodePool([DEAD, LIVE], eject_after=1, probe_interval=0)
+  for node in pool.nodes:
+    pool.release(pool.acquire([other for other in pool.nodes if other is not node]), status=None)
+
+  assert not any(node.healthy for node in pool.nodes)
+  assert pool.acquire() is pool.nodes[0]
+  with pytest.raises(ValueError):
+    NodePool([DEAD], strategy='round_robin')
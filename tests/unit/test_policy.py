@@ -0,0 +1,134 @@
+import pytest
+from pytest_httpserver import HTTPServer
+
+from relaxed import AdaptiveLimiter, CouchDB, CouchError, RequestLimiter
+from relaxed.policy import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch, delays
+  delays = []
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='testdb',
+                  retry_policy=RetryPolicy(retries=3, backoff=0.5, sleep=delays.append))
+  yield
+
+
+def test_retries_transient_statuses(httpserver: HTTPServer):
+  httpserver.expect_ordered_request('/testdb/doc', method='GET').respond_with_json({'error': 'unavailable'}, status=503)
+  httpserver.expect_ordered_request('/testdb/doc', method='GET').respond_with_json({'error': 'unavailable'}, status=502)
+  httpserver.expect_ordered_request('/testdb/doc', method='GET').respond_with_json({'_id': 'doc'})
+
+  assert couch.db.get_doc(uri_segments={'docid': 'doc'}) == {'_id': 'doc'}
+  assert len(delays) == 2
+  assert 0 <= delays[0] <= 0.5 and 0 <= delays[1] <= 1.0
+  assert couch.session.retry_policy.as_dict() == {'retried': 2, 'exhausted': 0}
+
+
+def test_honours_retry_after(httpserver: HTTPServer):
+  httpserver.expect_ordered_request('/testdb/doc', method='GET').respond_with_json({'error': 'too_many_requests'}, status=429, headers={'Retry-After': '2'})
+  httpserver.expect_ordered_request('/testdb/doc', method='GET').respond_with_json({'_id': 'doc'})
+
+  assert couch.db.get_doc(uri_segments={'docid': 'doc'}) == {'_id': 'doc'}
+  assert delays == [2.0]
+
+
+def test_gives_up_after_the_last_retry(httpserver: HTTPServer):
+  httpserver.expect_request('/testdb/doc', method='GET').respond_with_json({'error': 'unavailable'}, status=503)
+
+  response = couch.db.get_doc(uri_segments={'docid': 'doc'})
+  assert isinstance(response, CouchError)
+  assert response.status_code == 503
+  assert len(delays) == 3
+  assert couch.session.retry_policy.as_dict() == {'retried': 3, 'exhausted': 1}
+
+
+def test_does_not_retry_non_idempotent_requests_or_other_errors(httpserver: HTTPServer):
+  httpserver.expect_request('/testdb/_bulk_docs', method='POST').respond_with_json({'error': 'unavailable'}, status=503)
+  httpserver.expect_request('/testdb/missing', method='GET').respond_with_json({'error': 'not_found'}, status=404)
+
+  assert isinstance(couch.db.bulk_save(data={'docs': []}), CouchError)
+  assert couch.db.get_doc(uri_segments={'docid': 'missing'}).status_code == 404
+  assert delays == []
+
+
+def test_retries_connection_errors():
+  session = CouchDB(host='http://127.0.0.1', port=1, retry_policy=RetryPolicy(retries=2, sleep=delays.append)).session
+
+  with pytest.raises(Exception):
+    session.get_session_info()
+  assert len(delays) == 2
+
+
+def test_circuit_opens_and_recovers(httpserver: HTTPServer):
+  now = [0.0]
+  breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+  couch = CouchDB(host='http://127.0.0.1', port=8000, db='testdb', circuit_breaker=breaker)
+  httpserver.expect_oneshot_request('/testdb/doc', method='GET').respond_with_json({'error': 'unavailable'}, status=503)
+  httpserver.expect_oneshot_request('/testdb/doc', method='GET').respond_with_json({'error': 'unavailable'}, status=503)
+
+  couch.db.get_doc(uri_segments={'docid': 'doc'})
+  couch.db.get_doc(uri_segments={'docid': 'doc'})
+  assert breaker.is_open(couch.session.address)
+
+  with pytest.raises(CircuitOpenError):
+    couch.db.get_doc(uri_segments={'docid': 'doc'})
+  assert breaker.as_dict() == {'opened': 1, 'rejected': 1, 'open': ['http://127.0.0.1:8000']}
+
+  # after reset_timeout a single trial closes the circuit again
+  now[0] = 10.0
+  httpserver.expect_oneshot_request('/testdb/doc', method='GET').respond_with_json({'_id': 'doc'})
+  assert couch.db.get_doc(uri_segments={'docid': 'doc'}) == {'_id': 'doc'}
+  assert not breaker.is_open(couch.session.address)
+
+
+def test_open_circuit_fails_fast_without_retries_or_congestion():
+  breaker = CircuitBreaker(failure_threshold=1)
+  breaker.record('http://127.0.0.1:8000', None)
+  reads = AdaptiveLimiter(initial=4)
+  couch = CouchDB(host='http://127.0.0.1', port=8000, db='testdb', circuit_breaker=breaker,
+                  retry_policy=RetryPolicy(sleep=delays.append), limiter=RequestLimiter(limits={'read': reads}))
+
+  with pytest.raises(CircuitOpenError):
+    couch.db.get_doc(uri_segments={'docid': 'doc'})
+  assert delays == []
+  assert reads.as_dict() == {'limit': 4, 'inflight': 0, 'throttled': 0}
+
+
+def test_open_circuit_fails_over_to_another_node(httpserver: HTTPServer):
+  breaker = CircuitBreaker(failure_threshold=1)
+  breaker.record('http://127.0.0.1:1', None)
+  couch = CouchDB(nodes=['http://127.0.0.1:1', 'http://127.0.0.1:8000'], db='testdb', probe_interval=0,
+                  circuit_breaker=breaker)
+  httpserver.expect_request('/testdb/_bulk_docs', method='POST').respond_with_json([], status=201)
+
+  # nothing reached the node behind the open circuit, so even a POST goes to the next one
+  for _ in range(0, 5):
+    assert couch.db.bulk_save(data={'docs': []}) == []
+  nodes = couch.session.node_pool.as_dict()['nodes']
+  assert nodes['http://127.0.0.1:1']['healthy'] and nodes['http://127.0.0.1:1']['outstanding'] == 0
+  assert nodes['http://127.0.0.1:8000']['requests'] == 5
+
+
+def test_half_open_circuit_lets_one_trial_through():
+  now = [0.0]
+  breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+  breaker.record('host', None)
+
+  now[0] = 10.0
+  breaker.before('host')
+  with pytest.raises(CircuitOpenError):
+    breaker.before('host')
+
+  # a failed trial keeps the circuit open for another reset_timeout
+  breaker.record('host', 503)
+  now[0] = 15.0
+  with pytest.raises(CircuitOpenError):
+    breaker.before('host')
+  assert breaker.opened == 1
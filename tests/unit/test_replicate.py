@@ -0,0 +1,189 @@
+import json
+import threading
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from relaxed import CouchDB, Database, Replicator
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch, source, target
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='testdb')
+  source = Database(session=couch.session, db='source')
+  target = Database(session=couch.session, db='target')
+  yield
+
+
+class FakeCouch():
+  """ a source database of ten documents and a target database that already has the first three."""
+
+  def __init__(self, checkpoint=None):
+    self.docs = {f'doc{i}': {'_id': f'doc{i}', '_rev': '1-a', 'n': i} for i in range(0, 10)}
+    self.target = {f'doc{i}': '1-a' for i in range(0, 3)}
+    self.checkpoint = checkpoint
+    self.written = []
+    self.since = []
+    self.rejected = {}
+    self._lock = threading.Lock()
+
+  def changes(self, request):
+    since = int(request.args['since'])
+    limit = int(request.args['limit'])
+    assert request.args['style'] == 'all_docs'
+    self.since.append(since)
+    results = [{'seq': str(i + 1), 'id': f'doc{i}', 'changes': [{'rev': '1-a'}]} for i in range(since, min(since + limit, 10))]
+    last_seq = results[-1]['seq'] if results else str(since)
+    return Response(json.dumps({'results': results, 'last_seq': last_seq, 'pending': 10 - int(last_seq)}),
+                    content_type='application/json')
+
+  def revs_diff(self, request):
+    revs = json.loads(request.data)
+    missing = {docid: {'missing': revs[docid]} for docid in revs if docid not in self.target}
+    return Response(json.dumps(missing), content_type='application/json')
+
+  def bulk_get(self, request):
+    assert request.args['revs'] == 'true'
+    requested = json.loads(request.data)['docs']
+    results = [{'id': r['id'], 'docs': [{'ok': dict(self.docs[r['id']], _revisions={'start': 1, 'ids': ['a']})}]} for r in requested]
+    return Response(json.dumps({'results': results}), content_type='application/json')
+
+  def bulk_docs(self, request):
+    body = json.loads(request.data)
+    assert body['new_edits'] is False
+    with self._lock:
+      self.written.extend(doc for doc in body['docs'] if doc['_id'] not in self.rejected)
+    errors = [{'id': doc['_id'], 'rev': doc['_rev'], 'error': self.rejected[doc['_id']], 'reason': 'rejected'}
+              for doc in body['docs'] if doc['_id'] in self.rejected]
+    return Response(json.dumps(errors), status=201, content_type='application/json')
+
+  def get_checkpoint(self, request):
+    if self.checkpoint is None:
+      return Response(json.dumps({'error': 'not_found', 'reason': 'missing'}), status=404, content_type='application/json')
+    return Response(json.dumps(self.checkpoint), content_type='application/json')
+
+  def put_checkpoint(self, request):
+    self.checkpoint = dict(json.loads(request.data), _rev='0-1')
+    return Response(json.dumps({'ok': True, 'id': '_local/x', 'rev': '0-1'}), status=201, content_type='application/json')
+
+  def register(self, httpserver, replication_id):
+    httpserver.expect_request("/source/_changes").respond_with_handler(self.changes)
+    httpserver.expect_request("/target/_revs_diff", method="POST").respond_with_handler(self.revs_diff)
+    httpserver.expect_request("/source/_bulk_get", method="POST").respond_with_handler(self.bulk_get)
+    httpserver.expect_request("/target/_bulk_docs", method="POST").respond_with_handler(self.bulk_docs)
+    httpserver.expect_request(f"/target/_local/{replication_id}", method="GET").respond_with_handler(self.get_checkpoint)
+    httpserver.expect_request(f"/target/_local/{replication_id}", method="PUT").respond_with_handler(self.put_checkpoint)
+
+
+def test_replicates_missing_revisions_and_checkpoints(httpserver: HTTPServer):
+  fake = FakeCouch()
+  fake.register(httpserver, 'rep1')
+  reports = []
+
+  replicator = Replicator(source, target, batch_size=4, replication_id='rep1', on_batch=reports.append)
+  stats = replicator.run()
+
+  assert replicator.error is None
+  assert sorted(doc['_id'] for doc in fake.written) == [f'doc{i}' for i in range(3, 10)]
+  assert stats['changes'] == 10
+  assert stats['docs_written'] == 7
+  assert stats['last_seq'] == '10'
+  assert fake.checkpoint['source_last_seq'] == '10'
+  assert [report['last_seq'] for report in reports] == ['4', '8', '10']
+  assert [report['pending'] for report in reports] == [6, 2, 0]
+  assert [report['missing_revisions'] for report in reports] == [1, 4, 2]
+
+
+def test_resumes_from_the_checkpoint(httpserver: HTTPServer):
+  fake = FakeCouch(checkpoint={'_id': '_local/rep1', '_rev': '0-1', 'source_last_seq': '8'})
+  fake.register(httpserver, 'rep1')
+
+  replicator = Replicator(source, target, batch_size=4, replication_id='rep1')
+  stats = replicator.run()
+
+  assert fake.since[0] == 8
+  assert sorted(doc['_id'] for doc in fake.written) == ['doc8', 'doc9']
+  assert stats['docs_written'] == 2
+
+
+def test_transform_can_rewrite_and_skip_documents(httpserver: HTTPServer):
+  fake = FakeCouch()
+  fake.register(httpserver, 'rep1')
+
+  def transform(doc):
+    return None if doc['n'] % 2 else dict(doc, migrated=True)
+
+  replicator = Replicator(source, target, batch_size=100, replication_id='rep1', transform=transform)
+  replicator.run()
+
+  assert sorted(doc['_id'] for doc in fake.written) == ['doc4', 'doc6', 'doc8']
+  assert all(doc['migrated'] for doc in fake.written)
+
+
+def test_stops_on_errors_without_checkpointing(httpserver: HTTPServer):
+  fake = FakeCouch()
+  fake.register(httpserver, 'rep1')
+  httpserver.clear()
+  httpserver.expect_request("/target/_local/rep1", method="GET").respond_with_handler(fake.get_checkpoint)
+  httpserver.expect_request("/source/_changes").respond_with_json({'error': 'unauthorized', 'reason': 'nope'}, status=401)
+
+  replicator = Replicator(source, target, replication_id='rep1')
+  replicator.run()
+
+  assert replicator.error.status_code == 401
+  assert fake.checkpoint is None
+
+
+def test_permanent_rejections_are_checkpointed_past(httpserver: HTTPServer):
+  fake = FakeCouch()
+  fake.rejected['doc5'] = 'forbidden'
+  fake.register(httpserver, 'rep1')
+
+  replicator = Replicator(source, target, batch_size=4, replication_id='rep1')
+  stats = replicator.run()
+
+  assert replicator.error is None
+  assert stats['docs_written'] == 6
+  assert stats['doc_write_failures'] == 1
+  assert fake.checkpoint['source_last_seq'] == '10'
+
+
+def test_transient_write_failures_stop_before_the_checkpoint(httpserver: HTTPServer):
+  fake = FakeCouch()
+  fake.rejected['doc5'] = 'unknown_error'
+  fake.register(httpserver, 'rep1')
+
+  replicator = Replicator(source, target, batch_size=4, replication_id='rep1')
+  stats = replicator.run()
+
+  assert replicator.error.error == 'unknown_error'
+  assert stats['last_seq'] == '4'
+  # the next run starts again from the batch that failed
+  assert fake.checkpoint['source_last_seq'] == '4'
+
+
+def test_unreadable_revisions_stop_before_the_checkpoint(httpserver: HTTPServer):
+  fake = FakeCouch()
+
+  def bulk_get(request):
+    requested = json.loads(request.data)['docs']
+    results = [{'id': r['id'], 'docs': [{'error': {'id': r['id'], 'rev': r['rev'], 'error': 'internal_server_error',
+                                                   'reason': 'timeout'}}]} for r in requested]
+    return Response(json.dumps({'results': results}), content_type='application/json')
+  fake.bulk_get = bulk_get
+  fake.register(httpserver, 'rep1')
+
+  replicator = Replicator(source, target, batch_size=100, replication_id='rep1')
+  replicator.run()
+
+  assert replicator.error.error == 'internal_server_error'
+  assert fake.written == []
+  assert fake.checkpoint is None
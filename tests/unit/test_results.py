@@ -0,0 +1,100 @@
+from array import array
+
+import pytest
+from pytest_httpserver import HTTPServer
+
+from relaxed import CouchDB, CouchError, Row, ViewResult
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='testdb')
+  yield
+
+
+def test_columnar_all_docs(httpserver: HTTPServer):
+  rows = [{"id": f"doc{i}", "key": f"doc{i}", "value": {"rev": f"1-{i}"}, "doc": {"_id": f"doc{i}"}} for i in range(0, 5)]
+  httpserver.expect_request("/testdb/_all_docs").respond_with_json({"total_rows": 5, "offset": 0, "rows": rows})
+
+  result = couch.db.get_docs(params={'include_docs': 'true'}, response_mode='columnar')
+  assert isinstance(result, ViewResult)
+  assert (result.total_rows, result.offset, len(result)) == (5, 0, 5)
+  assert result.ids == [f"doc{i}" for i in range(0, 5)]
+  assert result.values == [{"rev": f"1-{i}"} for i in range(0, 5)]
+  assert result.docs[3] == {"_id": "doc3"}
+  assert result[3] == Row("doc3", "doc3", {"rev": "1-3"}, {"_id": "doc3"})
+
+
+def test_numeric_reduce_values_are_arrays(httpserver: HTTPServer):
+  rows = [{"key": [2020, month], "value": month * 10} for month in range(1, 13)]
+  httpserver.expect_request("/testdb/_design/stats/_view/by_month").respond_with_json({"rows": rows})
+
+  result = couch.db.get_view(uri_segments={'docid': 'stats', 'view': 'by_month'}, params={'group': 'true'}, response_mode='columnar')
+  assert result.ids is None
+  assert result.docs is None
+  assert isinstance(result.values, array)
+  assert result.values.typecode == 'q'
+  assert list(result.values) == [month * 10 for month in range(1, 13)]
+  assert memoryview(result.values).nbytes == 12 * 8
+
+
+def test_values_widen_to_floats_and_lists():
+  result = ViewResult.from_rows([{"key": 1, "value": 1}, {"key": 2, "value": 2.5}])
+  assert result.values.typecode == 'd'
+  assert list(result.values) == [1.0, 2.5]
+
+  result = ViewResult.from_rows([{"key": 1, "value": 1}, {"key": 2, "value": "two"}, {"key": 3, "value": True}])
+  assert result.values == [1, "two", True]
+
+
+def test_ints_a_double_cannot_hold_keep_their_precision():
+  big = 2 ** 53 + 1
+  result = ViewResult.from_rows([{"key": 1, "value": big}, {"key": 2, "value": 0.5}])
+  assert result.values == [big, 0.5]
+
+  result = ViewResult.from_rows([{"key": 1, "value": 0.5}, {"key": 2, "value": big}])
+  assert result.values == [0.5, big]
+
+  # exactly representable ints still widen to float64
+  result = ViewResult.from_rows([{"key": 1, "value": 2 ** 53}, {"key": 2, "value": 0.5}])
+  assert result.values.typecode == 'd'
+
+
+def test_stats_values_are_stored_per_member():
+  stats = [{"sum": i * 2.0, "count": i, "min": 0, "max": i, "sumsqr": i * 4.0} for i in range(1, 4)]
+  result = ViewResult.from_rows({"key": i, "value": value} for i, value in enumerate(stats))
+  assert set(result.value_columns) == {"sum", "count", "min", "max", "sumsqr"}
+  assert list(result.value_columns['sum']) == [2.0, 4.0, 6.0]
+  assert result.value_columns['count'].typecode == 'q'
+  assert result.values[1] == stats[1]
+  assert list(result.values) == stats
+
+  mixed = ViewResult.from_rows([{"key": 1, "value": stats[0]}, {"key": 2, "value": {"other": 1}}])
+  assert mixed.value_columns is None
+  assert mixed.values == [stats[0], {"other": 1}]
+
+
+def test_filter_view_and_errors(httpserver: HTTPServer):
+  httpserver.expect_request("/testdb/_design/app/_view/by_key", method="POST").respond_with_json({"total_rows": 9, "offset": 1, "rows": [{"id": "a", "key": 1, "value": 0.5}]})
+  httpserver.expect_request("/testdb/_design/app/_view/missing").respond_with_json({"error": "not_found", "reason": "missing_named_view"}, status=404)
+
+  result = couch.db.filter_view(uri_segments={'docid': 'app', 'view': 'by_key'}, data={'keys': [1]}, response_mode='columnar')
+  assert list(result.values) == [0.5]
+  assert result.offset == 1
+
+  error = couch.db.get_view(uri_segments={'docid': 'app', 'view': 'missing'}, response_mode='columnar')
+  assert isinstance(error, CouchError)
+  assert error.status_code == 404
+
+
+def test_couch_error_has_no_instance_dict():
+  error = CouchError(error='conflict', reason='Document update conflict.', code=409)
+  assert not hasattr(error, '__dict__')
+  assert (error.error, error.reason, error.status_code) == ('conflict', 'Document update conflict.', 409)
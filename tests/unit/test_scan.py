@@ -0,0 +1,111 @@
+import json
+import threading
+
+import pytest
+import requests
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from relaxed import CouchDB, ParallelScanner
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='testdb')
+  yield
+
+
+class AllDocsHandler():
+  """ answers _all_docs over a fixed set of docids with CouchDB's startkey/endkey/skip/limit semantics."""
+
+  def __init__(self, count=50):
+    self.ids = [f'doc{i:04d}' for i in range(0, count)]
+    self.requests = []
+    self._lock = threading.Lock()
+
+  def __call__(self, request):
+    args = request.args
+    with self._lock:
+      self.requests.append(dict(args))
+
+    ids = self.ids
+    if 'startkey' in args:
+      ids = [docid for docid in ids if docid >= json.loads(args['startkey'])]
+    if 'endkey' in args:
+      end = json.loads(args['endkey'])
+      ids = [docid for docid in ids if docid < end or (docid == end and args.get('inclusive_end') != 'false')]
+    ids = ids[int(args.get('skip', 0)):]
+    if 'limit' in args:
+      ids = ids[:int(args['limit'])]
+
+    rows = [{"id": docid, "key": docid, "value": {"rev": "1-a"}} for docid in ids]
+    return Response(json.dumps({"total_rows": len(self.ids), "offset": 0, "rows": rows}), content_type='application/json')
+
+
+def test_ordered_scan_returns_every_row_in_key_order(httpserver: HTTPServer):
+  handler = AllDocsHandler(count=50)
+  httpserver.expect_request("/testdb/_all_docs").respond_with_handler(handler)
+
+  scanner = ParallelScanner(couch.db, max_workers=3, ranges=4, page_size=7)
+  rows = list(scanner.scan())
+
+  assert [row['id'] for row in rows] == handler.ids
+  assert scanner.error is None
+  assert scanner.rows == 50
+  assert len(scanner.boundaries) == 3
+  assert all(request.get('limit') == '8' for request in handler.requests if 'skip' not in request and request.get('limit') != '0')
+
+
+def test_unordered_scan_returns_every_row_once(httpserver: HTTPServer):
+  handler = AllDocsHandler(count=33)
+  httpserver.expect_request("/testdb/_all_docs").respond_with_handler(handler)
+
+  scanner = ParallelScanner(couch.db, max_workers=4, ranges=5, page_size=4)
+  rows = list(scanner.scan(ordered=False, params={'include_docs': False}))
+
+  assert sorted(row['id'] for row in rows) == handler.ids
+  assert all(request.get('include_docs') == 'false' for request in handler.requests)
+
+
+def test_range_count_defaults_to_the_number_of_shards(httpserver: HTTPServer):
+  handler = AllDocsHandler(count=20)
+  shards = {f'{i:08x}-{i:08x}': ['node1@127.0.0.1'] for i in range(0, 8)}
+  httpserver.expect_request("/testdb/_shards").respond_with_json({"shards": shards})
+  httpserver.expect_request("/testdb/_all_docs").respond_with_handler(handler)
+
+  scanner = ParallelScanner(couch.db, max_workers=2, page_size=100)
+  assert [row['id'] for row in scanner.scan()] == handler.ids
+  assert len(scanner.boundaries) == 7
+
+
+def test_scan_stops_on_errors(httpserver: HTTPServer):
+  httpserver.expect_request("/testdb/_all_docs").respond_with_json({"error": "unauthorized", "reason": "nope"}, status=401)
+
+  scanner = ParallelScanner(couch.db, ranges=2)
+  assert list(scanner.scan()) == []
+  assert scanner.error.status_code == 401
+
+
+def test_scan_ends_when_a_request_raises(httpserver: HTTPServer):
+  handler = AllDocsHandler(count=20)
+  httpserver.expect_request("/testdb/_all_docs").respond_with_handler(handler)
+
+  class DroppingDatabase():
+    """ drops the connection of every request reading past the first range."""
+
+    def get_docs(self, params=None, **kwargs):
+      if 'startkey' in params:
+        raise requests.exceptions.ConnectionError('Connection aborted.')
+      return couch.db.get_docs(params=params, **kwargs)
+
+  for ordered in (True, False):
+    scanner = ParallelScanner(DroppingDatabase(), max_workers=2, ranges=2, page_size=100)
+    with pytest.raises(requests.exceptions.ConnectionError):
+      list(scanner.scan(ordered=ordered))
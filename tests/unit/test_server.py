@@ -10,6 +10,13 @@ def httpserver_listen_address():
     return ("127.0.0.1", 8000)
 
 
+def sample_value(expected):
+  """ a value of the type AllowedKeys declares for a key; container specs accept any JSON value."""
+  if expected in (bool, int, str):
+    return {bool: True, int: 1, str: 'test'}[expected]
+  return ['test']
+
+
 @pytest.fixture(autouse=True)
 def setup():
   """ setup any state specific to the execution of the given module."""
@@ -116,8 +123,8 @@ def test_get_databases_with_params(httpserver: HTTPServer):
   expected_json = ["_users", "contacts", "docs", "invoices", "locations"]
   httpserver.expect_request("/_dbs_info",  method="POST").respond_with_json(expected_json)
 
-  for k in AllowedKeys.SERVER__DBS_INFO__PARAMS:
-    response = couch.server.get_databases(data={k: ['test']})
+  for k, expected in AllowedKeys.SERVER__DBS_INFO__PARAMS.items():
+    response = couch.server.get_databases(data={k: sample_value(expected)})
     assert isinstance(response, CouchError) is False
 
   with pytest.raises(InvalidKeysException):
@@ -135,8 +142,8 @@ def test_get_cluster_setup_with_params(httpserver: HTTPServer):
   expected_json = {"state": "cluster_enabled"}
   httpserver.expect_request("/_cluster_setup",  method="GET").respond_with_json(expected_json)
 
-  for k in AllowedKeys.SERVER__CLUSTER_SETUP__PARAMS:
-    response = couch.server.get_cluster_setup(params={k: ['test']})
+  for k, expected in AllowedKeys.SERVER__CLUSTER_SETUP__PARAMS.items():
+    response = couch.server.get_cluster_setup(params={k: sample_value(expected)})
     assert isinstance(response, CouchError) is False
 
   with pytest.raises(InvalidKeysException):
@@ -147,8 +154,8 @@ def test_configure_cluster_setup(httpserver: HTTPServer):
   expected_json = {"state": "cluster_enabled"}
   httpserver.expect_request("/_cluster_setup",  method="POST").respond_with_json(expected_json)
 
-  for k in AllowedKeys.SERVER__CLUSTER_SETUP__DATA:
-    response = couch.server.configure_cluster_setup(data={k: ['test']})
+  for k, expected in AllowedKeys.SERVER__CLUSTER_SETUP__DATA.items():
+    response = couch.server.configure_cluster_setup(data={k: sample_value(expected)})
     assert isinstance(response, CouchError) is False
 
   with pytest.raises(InvalidKeysException):
@@ -180,8 +187,8 @@ def test_get_database_updates(httpserver: HTTPServer):
   assert response.status_code == 401
 
   httpserver.expect_request("/_db_updates",  method="POST").respond_with_json({})
-  for k in AllowedKeys.SERVER__DB_UPDATES__PARAMS:
-    response = couch.server.get_database_updates(params={k: ['test']})
+  for k, expected in AllowedKeys.SERVER__DB_UPDATES__PARAMS.items():
+    response = couch.server.get_database_updates(params={k: sample_value(expected)})
     assert isinstance(response, CouchError) is False
 
   with pytest.raises(InvalidKeysException):
@@ -258,8 +265,8 @@ def test_replicate(httpserver: HTTPServer):
     assert isinstance(response, CouchError) is True
 
   httpserver.expect_request("/_replicate",  method="POST").respond_with_json({})
-  for k in AllowedKeys.SERVER__REPLICATE__DATA:
-    response = couch.server.replicate(data={k: ['test']})
+  for k, expected in AllowedKeys.SERVER__REPLICATE__DATA.items():
+    response = couch.server.replicate(data={k: sample_value(expected)})
     assert isinstance(response, CouchError) is False
 
   with pytest.raises(InvalidKeysException):
@@ -305,8 +312,8 @@ def test_get_replication_updates(httpserver: HTTPServer):
     assert isinstance(response, CouchError) is True
 
   httpserver.expect_request("/_scheduler/jobs",  method="GET").respond_with_json({})
-  for k in AllowedKeys.SERVER__SCHEDULER_JOBS__PARAMS:
-    response = couch.server.get_replication_updates(params={k: ['test']})
+  for k, expected in AllowedKeys.SERVER__SCHEDULER_JOBS__PARAMS.items():
+    response = couch.server.get_replication_updates(params={k: sample_value(expected)})
     assert isinstance(response, CouchError) is False
 
   with pytest.raises(InvalidKeysException):
@@ -345,8 +352,8 @@ def test_get_replication_docs(httpserver: HTTPServer):
     assert isinstance(response, CouchError) is True
 
   httpserver.expect_request("/_scheduler/docs",  method="GET").respond_with_json({})
-  for k in AllowedKeys.SERVER__SCHEDULER_DOCS__PARAMS:
-    response = couch.server.get_replication_docs(params={k: ['test']})
+  for k, expected in AllowedKeys.SERVER__SCHEDULER_DOCS__PARAMS.items():
+    response = couch.server.get_replication_docs(params={k: sample_value(expected)})
     assert isinstance(response, CouchError) is False
 
   with pytest.raises(InvalidKeysException):
@@ -385,8 +392,8 @@ def test_get_replicator_docs(httpserver: HTTPServer):
     assert isinstance(response, CouchError) is True
 
   httpserver.expect_request("/_scheduler/docs/other/_replicator",  method="GET").respond_with_json({})
-  for k in AllowedKeys.SERVER__SCHEDULER_DOCS__PARAMS:
-    response = couch.server.get_replicator_docs(uri_segments={'db': 'other'}, params={k: ['test']})
+  for k, expected in AllowedKeys.SERVER__SCHEDULER_DOCS__PARAMS.items():
+    response = couch.server.get_replicator_docs(uri_segments={'db': 'other'}, params={k: sample_value(expected)})
     assert isinstance(response, CouchError) is False
 
   with pytest.raises(InvalidKeysException):
@@ -473,8 +480,10 @@ def test_get_node_server_stat(httpserver: HTTPServer):
   response = couch.server.get_node_server_stat(uri_segments={'node_name': '_local', 'stat': 'couchdb/request_time'})
   assert response == expected_json
 
-  response = couch.server.get_node_server_stat()
-  assert response == expected_json
+  # segments passed to one call are not kept for the next one
+  with pytest.raises(Exception, match='stat'):
+    couch.server.get_node_server_stat()
+  assert couch.server._predefined_segments == {'node_name': '_local'}
 
 
 def test_get_node_system_stats(httpserver: HTTPServer):
@@ -624,8 +633,8 @@ def test_generate_uiids(httpserver: HTTPServer):
     assert isinstance(response, CouchError) is True
 
   httpserver.expect_request("/_uuids",  method="GET").respond_with_json(expected_json)
-  for k in AllowedKeys.SERVER__UUIDS__PARAMS:
-    response = couch.server.generate_uuids(params={k: ['test']})
+  for k, expected in AllowedKeys.SERVER__UUIDS__PARAMS.items():
+    response = couch.server.generate_uuids(params={k: sample_value(expected)})
     assert isinstance(response, CouchError) is False
 
   with pytest.raises(InvalidKeysException):
@@ -1,7 +1,14 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
 
 from relaxed import CouchDB, CouchError
+from relaxed.scheduler import Scheduler, shared_scheduler
 from relaxed.session import Session
 
 
@@ -84,21 +91,118 @@ def test_authenticate_via_proxy(httpserver: HTTPServer):
   assert False
 
 def test_keep_alive(httpserver: HTTPServer):
+  scheduler = shared_scheduler()
+  jobs = len(scheduler)
   session = Session(keep_alive=300, auth_token='cm9vdDo1MEJCRkYwMjq0LO0ylOIwShrgt8y-UkhI-c6BGw')
   session.keep_alive(True)
-  assert 1 == len(session._keep_alive_timeloop.jobs)
+  assert jobs + 1 == len(scheduler)
 
   # only 1 keep alive is allowed
   session.keep_alive(True)
-  assert 1 == len(session._keep_alive_timeloop.jobs)
+  assert jobs + 1 == len(scheduler)
 
   # keep alive should not work without an auth token
   session.auth_token = None
   session.keep_alive(True)
-  assert 1 == len(session._keep_alive_timeloop.jobs)
+  assert jobs + 1 == len(scheduler)
 
   session.keep_alive(False)
-  assert 1 == len(session._keep_alive_timeloop.jobs)
+  assert jobs == len(scheduler)
+
+def test_keep_alive_shares_one_thread():
+  scheduler = Scheduler()
+  calls = []
+
+  class Client():
+    def renew_session(self):
+      calls.append(self)
+
+  clients = [Client() for _ in range(0, 20)]
+  for client in clients:
+    scheduler.schedule(client.renew_session, 0.05)
+  threads = threading.active_count()
+  time.sleep(0.2)
+
+  assert threads == threading.active_count()
+  assert len(set(calls)) == 20
+
+  # jobs of collected clients are dropped
+  del clients, client, calls[:]
+  time.sleep(0.2)
+  assert 0 == len(scheduler)
+
+def test_reauthenticates_once_on_concurrent_401(httpserver: HTTPServer):
+  stale = 'cm9vdDo1MEJCRkYwMjq0LO0ylOIwShrgt8y-UkhI-c6BGw'  # root:50BBFF02:...
+  fresh = 'cm9vdDo1MEJCRkYwMzq0LO0ylOIwShrgt8y-UkhI-c6BGw'  # root:50BBFF03:...
+  logins = []
+
+  def login(request):
+    logins.append(request)
+    return Response(json.dumps({'ok': True}), headers={'Set-Cookie': f'AuthSession={fresh}; Version=1; Path=/; HttpOnly'},
+                    content_type='application/json')
+
+  def all_dbs(request):
+    if request.cookies.get('AuthSession') != fresh:
+      return Response(json.dumps({'error': 'unauthorized', 'reason': 'expired'}), status=401, content_type='application/json')
+    return Response(json.dumps(['db']), content_type='application/json')
+
+  httpserver.expect_request('/_session', method='POST').respond_with_handler(login)
+  httpserver.expect_request('/_all_dbs', method='GET').respond_with_handler(all_dbs)
+
+  couch = CouchDB(username='root', password='secret', host='http://127.0.0.1', port=8000, auth_token=stale)
+  with ThreadPoolExecutor(max_workers=4) as executor:
+    results = list(executor.map(lambda _: couch.server.get_database_names(), range(0, 8)))
+
+  assert all(result == ['db'] for result in results)
+  assert 1 == len(logins)
+  assert couch.session.auth_token == fresh
+
+def test_stale_token_is_kept_until_the_new_one_replaces_it(httpserver: HTTPServer):
+  stale = 'cm9vdDo1MEJCRkYwMjq0LO0ylOIwShrgt8y-UkhI-c6BGw'  # root:50BBFF02:...
+  skewed = 'cm9vdDo1MEJCRkYwMToBOgJhYmM'  # root:50BBFF01:<hmac holding colons>, issued by a node running behind
+  tokens_during_login = []
+
+  def login(request):
+    tokens_during_login.append(couch.session.auth_token)
+    return Response(json.dumps({'ok': True}), headers={'Set-Cookie': f'AuthSession={skewed}; Version=1; Path=/; HttpOnly'},
+                    content_type='application/json')
+
+  def all_dbs(request):
+    if request.cookies.get('AuthSession') != skewed:
+      return Response(json.dumps({'error': 'unauthorized', 'reason': 'expired'}), status=401, content_type='application/json')
+    return Response(json.dumps(['db']), content_type='application/json')
+
+  httpserver.expect_request('/_session', method='POST').respond_with_handler(login)
+  httpserver.expect_request('/_all_dbs', method='GET').respond_with_handler(all_dbs)
+
+  couch = CouchDB(username='root', password='secret', host='http://127.0.0.1', port=8000, auth_token=stale)
+  assert couch.server.get_database_names() == ['db']
+  # concurrent requests never go out without a cookie
+  assert tokens_during_login == [stale]
+  assert couch.session.auth_token == skewed
+
+def test_401_without_credentials_is_returned(httpserver: HTTPServer):
+  httpserver.expect_request('/_all_dbs', method='GET').respond_with_json({'error': 'unauthorized'}, status=401)
+
+  couch = CouchDB(host='http://127.0.0.1', port=8000, auth_token='abc')
+  response = couch.server.get_database_names()
+  assert isinstance(response, CouchError)
+  assert response.status_code == 401
+
+def test_older_auth_cookie_is_ignored():
+  newer = 'cm9vdDo1MEJCRkYwMzq0LO0ylOIwShrgt8y-UkhI-c6BGw'
+  older = 'cm9vdDo1MEJCRkYwMjq0LO0ylOIwShrgt8y-UkhI-c6BGw'
+  session = Session(auth_token=newer)
+
+  session.set_auth_token_from_headers({'Set-Cookie': f'AuthSession={older}; Version=1; Path=/; HttpOnly'})
+  assert session.auth_token == newer
+
+  session.set_auth_token_from_headers({'Set-Cookie': 'OtherCookie=value; Path=/'})
+  assert session.auth_token == newer
+
+  # root:50BBFF01: followed by hmac bytes holding colons
+  session.set_auth_token_from_headers({'Set-Cookie': 'AuthSession=cm9vdDo1MEJCRkYwMToBOgJhYmM; Path=/'})
+  assert session.auth_token == newer
 
 def test_create_basic_auth_header(httpserver: HTTPServer):
   session = Session(username="test", password="test")
@@ -0,0 +1,186 @@
+import json
+import time
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from relaxed import CouchDB, CouchError
+from relaxed.streaming import ChangesFeed
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, db='testdb')
+  yield
+
+
+NORMAL_FEED = (b'{"results":[\n'
+               b'{"seq":"1-a","id":"doc1","changes":[{"rev":"1-x"}]},\n'
+               b'{"seq":"2-b","id":"doc2","changes":[{"rev":"1-y"}]}\n'
+               b'],\n'
+               b'"last_seq":"2-b","pending":0}\n')
+
+
+def test_iter_changes_parses_a_normal_feed_line_by_line(httpserver: HTTPServer):
+  httpserver.expect_oneshot_request("/testdb/_changes", method="GET", query_string={'since': '0', 'feed': 'normal'}).respond_with_data(NORMAL_FEED)
+
+  feed = couch.db.iter_changes(feed='normal')
+  assert isinstance(feed, ChangesFeed)
+  assert [change['id'] for change in feed] == ['doc1', 'doc2']
+  assert feed.last_seq == '2-b'
+  assert feed.pending == 0
+
+
+def test_iter_changes_parses_a_compact_normal_feed(httpserver: HTTPServer):
+  body = b'{"results":[{"seq":"1-a","id":"doc1","changes":[]}],"last_seq":"1-a","pending":3}'
+  httpserver.expect_oneshot_request("/testdb/_changes", method="GET").respond_with_data(body)
+
+  feed = couch.db.iter_changes(feed='normal')
+  assert [change['id'] for change in feed] == ['doc1']
+  assert feed.pending == 3
+
+
+def test_iter_changes_skips_heartbeats_and_reconnects_from_last_seq(httpserver: HTTPServer):
+  first = (b'{"seq":"1-a","id":"doc1","changes":[]}\n'
+           b'\n'
+           b'{"seq":"2-b","id":"doc2","changes":[]}\n'
+           b'\n')
+  second = (b'{"seq":"3-c","id":"doc3","changes":[]}\n'
+            b'{"last_seq":"3-c","pending":0}\n')
+  httpserver.expect_oneshot_request("/testdb/_changes", method="GET",
+                                    query_string={'since': 'now', 'feed': 'continuous', 'heartbeat': '5000', 'include_docs': 'true'}).respond_with_data(first)
+  httpserver.expect_oneshot_request("/testdb/_changes", method="GET",
+                                    query_string={'since': '2-b', 'feed': 'continuous', 'heartbeat': '5000', 'include_docs': 'true'}).respond_with_data(second)
+
+  feed = couch.db.iter_changes(since='now', feed='continuous', heartbeat=5000, include_docs=True, reconnect_delay=0)
+  changes = [next(feed) for k in range(0, 3)]
+  feed.close()
+
+  assert [change['id'] for change in changes] == ['doc1', 'doc2', 'doc3']
+  assert feed.heartbeats == 2
+  assert feed.last_seq == '3-c'
+
+
+def test_iter_changes_reports_errors(httpserver: HTTPServer):
+  httpserver.expect_oneshot_request("/testdb/_changes", method="GET").respond_with_json({"error": "not_found", "reason": "missing"}, status=404)
+
+  response = couch.db.iter_changes(feed='normal')
+  assert isinstance(response, CouchError) is True
+  assert response.status_code == 404
+
+
+def test_iter_changes_stops_when_reconnect_is_refused(httpserver: HTTPServer):
+  httpserver.expect_oneshot_request("/testdb/_changes", method="GET", query_string={'since': '0', 'feed': 'longpoll', 'heartbeat': '10000'}).respond_with_data(NORMAL_FEED)
+  httpserver.expect_oneshot_request("/testdb/_changes", method="GET").respond_with_json({"error": "unauthorized", "reason": "expired"}, status=401)
+
+  feed = couch.db.iter_changes(feed='longpoll', reconnect_delay=0)
+  assert [change['id'] for change in feed] == ['doc1', 'doc2']
+  assert feed.error.status_code == 401
+
+
+ALL_DOCS = (b'{"total_rows":3,"offset":0,"rows":[\r\n'
+            b'{"id":"a","key":"a","value":{"rev":"1-x"},"doc":{"_id":"a","text":"with \\"quotes\\" and ]} brackets"}},\r\n'
+            b'{"id":"b","key":"b","value":{"rev":"1-y"}},\r\n'
+            b'{"id":"c","key":"c","value":{"rev":"1-z"}}\r\n'
+            b'],\r\n"update_seq":"7-g"}\n')
+
+
+def test_iter_docs_yields_rows_as_they_are_parsed(httpserver: HTTPServer):
+  httpserver.expect_oneshot_request("/testdb/_all_docs", method="GET", query_string={'include_docs': 'true'}).respond_with_data(ALL_DOCS)
+
+  rows = couch.db.iter_docs(params={'include_docs': 'true'}, chunk_size=7)
+  assert rows.total_rows is None
+
+  first = next(rows)
+  assert first['doc']['text'] == 'with "quotes" and ]} brackets'
+  assert rows.total_rows == 3
+  assert rows.offset == 0
+  assert rows.update_seq is None
+
+  assert [row['id'] for row in rows] == ['b', 'c']
+  assert rows.update_seq == '7-g'
+
+
+def test_iter_view_and_design_docs_use_their_endpoints(httpserver: HTTPServer):
+  httpserver.expect_oneshot_request("/testdb/_design/ddoc/_view/by_key", method="GET").respond_with_data(b'{"total_rows":1,"offset":0,"rows":[{"id":"a","key":1,"value":2}]}')
+  httpserver.expect_oneshot_request("/testdb/_design_docs", method="GET").respond_with_data(b'{"total_rows":0,"offset":0,"rows":[]}')
+
+  assert list(couch.db.iter_view(uri_segments={'docid': 'ddoc', 'view': 'by_key'})) == [{"id": "a", "key": 1, "value": 2}]
+  assert list(couch.db.iter_design_docs()) == []
+
+
+def test_iter_docs_reports_errors(httpserver: HTTPServer):
+  httpserver.expect_oneshot_request("/testdb/_all_docs", method="GET").respond_with_json({"error": "not_found", "reason": "missing"}, status=404)
+
+  response = couch.db.iter_docs()
+  assert isinstance(response, CouchError) is True
+  assert response.status_code == 404
+
+
+def test_iter_docs_reports_errors_sent_after_rows(httpserver: HTTPServer):
+  httpserver.expect_oneshot_request("/testdb/_all_docs", method="GET").respond_with_data(b'{"total_rows":2,"offset":0,"rows":[{"id":"a"}],"error":"timeout","reason":"shard unavailable"}')
+
+  rows = couch.db.iter_docs()
+  assert list(rows) == [{"id": "a"}]
+  assert rows.error.error == 'timeout'
+  assert rows.error.reason == 'shard unavailable'
+
+
+class FindHandler():
+  """ serves three pages of a Mango query, keyed by bookmark."""
+
+  pages = {None: (['a', 'b'], 'bm1'), 'bm1': (['c', 'd'], 'bm2'), 'bm2': (['e'], 'bm3')}
+
+  def __init__(self):
+    self.bookmarks = []
+
+  def __call__(self, request):
+    body = json.loads(request.data)
+    self.bookmarks.append(body.get('bookmark', None))
+    assert body['limit'] == 2
+    assert body['fields'] == ['_id']
+    ids, bookmark = self.pages[body.get('bookmark', None)]
+    result = {"docs": [{"_id": docid} for docid in ids], "bookmark": bookmark,
+              "execution_stats": {"total_keys_examined": 0, "total_docs_examined": 10, "results_returned": len(ids), "execution_time_ms": 1.5}}
+    return Response(json.dumps(result), content_type='application/json')
+
+
+def test_iter_find_follows_bookmarks_and_aggregates_stats(httpserver: HTTPServer):
+  handler = FindHandler()
+  httpserver.expect_request("/testdb/_find", method="POST").respond_with_handler(handler)
+
+  docs = couch.db.iter_find({"type": "invoice"}, fields=['_id'], page_size=2, execution_stats=True)
+  assert [doc['_id'] for doc in docs] == ['a', 'b', 'c', 'd', 'e']
+
+  assert handler.bookmarks == [None, 'bm1', 'bm2']
+  assert docs.pages == 3
+  assert docs.execution_stats == {"total_keys_examined": 0, "total_docs_examined": 30, "results_returned": 5, "execution_time_ms": 4.5}
+
+
+def test_iter_find_prefetches_the_next_page(httpserver: HTTPServer):
+  handler = FindHandler()
+  httpserver.expect_request("/testdb/_find", method="POST").respond_with_handler(handler)
+
+  docs = couch.db.iter_find({"type": "invoice"}, fields=['_id'], page_size=2)
+  next(docs)
+  deadline = time.time() + 5
+  while len(handler.bookmarks) < 2 and time.time() < deadline:
+    time.sleep(0.01)
+  assert handler.bookmarks == [None, 'bm1']
+  docs.close()
+
+
+def test_iter_find_stops_on_errors(httpserver: HTTPServer):
+  httpserver.expect_request("/testdb/_find", method="POST").respond_with_json({"error": "no_usable_index", "reason": "none"}, status=400)
+
+  docs = couch.db.iter_find({"type": "invoice"})
+  assert list(docs) == []
+  assert docs.error.status_code == 400
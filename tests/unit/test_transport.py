@@ -0,0 +1,67 @@
+import time
+
+import pytest
+from pytest_httpserver import HTTPServer
+
+from relaxed import CouchDB
+from relaxed.session import Session
+from relaxed.transport import Transport
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+def test_components_share_the_session_transport(httpserver: HTTPServer):
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000)
+
+  assert couch.server.session.transport is couch.session.transport
+  assert couch.db.session.transport is couch.session.transport
+  assert couch.user.session.transport is couch.session.transport
+
+
+def test_transport_configuration_is_taken_from_session_kwargs(httpserver: HTTPServer):
+  session = Session(pool_connections=2, pool_maxsize=32, pool_block=True, idle_timeout=15)
+
+  assert session.transport.pool_connections == 2
+  assert session.transport.pool_maxsize == 32
+  assert session.transport.pool_block is True
+  assert session.transport.idle_timeout == 15
+  assert session.transport._adapter._pool_maxsize == 32
+
+  transport = Transport()
+  assert Session(transport=transport).transport is transport
+
+
+def test_transport_counts_requests_and_connections(httpserver: HTTPServer):
+  httpserver.expect_request("/",  method="GET").respond_with_json({"couchdb": "Welcome"})
+  couch = CouchDB(host="http://127.0.0.1", port=8000)
+
+  for k in range(0, 3):
+    couch.server.get_info()
+
+  stats = couch.session.transport_stats
+  assert stats.requests == 3
+  assert 1 <= stats.connections <= 3
+  assert stats.reused == stats.requests - stats.connections
+  assert stats.as_dict()['requests'] == 3
+
+
+def test_transport_discards_idle_connections(httpserver: HTTPServer):
+  httpserver.expect_request("/",  method="GET").respond_with_json({"couchdb": "Welcome"})
+  couch = CouchDB(host="http://127.0.0.1", port=8000, idle_timeout=0.01)
+
+  couch.server.get_info()
+  time.sleep(0.05)
+  couch.server.get_info()
+
+  assert couch.session.transport_stats.idle_resets == 1
+
+
+def test_transport_does_not_persist_auth_cookies(httpserver: HTTPServer):
+  httpserver.expect_request("/_session",  method="POST").respond_with_json({"ok": True}, headers={'Set-Cookie': 'AuthSession=cm9vdDo1MEJCRkYwMjq0LO0ylOIwShrgt8y-UkhI-c6BGw; Version=1; Path=/; HttpOnly'})
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000, auto_connect=True)
+
+  assert couch.session.auth_token == 'cm9vdDo1MEJCRkYwMjq0LO0ylOIwShrgt8y-UkhI-c6BGw'
+  assert len(couch.session.transport._session.cookies) == 0
@@ -0,0 +1,134 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pytest_httpserver import HTTPServer
+from werkzeug.wrappers import Response
+
+from relaxed import CouchDB, CouchError, UUIDPool
+
+
+@pytest.fixture
+def httpserver_listen_address():
+    return ("127.0.0.1", 8000)
+
+
+@pytest.fixture(autouse=True)
+def setup():
+  """ setup any state specific to the execution of the given module."""
+  global couch
+  couch = CouchDB(username="test", password="test", host="http://127.0.0.1", port=8000)
+  yield
+
+
+def serve_uuids(httpserver, counts):
+  lock = threading.Lock()
+  issued = [0]
+
+  def uuids(request):
+    count = int(request.args['count'])
+    counts.append(count)
+    with lock:
+      start = issued[0]
+      issued[0] += count
+    return Response(json.dumps({'uuids': [f'{n:032x}' for n in range(start, start + count)]}),
+                    content_type='application/json')
+  httpserver.expect_request('/_uuids', method='GET').respond_with_handler(uuids)
+
+
+def test_ids_come_from_server_batches(httpserver: HTTPServer):
+  counts = []
+  serve_uuids(httpserver, counts)
+  pool = UUIDPool(server=couch.server, batch_size=10, low_water=0)
+
+  ids = [pool.get() for _ in range(0, 10)] + pool.take(15)
+  assert ids == [f'{n:032x}' for n in range(0, 25)]
+  assert counts == [10, 10, 10]
+  assert pool.requests == 3
+
+
+def test_refills_in_the_background_below_low_water(httpserver: HTTPServer):
+  counts = []
+  serve_uuids(httpserver, counts)
+  pool = UUIDPool(server=couch.server, batch_size=10, low_water=5)
+
+  pool.take(6)
+  for _ in range(0, 100):
+    with pool._condition:
+      if not pool._refilling:
+        break
+    threading.Event().wait(0.01)
+
+  assert counts == [10, 10]
+  assert len(pool._ids) == 14
+
+
+def test_concurrent_callers_get_unique_ids(httpserver: HTTPServer):
+  serve_uuids(httpserver, [])
+  pool = UUIDPool(server=couch.server, batch_size=50)
+
+  with ThreadPoolExecutor(max_workers=8) as executor:
+    ids = [uuid for batch in executor.map(lambda _: pool.take(7), range(0, 40)) for uuid in batch]
+  assert len(ids) == 280 and len(set(ids)) == 280
+
+
+def test_failed_refill_returns_couch_error(httpserver: HTTPServer):
+  httpserver.expect_request('/_uuids', method='GET').respond_with_json({'error': 'unauthorized'}, status=401)
+  pool = UUIDPool(server=couch.server)
+
+  assert isinstance(pool.get(), CouchError)
+  assert isinstance(pool.error, CouchError)
+
+
+def test_local_sequential_ids_are_ordered():
+  pool = UUIDPool(algorithm='sequential')
+  ids = pool.take(1000)
+  assert all(len(uuid) == 32 for uuid in ids)
+  assert len(set(uuid[:26] for uuid in ids)) <= 2
+  assert ids == sorted(ids) or len(set(uuid[:26] for uuid in ids)) == 2
+
+
+def test_local_utc_ids_are_ordered():
+  now = [1500000000.0]
+  pool = UUIDPool(algorithm='utc_random', clock=lambda: now[0])
+  ids = pool.take(100)
+  assert ids == sorted(ids)
+  assert ids[0].startswith(f'{1500000000 * 1000000:014x}')
+  assert len(set(ids)) == 100 and all(len(uuid) == 32 for uuid in ids)
+
+  pool = UUIDPool(algorithm='utc_id', utc_id_suffix='-node1')
+  assert pool.get().endswith('-node1')
+  with pytest.raises(ValueError):
+    UUIDPool(algorithm='utc_id')
+  with pytest.raises(ValueError):
+    UUIDPool()
+
+
+def test_failed_refill_does_not_block_later_callers():
+  class Unreachable():
+    calls = 0
+
+    def generate_uuids(self, **kwargs):
+      Unreachable.calls += 1
+      raise ConnectionError('refused')
+
+  pool = UUIDPool(server=Unreachable())
+  results = []
+
+  def take():
+    try:
+      results.append(pool.take(1))
+    except ConnectionError as error:
+      results.append(error)
+
+  for _ in range(0, 2):
+    thread = threading.Thread(target=take)
+    thread.start()
+    thread.join(2)
+    assert not thread.is_alive()
+
+  assert len(results) == 2 and all(isinstance(result, ConnectionError) for result in results)
+  assert Unreachable.calls == 2
+  assert pool.error.error == 'connection_error'
+  assert not pool._refilling